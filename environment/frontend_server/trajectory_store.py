@@ -0,0 +1,182 @@
+"""
+File: trajectory_store.py
+Description: A columnar store of the personas' per-step movements, kept in
+a simulation's trajectory/ folder.
+
+Files:
+  personas.json  -- the persona names, in column order.
+  positions.bin  -- int16 array of shape (steps, personas, 2): the x, y tile
+                    of the "movement" of each persona at each step.
+  labels.bin     -- int32 array of shape (steps, personas, 3): the ids of the
+                    pronunciatio, description and chat of each persona at
+                    each step, in strings.jsonl.
+  strings.jsonl  -- the interned side table; line i holds the json encoded
+                    value whose id is i.
+
+Both arrays are memory-mapped when read, so a time range of trajectories
+can be sliced without parsing anything. Steps that were never written are
+filled with -1.
+
+Note: this file is kept identical in reverie/, reverie/backend_server/ and
+environment/frontend_server/, like global_methods.py.
+"""
+import json
+import os
+
+import numpy
+
+LABEL_KEYS = ["pronunciatio", "description", "chat"]
+
+
+class TrajectoryStore:
+  def __init__(self, folder, persona_names=None):
+    # <folder> is the folder the store lives in, e.g., storage/<sim>/trajectory
+    # <persona_names> is only needed when creating a new store.
+    self.folder = folder
+    f_personas = f"{folder}/personas.json"
+    if os.path.exists(f_personas):
+      with open(f_personas) as json_file:
+        self.persona_names = json.load(json_file)
+    else:
+      self.persona_names = list(persona_names)
+      os.makedirs(folder, exist_ok=True)
+      with open(f_personas, "w") as outfile:
+        outfile.write(json.dumps(self.persona_names, indent=2))
+    self.persona_index = {name: i for i, name in enumerate(self.persona_names)}
+
+    # <strings> is the side table (id -> json encoded value), and
+    # <string_ids> its reverse.
+    self.strings = []
+    self.string_ids = dict()
+    f_strings = f"{folder}/strings.jsonl"
+    if os.path.exists(f_strings):
+      with open(f_strings) as strings_file:
+        for line in strings_file:
+          if not line.endswith("\n"):
+            break
+          encoded = json.loads(line)
+          self.string_ids[encoded] = len(self.strings)
+          self.strings += [encoded]
+
+
+  def _intern(self, value, strings_file):
+    encoded = json.dumps(value)
+    if encoded not in self.string_ids:
+      self.string_ids[encoded] = len(self.strings)
+      self.strings += [encoded]
+      strings_file.write(json.dumps(encoded) + "\n")
+    return self.string_ids[encoded]
+
+
+  def get_num_steps(self):
+    """
+    Returns the number of steps in the store (including unwritten steps
+    before the last written one).
+    """
+    f_positions = f"{self.folder}/positions.bin"
+    if not os.path.exists(f_positions):
+      return 0
+    row_bytes = len(self.persona_names) * 2 * 2
+    return os.path.getsize(f_positions) // row_bytes
+
+
+  def append(self, step, movements, count=1):
+    """
+    Writes the movements of <step> to the store.
+    ARGS:
+      step: the step the movements are for.
+      movements: the movements dictionary the backend sends to the frontend,
+                 i.e., {"persona": {<name>: {"movement": [x, y],
+                 "pronunciatio": ..., "description": ..., "chat": ...}}}
+      count: the number of steps from <step> on that the same movements
+             are written for.
+    RETURNS:
+      None
+    """
+    num_personas = len(self.persona_names)
+    positions = numpy.full((num_personas, 2), -1, dtype=numpy.int16)
+    labels = numpy.full((num_personas, 3), -1, dtype=numpy.int32)
+
+    with open(f"{self.folder}/strings.jsonl", "a") as strings_file:
+      for name, movement in movements["persona"].items():
+        if name not in self.persona_index:
+          continue
+        i = self.persona_index[name]
+        positions[i] = movement["movement"]
+        for j, key in enumerate(LABEL_KEYS):
+          labels[i, j] = self._intern(movement[key], strings_file)
+
+    num_steps = self.get_num_steps()
+    for f_name, row in [("positions.bin", positions), ("labels.bin", labels)]:
+      f_array = f"{self.folder}/{f_name}"
+      with open(f_array, "r+b" if os.path.exists(f_array) else "wb") as outfile:
+        # Steps we skipped over are filled with -1.
+        if step > num_steps:
+          outfile.seek(num_steps * row.nbytes)
+          outfile.write(numpy.full_like(row, -1).tobytes() * (step - num_steps))
+        outfile.seek(step * row.nbytes)
+        outfile.write(row.tobytes() * count)
+
+
+  def get_positions(self, start=0, end=None):
+    """
+    Returns the memory-mapped int16 array of shape (end - start, personas, 2)
+    with the x, y tile of each persona for the steps in [start, end).
+    """
+    return self._get_array("positions.bin", numpy.int16, 2)[start:end]
+
+
+  def get_labels(self, start=0, end=None):
+    """
+    Returns the memory-mapped int32 array of shape (end - start, personas, 3)
+    with the pronunciatio, description and chat ids of each persona for the
+    steps in [start, end). Use get_string to look the ids up.
+    """
+    return self._get_array("labels.bin", numpy.int32, 3)[start:end]
+
+
+  def get_string(self, string_id):
+    """
+    Returns the value (pronunciatio, description or chat) with <string_id>.
+    """
+    return json.loads(self.strings[string_id])
+
+
+  def _get_array(self, f_name, dtype, width):
+    num_steps = self.get_num_steps()
+    shape = (num_steps, len(self.persona_names), width)
+    if num_steps == 0:
+      return numpy.zeros(shape, dtype=dtype)
+    return numpy.memmap(f"{self.folder}/{f_name}", dtype=dtype, mode="r",
+                        shape=shape)
+
+
+  def get_movement_changes(self, start=0, end=None):
+    """
+    Returns the movements of the steps in [start, end) in the form of
+    compress_sim_storage's master_movement: {step: {<name>: {"movement": ...,
+    "pronunciatio": ..., "description": ..., "chat": ...}}}, where the first
+    step holds every persona and each later step only holds the personas
+    whose movement changed since the step before.
+    """
+    positions = self.get_positions(start, end)
+    labels = self.get_labels(start, end)
+    if len(positions) == 0:
+      return dict()
+
+    # <changed> is True where a persona's position or labels differ from
+    # the step before. The first step counts as changed for everyone.
+    changed = numpy.ones(positions.shape[:2], dtype=bool)
+    changed[1:] = ((positions[1:] != positions[:-1]).any(axis=2)
+                   | (labels[1:] != labels[:-1]).any(axis=2))
+    # Steps that were never written are left out.
+    changed &= positions[:, :, 0] != -1
+
+    all_movement = {start + i: dict() for i in range(len(positions))}
+    for i, p in zip(*numpy.nonzero(changed)):
+      all_movement[start + int(i)][self.persona_names[p]] = {
+        "movement": positions[i, p].tolist(),
+        "pronunciatio": self.get_string(labels[i, p, 0]),
+        "description": self.get_string(labels[i, p, 1]),
+        "chat": self.get_string(labels[i, p, 2])}
+    return all_movement
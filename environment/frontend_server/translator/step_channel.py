@@ -0,0 +1,78 @@
+"""
+File: step_channel.py
+Description: The frontend end of the local message channel between the
+frontend server and the backend server (see reverie/backend_server/
+step_channel.py for the backend end). Both ends must agree on
+STEP_CHANNEL_ADDRESS and STEP_CHANNEL_KEY_FILE, the file in temp_storage
+the backend writes the key of its current run to.
+
+Every function here returns None when the backend cannot be reached through
+the channel, in which case the caller falls back to the per-step files.
+"""
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+
+STEP_CHANNEL_ADDRESS = ("localhost", 8765)
+STEP_CHANNEL_KEY_FILE = "step_channel_key"
+
+
+def _request(message):
+  # The key changes with every run of the backend, so we read it anew.
+  try:
+    with open(f"temp_storage/{STEP_CHANNEL_KEY_FILE}") as infile:
+      authkey = bytes.fromhex(infile.read().strip())
+  except (OSError, ValueError):
+    return None
+
+  try:
+    with Client(STEP_CHANNEL_ADDRESS, authkey=authkey) as conn:
+      conn.send(message)
+      response = conn.recv()
+  except (OSError, EOFError, AuthenticationError):
+    return None
+
+  if not response.get("ok"):
+    return None
+  return response
+
+
+def send_environment(sim_code, step, environment):
+  """
+  Pushes the environment of <step> to the backend.
+
+  ARGS:
+    sim_code: The current simulation code.
+    step: The current step.
+    environment: The persona locations, keyed by persona name.
+  RETURNS:
+    True if the backend received it; None otherwise.
+  """
+  response = _request({"type": "environment",
+                       "sim_code": sim_code,
+                       "step": step,
+                       "environment": environment})
+  if response is None:
+    return None
+  return True
+
+
+def wait_for_movement(sim_code, step, timeout):
+  """
+  Waits up to <timeout> seconds for the backend to finish computing the
+  movements of <step>.
+
+  ARGS:
+    sim_code: The current simulation code.
+    step: The current step.
+    timeout: The number of seconds the backend may hold the request.
+  RETURNS:
+    The movements dictionary; None if it is not ready yet or the backend
+    cannot be reached through the channel.
+  """
+  response = _request({"type": "movement",
+                       "sim_code": sim_code,
+                       "step": step,
+                       "timeout": timeout})
+  if response is None:
+    return None
+  return response["movement"]
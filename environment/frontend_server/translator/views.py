@@ -13,9 +13,16 @@ import datetime
 from django.shortcuts import render, redirect, HttpResponseRedirect
 from django.http import HttpResponse, JsonResponse
 from global_methods import *
+from step_log import StepLog
+from trajectory_store import TrajectoryStore
 
 from django.contrib.staticfiles.templatetags.staticfiles import static
 from .models import *
+from .step_channel import send_environment, wait_for_movement
+
+# <MOVEMENT_WAIT> is the number of seconds update_environment holds a request
+# open while the backend is still computing the movements of the step.
+MOVEMENT_WAIT = 5
 
 def landing(request): 
   context = {}
@@ -25,6 +32,7 @@ def landing(request):
 
 def demo(request, sim_code, step, play_speed="2"): 
   move_file = f"compressed_storage/{sim_code}/master_movement.json"
+  trajectory_folder = f"compressed_storage/{sim_code}/trajectory"
   meta_file = f"compressed_storage/{sim_code}/meta.json"
   step = int(step)
   play_speed_opt = {"1": 1, "2": 2, "3": 4,
@@ -44,16 +52,22 @@ def demo(request, sim_code, step, play_speed="2"):
     start_datetime += datetime.timedelta(seconds=sec_per_step)
   start_datetime = start_datetime.strftime("%Y-%m-%dT%H:%M:%S")
 
-  # Loading the movement file
+  # Loading the movement file. If the simulation was compressed with its 
+  # trajectory store, we only read the steps from <step> onward from it. 
   raw_all_movement = dict()
-  with open(move_file) as json_file: 
-    raw_all_movement = json.load(json_file)
+  if os.path.exists(trajectory_folder): 
+    trajectory = TrajectoryStore(trajectory_folder)
+    all_p = trajectory.persona_names
+  else: 
+    with open(move_file) as json_file: 
+      raw_all_movement = json.load(json_file)
+    all_p = list(raw_all_movement["0"].keys())
  
   # Loading all names of the personas
   persona_names = dict()
   persona_names = []
   persona_names_set = set()
-  for p in list(raw_all_movement["0"].keys()): 
+  for p in all_p: 
     persona_names += [{"original": p, 
                        "underscore": p.replace(" ", "_"), 
                        "initial": p[0] + p.split(" ")[-1][0]}]
@@ -65,24 +79,31 @@ def demo(request, sim_code, step, play_speed="2"):
   # information in one step. 
   all_movement = dict()
 
-  # Preparing the initial step. 
-  # <init_prep> sets the locations and descriptions of all agents at the
-  # beginning of the demo determined by <step>. 
-  init_prep = dict() 
-  for int_key in range(step+1): 
-    key = str(int_key)
-    val = raw_all_movement[key]
+  if os.path.exists(trajectory_folder): 
+    # The first step of get_movement_changes already holds every persona.
+    all_movement = trajectory.get_movement_changes(step)
+    persona_init_pos = dict()
+    for p in persona_names_set: 
+      persona_init_pos[p.replace(" ","_")] = all_movement[step][p]["movement"]
+  else: 
+    # Preparing the initial step. 
+    # <init_prep> sets the locations and descriptions of all agents at the
+    # beginning of the demo determined by <step>. 
+    init_prep = dict() 
+    for int_key in range(step+1): 
+      key = str(int_key)
+      val = raw_all_movement[key]
+      for p in persona_names_set: 
+        if p in val: 
+          init_prep[p] = val[p]
+    persona_init_pos = dict()
     for p in persona_names_set: 
-      if p in val: 
-        init_prep[p] = val[p]
-  persona_init_pos = dict()
-  for p in persona_names_set: 
-    persona_init_pos[p.replace(" ","_")] = init_prep[p]["movement"]
-  all_movement[step] = init_prep
+      persona_init_pos[p.replace(" ","_")] = init_prep[p]["movement"]
+    all_movement[step] = init_prep
 
-  # Finish loading <all_movement>
-  for int_key in range(step+1, len(raw_all_movement.keys())): 
-    all_movement[int_key] = raw_all_movement[str(int_key)]
+    # Finish loading <all_movement>
+    for int_key in range(step+1, len(raw_all_movement.keys())): 
+      all_movement[int_key] = raw_all_movement[str(int_key)]
 
   context = {"sim_code": sim_code,
              "step": step,
@@ -128,17 +149,11 @@ def home(request):
       persona_names_set.add(x)
 
   persona_init_pos = []
-  file_count = []
-  for i in find_filenames(f"storage/{sim_code}/environment", ".json"):
-    x = i.split("/")[-1].strip()
-    if x[0] != ".": 
-      file_count += [int(x.split(".")[0])]
-  curr_json = f'storage/{sim_code}/environment/{str(max(file_count))}.json'
-  with open(curr_json) as json_file:  
-    persona_init_pos_dict = json.load(json_file)
-    for key, val in persona_init_pos_dict.items(): 
-      if key in persona_names_set: 
-        persona_init_pos += [[key, val["x"], val["y"]]]
+  environment_log = StepLog(f"storage/{sim_code}/environment")
+  persona_init_pos_dict = environment_log.read(environment_log.last_step())
+  for key, val in persona_init_pos_dict.items(): 
+    if key in persona_names_set: 
+      persona_init_pos += [[key, val["x"], val["y"]]]
 
   context = {"sim_code": sim_code,
              "step": step, 
@@ -162,17 +177,11 @@ def replay(request, sim_code, step):
       persona_names_set.add(x)
 
   persona_init_pos = []
-  file_count = []
-  for i in find_filenames(f"storage/{sim_code}/environment", ".json"):
-    x = i.split("/")[-1].strip()
-    if x[0] != ".": 
-      file_count += [int(x.split(".")[0])]
-  curr_json = f'storage/{sim_code}/environment/{str(max(file_count))}.json'
-  with open(curr_json) as json_file:  
-    persona_init_pos_dict = json.load(json_file)
-    for key, val in persona_init_pos_dict.items(): 
-      if key in persona_names_set: 
-        persona_init_pos += [[key, val["x"], val["y"]]]
+  environment_log = StepLog(f"storage/{sim_code}/environment")
+  persona_init_pos_dict = environment_log.read(environment_log.last_step())
+  for key, val in persona_init_pos_dict.items(): 
+    if key in persona_names_set: 
+      persona_init_pos += [[key, val["x"], val["y"]]]
 
   context = {"sim_code": sim_code,
              "step": step,
@@ -202,6 +211,17 @@ def replay_persona_state(request, sim_code, step, persona_name):
   with open(memory + "/associative_memory/nodes.json") as json_file:  
     associative = json.load(json_file)
 
+  # Nodes added since the backend last wrote nodes.json are in the journal.
+  journal = memory + "/associative_memory/journal.jsonl"
+  if check_if_file_exists(journal): 
+    with open(journal) as journal_file: 
+      for line in journal_file: 
+        try: 
+          node_details = json.loads(line)["node"]
+        except ValueError: 
+          break
+        associative[f"node_{str(node_details['node_count'])}"] = node_details
+
   a_mem_event = []
   a_mem_chat = []
   a_mem_thought = []
@@ -242,8 +262,9 @@ def process_environment(request):
   """
   <FRONTEND to BACKEND> 
   This sends the frontend visual world information to the backend server. 
-  It does this by writing the current environment representation to 
-  "storage/environment.json" file. 
+  It does this by pushing the current environment representation to the 
+  backend through the step channel, or, if the backend cannot be reached 
+  that way, by appending it to the "storage/<sim>/environment" step log. 
 
   ARGS:
     request: Django request
@@ -259,8 +280,10 @@ def process_environment(request):
   sim_code = data["sim_code"]
   environment = data["environment"]
 
-  with open(f"storage/{sim_code}/environment/{step}.json", "w") as outfile:
-    outfile.write(json.dumps(environment, indent=2))
+  if not send_environment(sim_code, step, environment): 
+    environment_log = StepLog(f"storage/{sim_code}/environment")
+    environment_log.append(step, environment)
+    environment_log.close()
 
   return HttpResponse("received")
 
@@ -270,8 +293,9 @@ def update_environment(request):
   <BACKEND to FRONTEND> 
   This sends the backend computation of the persona behavior to the frontend
   visual server. 
-  It does this by reading the new movement information from 
-  "storage/movement.json" file.
+  It does this by waiting (up to MOVEMENT_WAIT seconds) for the new movement
+  information on the step channel, or, if the backend cannot be reached that
+  way, by reading it from the "storage/<sim>/movement" step log.
 
   ARGS:
     request: Django request
@@ -287,10 +311,23 @@ def update_environment(request):
   sim_code = data["sim_code"]
 
   response_data = {"<step>": -1}
-  if (check_if_file_exists(f"storage/{sim_code}/movement/{step}.json")):
-    with open(f"storage/{sim_code}/movement/{step}.json") as json_file: 
-      response_data = json.load(json_file)
-      response_data["<step>"] = step
+  movement = wait_for_movement(sim_code, step, MOVEMENT_WAIT)
+  if not movement: 
+    movement = StepLog(f"storage/{sim_code}/movement").read(step)
+  if movement:
+    response_data = movement
+    response_data["<step>"] = step
+    # Steps the backend fast-forwarded through share one record, which
+    # carries the time of the first of them.
+    no_change = movement.get("meta", dict()).get("no_change")
+    if no_change:
+      curr_time = datetime.datetime.strptime(movement["meta"]["curr_time"],
+                                             "%B %d, %Y, %H:%M:%S")
+      curr_time += datetime.timedelta(seconds=no_change["sec_per_step"]
+                                       * (step - no_change["first_step"]))
+      response_data["meta"] = dict(movement["meta"])
+      response_data["meta"]["curr_time"] = curr_time.strftime(
+                                             "%B %d, %Y, %H:%M:%S")
 
   return JsonResponse(response_data)
 
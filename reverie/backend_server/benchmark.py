@@ -0,0 +1,303 @@
+"""
+File: benchmark.py
+Description: Measures how fast the backend simulates, in steps per second,
+with the LLM and embedding backends replaced by the local mock (see
+persona/prompt_template/mock_gpt_structure.py), so the numbers are
+deterministic and reflect Reverie's own cost.
+
+Each benchmarked simulation is forked from a base simulation into a scratch
+simulation, run headless for the requested number of steps, and deleted
+afterwards (unless --keep is given). The time spent in each stage of the
+personas' cognitive chain (and in the sub-stages under it, e.g., each
+generate_* function of plan) is reported alongside the throughput, from the
+instrumentation (see instrumentation.py), along with the hits and misses of
+the caches looked up in it (e.g., path_finder's path cache). The stage times of the personas
+are summed over the personas, so with more than one cognition worker (or
+persona process) they can add up to more than the wall time.
+
+Usage (from reverie/backend_server):
+  python benchmark.py --steps 100
+  python benchmark.py --steps 50 --workers 8 --latency 0.2 base_the_ville_n25
+  python benchmark.py --steps 1000 --fast-forward
+  python benchmark.py --steps 200 --processes 4 base_the_ville_n25
+  python benchmark.py --steps 200 --processes 4 --nodes base_the_ville_n25
+  python benchmark.py --steps 2500 --check-processes 3 base_the_ville_n25
+
+With --check-processes, nothing is timed; instead, each simulation is run
+with its personas' random generators seeded by their names, once serially 
+and once with the given number of persona processes, and the two runs' 
+movement and environment logs (and the sizes of the personas' associative
+memories) are compared step by step. The check fixes PYTHONHASHSEED (to 0,
+unless it is set) so that the server and the persona processes agree on the
+order of sets of strings.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import shutil
+import sys
+import time
+
+from utils import *
+from instrumentation import metrics
+from persona.prompt_template.async_gpt_structure import use_mock_backend
+from reverie import ReverieServer
+
+DEFAULT_SIMS = ["base_the_ville_isabella_maria_klaus", "base_the_ville_n25"]
+
+# <STAGES> are the stages of Persona.move (personas that are not due only
+# glance and execute; see cognition_scheduler.py), and <SERVER_STAGES> the
+# rest of a step in ReverieServer.start_server (see instrumentation.py).
+STAGES = ["glance", "perceive", "retrieve", "plan", "reflect", "execute"]
+SERVER_STAGES = ["update_maze", "move_personas", "write_movement", 
+                 "write_wal", "fast_forward"]
+
+
+def benchmark_sim(base_sim_code, steps, workers=1, keep=False, 
+                  fast_forward=False, processes=1, nodes=False):
+  """
+  Forks <base_sim_code> and runs it headless for <steps> steps.
+  ARGS:
+    base_sim_code: the simulation to fork from.
+    steps: the number of steps to run.
+    workers: the number of cognition workers (see ReverieServer).
+    keep: whether to keep the forked simulation afterwards.
+    fast_forward: whether to skip the steps in which nothing can change 
+      (see ReverieServer._get_quiet_steps).
+    processes: the number of persona processes (see persona_workers.py).
+    nodes: whether the persona processes are local worker nodes that talk
+      to the server over TCP, rather than child processes.
+  RETURNS:
+    A dictionary with the results.
+  """
+  timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+  sim_code = f"benchmark_{base_sim_code}_{timestamp}"
+
+  start = time.perf_counter()
+  rs = ReverieServer(base_sim_code, sim_code)
+  load_time = time.perf_counter() - start
+  rs.headless = True
+  rs.cognition_workers = workers
+  rs.fast_forward = fast_forward
+  rs.persona_processes = processes
+  if nodes:
+    rs.persona_nodes_address = ("localhost", 0)
+    rs.spawn_persona_nodes = True
+
+  metrics.reset()
+  metrics.enabled = True
+  try:
+    start = time.perf_counter()
+    rs.start_server(steps)
+    run_time = time.perf_counter() - start
+  finally:
+    metrics.enabled = False
+    rs.environment_log.close()
+    rs.movement_log.close()
+    if not keep:
+      shutil.rmtree(f"{fs_storage}/{sim_code}")
+
+  # The stages are summed over the personas.
+  stages = dict()
+  for (persona, stage), values in metrics.get_totals().items():
+    total = stages.setdefault(stage, dict())
+    for counter, value in values.items():
+      total[counter] = total.get(counter, 0) + value
+  return {"sim_code": base_sim_code,
+          "personas": len(rs.personas),
+          "steps": steps,
+          "workers": workers,
+          "processes": processes,
+          "nodes": nodes,
+          "fast_forward": fast_forward,
+          "load_sec": round(load_time, 3),
+          "run_sec": round(run_time, 3),
+          "steps_per_sec": round(steps / run_time, 3) if run_time else None,
+          "stages": stages,
+          "prometheus": metrics.to_prometheus()}
+
+
+def run_seeded_sim(base_sim_code, steps, processes=1, nodes=False):
+  """
+  Forks <base_sim_code>, seeds each persona's random generator with its 
+  name, runs it headless for <steps> steps, and deletes the fork.
+  ARGS:
+    base_sim_code: the simulation to fork from.
+    steps: the number of steps to run.
+    processes: the number of persona processes (see persona_workers.py).
+    nodes: whether the persona processes are local worker nodes.
+  RETURNS:
+    A dictionary with the "movement" and "environment" records of every 
+    step and the number of nodes in each persona's associative memory
+    ("memory").
+  """
+  timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+  sim_code = f"check_{base_sim_code}_{str(processes)}_{timestamp}"
+
+  rs = ReverieServer(base_sim_code, sim_code)
+  rs.headless = True
+  rs.persona_processes = processes
+  if nodes:
+    rs.persona_nodes_address = ("localhost", 0)
+    rs.spawn_persona_nodes = True
+  for persona_name, persona in rs.personas.items():
+    persona.rng.seed(persona_name)
+
+  try:
+    with contextlib.redirect_stdout(io.StringIO()):
+      rs.start_server(steps)
+    return {"movement": [rs.movement_log.read(step) 
+                         for step in rs.movement_log.steps()],
+            "environment": [rs.environment_log.read(step) 
+                            for step in rs.environment_log.steps()],
+            "memory": {persona_name: len(persona.a_mem.id_to_node)
+                       for persona_name, persona in rs.personas.items()}}
+  finally:
+    rs.environment_log.close()
+    rs.movement_log.close()
+    shutil.rmtree(f"{fs_storage}/{sim_code}")
+
+
+def check_processes(base_sim_code, steps, processes, nodes=False):
+  """
+  Checks that running <base_sim_code> with <processes> persona processes
+  produces the same logs as running it serially (see run_seeded_sim).
+  ARGS:
+    base_sim_code: the simulation to fork from.
+    steps: the number of steps to run.
+    processes: the number of persona processes to compare against.
+    nodes: whether the persona processes are local worker nodes.
+  RETURNS:
+    A dictionary with the result of the check; "identical" is True when
+    the logs and memory sizes match, and otherwise "first_diff_step" and 
+    "memory_diffs" say where they do not.
+  """
+  serial = run_seeded_sim(base_sim_code, steps)
+  pooled = run_seeded_sim(base_sim_code, steps, processes, nodes)
+
+  first_diff_step = None
+  for log in ["movement", "environment"]:
+    if len(serial[log]) != len(pooled[log]):
+      first_diff_step = min(len(serial[log]), len(pooled[log]))
+    for step, (a, b) in enumerate(zip(serial[log], pooled[log])):
+      if a != b:
+        if first_diff_step is None or step < first_diff_step:
+          first_diff_step = step
+        break
+  memory_diffs = {persona_name: (count, pooled["memory"][persona_name])
+                  for persona_name, count in serial["memory"].items()
+                  if count != pooled["memory"][persona_name]}
+  return {"sim_code": base_sim_code,
+          "steps": steps,
+          "processes": processes,
+          "nodes": nodes,
+          "chat_steps": sum(1 for record in serial["movement"]
+                            if any(i.get("chat") 
+                                   for i in record["persona"].values())),
+          "identical": first_diff_step is None and not memory_diffs,
+          "first_diff_step": first_diff_step,
+          "memory_diffs": memory_diffs}
+
+
+def print_check(result):
+  print(f"== {result['sim_code']} ({str(result['steps'])} steps, serial vs "
+        f"{str(result['processes'])} persona processes, "
+        f"{str(result['chat_steps'])} steps with chats)")
+  if result["identical"]:
+    print("   identical movement and environment logs and memories")
+    return
+  if result["first_diff_step"] is not None:
+    print(f"   logs differ from step {str(result['first_diff_step'])}")
+  for persona_name, (a, b) in result["memory_diffs"].items():
+    print(f"   {persona_name}: {str(a)} vs {str(b)} memory nodes")
+
+
+def print_result(result):
+  print(f"== {result['sim_code']} ({str(result['personas'])} personas, "
+        f"{str(result['workers'])} cognition workers, "
+        f"{str(result['processes'])} persona processes)")
+  print(f"   load: {result['load_sec']:.3f}s, "
+        f"{str(result['steps'])} steps: {result['run_sec']:.3f}s, "
+        f"{result['steps_per_sec']} steps/sec")
+  print(f"   {'stage':<45} {'sec':>9} {'calls':>7} {'llm':>6} {'embed':>6} "
+        f"{'hits':>7} {'misses':>7}")
+  for stage, values in sorted(result["stages"].items(), 
+                              key=lambda i: _stage_order(i[0])):
+    if not stage:
+      continue
+    depth = stage.count("/")
+    name = "  " * depth + stage.split("/")[-1]
+    print(f"   {name:<45} {values.get('seconds', 0):>9.3f} "
+          f"{values.get('calls', 0):>7} {values.get('llm_requests', 0):>6} "
+          f"{values.get('embedding_requests', 0):>6} "
+          f"{values.get('cache_hits', 0):>7} "
+          f"{values.get('cache_misses', 0):>7}")
+
+
+def _stage_order(stage):
+  top = stage.split("/")[0]
+  order = SERVER_STAGES + STAGES
+  return (order.index(top) if top in order else len(order), stage)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description="Benchmark Reverie steps/sec against the mock LLM backend.")
+  parser.add_argument("sim_codes", nargs="*", default=DEFAULT_SIMS,
+                      help="simulations to fork and run")
+  parser.add_argument("--steps", type=int, default=100,
+                      help="number of steps to run each simulation for")
+  parser.add_argument("--workers", type=int, default=1,
+                      help="number of cognition workers")
+  parser.add_argument("--processes", type=int, default=1,
+                      help="number of persona worker processes")
+  parser.add_argument("--nodes", action="store_true",
+                      help="run the persona processes as local worker nodes "
+                           "over TCP")
+  parser.add_argument("--latency", type=float, default=0,
+                      help="seconds each mock LLM/embedding request takes")
+  parser.add_argument("--fast-forward", action="store_true",
+                      help="skip the steps in which nothing can change")
+  parser.add_argument("--json", action="store_true",
+                      help="print the results as json lines")
+  parser.add_argument("--prometheus", action="store_true",
+                      help="also print the Prometheus-style snapshot")
+  parser.add_argument("--keep", action="store_true",
+                      help="keep the forked simulations")
+  parser.add_argument("--check-processes", type=int, default=0,
+                      metavar="N",
+                      help="instead of timing, check that seeded runs with "
+                           "N persona processes produce the same logs as "
+                           "serial ones")
+  args = parser.parse_args()
+
+  if args.check_processes and "PYTHONHASHSEED" not in os.environ:
+    # The persona processes have to order sets of strings the way the 
+    # server does, so the check runs with a fixed hash seed.
+    os.environ["PYTHONHASHSEED"] = "0"
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+  use_mock_backend(latency=args.latency)
+  if args.check_processes:
+    results = [check_processes(sim_code, args.steps, args.check_processes,
+                               args.nodes)
+               for sim_code in args.sim_codes]
+    for result in results:
+      if args.json:
+        print(json.dumps(result))
+      else:
+        print_check(result)
+    sys.exit(0 if all(result["identical"] for result in results) else 1)
+  for sim_code in args.sim_codes:
+    result = benchmark_sim(sim_code, args.steps, args.workers, args.keep,
+                           args.fast_forward, args.processes, args.nodes)
+    prometheus = result.pop("prometheus")
+    if args.json:
+      print(json.dumps(result))
+    else:
+      print_result(result)
+    if args.prometheus:
+      print(prometheus)
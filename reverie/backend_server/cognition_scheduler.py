@@ -0,0 +1,164 @@
+"""
+File: cognition_scheduler.py
+Description: Keeps track of when each persona next needs to run its full
+cognitive chain (perceive, retrieve, plan, reflect).
+
+Most steps, a persona is in the middle of an action and has nothing new in
+view, and its cognitive chain would do nothing but move it along its path.
+The scheduler keeps, in a heap, the step at which each persona has to wake
+up again: the step its action (or chat) ends or its day ends, as worked out
+by ReverieServer._get_steps_to_wake. Until then, the persona only glances
+around (see perceive.glance) and executes, unless something new comes into
+view or another persona changes its action.
+
+The wake step of a persona is only valid for the action it was computed
+for. Along with it, we keep the persona's wake key (see get_wake_key); if
+the key changed, e.g., because another persona started a conversation with
+it, the persona is due right away. Heap entries that were superseded by a
+later schedule call are skipped when they come up.
+"""
+import datetime
+import heapq
+import math
+
+
+def get_wake_key(persona):
+  """
+  Returns what the wake step of <persona> depends on besides the time: its
+  current action (and chat). If another persona changes it, e.g., by
+  starting a conversation with it, the persona's wake step no longer holds.
+  """
+  scratch = persona.scratch
+  return (scratch.act_address, scratch.act_start_time,
+          scratch.act_duration, scratch.chatting_with,
+          scratch.chatting_end_time)
+
+
+def get_steps_to_wake(persona, curr_time, sec_per_step):
+  """
+  Returns the number of steps, starting from the one at <curr_time>,
+  before <persona> has to run its full cognitive chain again, assuming it
+  sees nothing new in the meantime: that is, before
+    - its action finishes (Scratch.act_check_finished), or
+    - the day changes (which starts the long term planning).
+  A persona that is chatting, or has no action, is due right away.
+  ARGS:
+    persona: the Persona.
+    curr_time: the time of the first step we count from.
+    sec_per_step: the number of seconds a step takes.
+  RETURNS:
+    The number of steps (0 if the persona is due at <curr_time>).
+  """
+  scratch = persona.scratch
+  if (not scratch.curr_time
+      or not scratch.act_address
+      or scratch.chatting_with
+      or scratch.chatting_end_time):
+    return 0
+
+  # The steps left before midnight.
+  midnight = (datetime.datetime.combine(scratch.curr_time.date(),
+                                        datetime.time())
+              + datetime.timedelta(days=1))
+  steps = math.ceil((midnight - curr_time).total_seconds() / sec_per_step)
+
+  # The steps left before the action finishes. Only the time of the day
+  # counts in act_check_finished, and only a step that hits it exactly.
+  end_time = datetime.datetime.combine(curr_time.date(),
+                                       scratch.get_act_end_time().time())
+  to_end = (end_time - curr_time).total_seconds()
+  if to_end >= 0 and to_end % sec_per_step == 0:
+    steps = min(steps, int(to_end // sec_per_step))
+  return max(steps, 0)
+
+
+def get_wake(persona, next_time, sec_per_step):
+  """
+  Returns what the persona is scheduled by once it moved in a step: the
+  steps from the next one (at <next_time>) before it is due (see
+  get_steps_to_wake), and its wake key. This has to be taken right after
+  the persona moved; a persona that moves after it in the same step may
+  still change its wake key (which then makes it due in the next step).
+  ARGS:
+    persona: the Persona that just moved.
+    next_time: the time of the next step.
+    sec_per_step: the number of seconds a step takes.
+  RETURNS:
+    A (steps to wake, wake key) pair.
+  """
+  return (get_steps_to_wake(persona, next_time, sec_per_step),
+          get_wake_key(persona))
+
+
+class CognitionScheduler:
+  def __init__(self):
+    # <wake_heap> is a heap of (wake step, persona name) entries. A persona
+    # may have stale entries in it; only the one that matches
+    # <wake_steps> counts.
+    self.wake_heap = []
+    # <wake_steps> is the current wake step of each scheduled persona, and
+    # <wake_keys> the wake key it was computed for.
+    self.wake_steps = dict()
+    self.wake_keys = dict()
+
+
+  def reset(self):
+    """
+    Forgets every schedule, so that every persona is due in the next step.
+    """
+    self.wake_heap = []
+    self.wake_steps = dict()
+    self.wake_keys = dict()
+
+
+  def schedule(self, persona_name, wake_step, wake_key):
+    """
+    Sets the step at which <persona_name> next has to run its full
+    cognitive chain.
+    ARGS:
+      persona_name: the name of the persona.
+      wake_step: the step at which the persona is due.
+      wake_key: the wake key the step was computed for.
+    RETURNS:
+      None
+    """
+    self.wake_keys[persona_name] = wake_key
+    if self.wake_steps.get(persona_name) == wake_step:
+      return
+    self.wake_steps[persona_name] = wake_step
+    heapq.heappush(self.wake_heap, (wake_step, persona_name))
+
+
+  def pop_due(self, step):
+    """
+    Returns the names of the scheduled personas that are due at <step>, and
+    takes them off the schedule.
+    ARGS:
+      step: the current step.
+    RETURNS:
+      A set of persona names.
+    """
+    due = set()
+    while self.wake_heap and self.wake_heap[0][0] <= step:
+      wake_step, persona_name = heapq.heappop(self.wake_heap)
+      if self.wake_steps.get(persona_name) == wake_step:
+        del self.wake_steps[persona_name]
+        del self.wake_keys[persona_name]
+        due.add(persona_name)
+    return due
+
+
+  def is_due(self, persona_name, wake_key):
+    """
+    Returns whether <persona_name> has to run its full cognitive chain now,
+    given that it is not among the personas pop_due returned: that is, if
+    it is not scheduled, or its wake key changed since it was.
+    ARGS:
+      persona_name: the name of the persona.
+      wake_key: the persona's current wake key.
+    RETURNS:
+      True if the persona is due.
+    """
+    if persona_name not in self.wake_steps:
+      return True
+    return self.wake_keys[persona_name] != wake_key
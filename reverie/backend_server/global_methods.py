@@ -225,6 +225,33 @@ def copyanything(src, dst):
     else: raise
 
 
+def linkanything(src, dst, can_link): 
+  """
+  Hardlink over everything in the src folder to the dst folder, where 
+  can_link is True for the file's path, and copy over the rest. Linked files
+  share their data with src, so they must never be rewritten in place (only
+  replaced or removed). Falls back to copying when the file system does not 
+  support hardlinks between the two folders. 
+  ARGS:
+    src: address of the source folder  
+    dst: address of the destination folder  
+    can_link: function that takes a source file path and returns whether it
+              may be linked rather than copied. 
+  RETURNS: 
+    None
+  """
+  def link_or_copy(src_file, dst_file): 
+    if can_link(src_file): 
+      try: 
+        os.link(src_file, dst_file)
+        return dst_file
+      except OSError: 
+        pass
+    return shutil.copy2(src_file, dst_file)
+
+  shutil.copytree(src, dst, copy_function=link_or_copy)
+
+
 if __name__ == '__main__':
   pass
 
@@ -0,0 +1,266 @@
+"""
+File: hierarchical_path_finder.py
+Description: Defines the HierarchicalPathFinder class, which finds long
+paths on large mazes by searching a small graph of portals between the
+maze's regions first (in the manner of HPA*), and only then the tiles.
+
+The passable tiles of the maze are split into clusters: the connected parts
+of each arena (see Maze.path_grids), cut further into squares of
+CLUSTER_SIZE tiles so that large open arenas (e.g., the streets) do not
+make for large clusters. Wherever two clusters touch along a run of
+tiles, the middle of the run (and, for runs of LONG_RUN tiles or more, its
+ends) becomes a portal: a pair of tiles, one on either side, that are
+nodes of the graph, joined by an edge of cost 1. The
+nodes of each cluster are joined to each other by edges that cost the
+length of the shortest path between them within the cluster, which are
+worked out once, when the graph is built.
+
+A path is found by joining the start and end tiles to the nodes of their
+clusters, searching the graph with A*, and then finding the tiles between
+consecutive nodes, each time within a single cluster. The paths are
+shortest paths through the portals, so they can be somewhat longer than
+the shortest paths over the whole grid.
+"""
+import collections
+import heapq
+
+from instrumentation import timed_stage
+from path_finder import get_passable_grid
+
+# <CLUSTER_SIZE> is the side of the squares the arenas are cut into.
+CLUSTER_SIZE = 16
+# <LONG_RUN> is the length from which on a run of tiles along which two
+# clusters touch gets three portals rather than one.
+LONG_RUN = 6
+
+
+class HierarchicalPathFinder:
+  def __init__(self, collision_maze, collision_block_char, arena_grid,
+               cluster_size=CLUSTER_SIZE):
+    """
+    Builds the graph of portals of a maze.
+
+    INPUT
+      collision_maze: The collision maze, as a list of rows.
+      collision_block_char: The value of the collision maze's blocked
+        tiles.
+      arena_grid: The (maze_height, maze_width) grid of the arena path id of
+        each tile (see Maze.path_grids).
+      cluster_size: The side of the squares the arenas are cut into.
+    """
+    passable = get_passable_grid(collision_maze, collision_block_char)
+    self.height, self.width = passable.shape
+    # Like path_finder, we work on the flattened tiles of the maze with a
+    # border around it, so that we never have to check the maze's bounds.
+    # <padded_width> is the width of the padded maze.
+    self.padded_width = self.width + 2
+    self.cluster_size = cluster_size
+
+    # <region_keys> tells which arena and square each passable tile is in
+    # (None for the blocked tiles and the border).
+    region_keys = [None] * (self.padded_width * (self.height + 2))
+    arena_rows = arena_grid.tolist()
+    passable_rows = passable.tolist()
+    for y in range(self.height):
+      for x in range(self.width):
+        if passable_rows[y][x]:
+          region_keys[self._index((x, y))] = (arena_rows[y][x],
+                                              y // cluster_size,
+                                              x // cluster_size)
+
+    # <clusters> holds the cluster of each tile (-1 for the blocked tiles
+    # and the border): the connected parts of the regions.
+    self.clusters = [-1] * len(region_keys)
+    num_clusters = 0
+    for i, key in enumerate(region_keys):
+      if key is None or self.clusters[i] != -1:
+        continue
+      self.clusters[i] = num_clusters
+      queue = collections.deque([i])
+      while queue:
+        curr = queue.popleft()
+        for step in self._neighbors(curr):
+          if self.clusters[step] == -1 and region_keys[step] == key:
+            self.clusters[step] = num_clusters
+            queue.append(step)
+      num_clusters += 1
+
+    # <edges> holds the edges of the graph: node -> {node: cost}.
+    # <cluster_nodes> holds the nodes of each cluster.
+    self.edges = dict()
+    self.cluster_nodes = [[] for i in range(num_clusters)]
+    for a, b in self._find_portals():
+      for node, other in [(a, b), (b, a)]:
+        if node not in self.edges:
+          self.edges[node] = dict()
+          self.cluster_nodes[self.clusters[node]] += [node]
+        self.edges[node][other] = 1
+    for nodes in self.cluster_nodes:
+      for node in nodes:
+        dists = self._search_cluster(node)[0]
+        for other in nodes:
+          if other != node and other in dists:
+            self.edges[node][other] = dists[other]
+
+
+  @timed_stage
+  def find_path(self, start, end):
+    """
+    Finds a path from <start> to <end> through the graph of portals.
+
+    INPUT
+      start: The (x, y) tile to start from.
+      end: The (x, y) tile to reach.
+    OUTPUT
+      The path, as a list of (x, y) tiles from <start> to <end>, or None if
+      either tile is blocked, or <end> cannot be reached from <start>.
+    """
+    start_index = self._index(start)
+    end_index = self._index(end)
+    if self.clusters[start_index] == -1 or self.clusters[end_index] == -1:
+      return None
+    if start_index == end_index:
+      return [self._tile(start_index)]
+
+    # We join the start and end tiles to the nodes of their clusters. Paths
+    # within a single cluster are a candidate as well.
+    start_dists = self._search_cluster(start_index)[0]
+    end_dists = self._search_cluster(end_index)[0]
+    end_nodes = {node: end_dists[node]
+                 for node in self.cluster_nodes[self.clusters[end_index]]
+                 if node in end_dists}
+    best_cost = start_dists.get(end_index)
+    best_node = None
+
+    # A* over the graph, with the Manhattan distance to <end> as the
+    # heuristic (no edge is shorter than that).
+    costs = dict()
+    came_from = dict()
+    heap = []
+    for node in self.cluster_nodes[self.clusters[start_index]]:
+      if node in start_dists:
+        costs[node] = start_dists[node]
+        came_from[node] = None
+        heapq.heappush(heap, (start_dists[node] + self._h(node, end_index),
+                              start_dists[node], node))
+    while heap:
+      f, cost, node = heapq.heappop(heap)
+      if best_cost is not None and f >= best_cost:
+        break
+      if cost > costs[node]:
+        continue
+      if node in end_nodes and (best_cost is None
+                                or cost + end_nodes[node] < best_cost):
+        best_cost = cost + end_nodes[node]
+        best_node = node
+      for other, edge_cost in self.edges[node].items():
+        other_cost = cost + edge_cost
+        if other not in costs or other_cost < costs[other]:
+          costs[other] = other_cost
+          came_from[other] = node
+          heapq.heappush(heap, (other_cost + self._h(other, end_index),
+                                other_cost, other))
+
+    if best_cost is None:
+      return None
+    if best_node is None:
+      return self._refine(start_index, end_index)
+
+    nodes = [best_node]
+    while came_from[nodes[-1]] is not None:
+      nodes += [came_from[nodes[-1]]]
+    nodes = [start_index] + nodes[::-1] + [end_index]
+    path = [self._tile(start_index)]
+    for a, b in zip(nodes, nodes[1:]):
+      path += self._refine(a, b)[1:]
+    return path
+
+
+  def _find_portals(self):
+    """
+    Returns the portals between the clusters, as (tile, tile) index pairs:
+    the middle (and the ends of the long ones) of each run of tiles along
+    which two clusters touch.
+    """
+    # <runs> holds, for each pair of clusters that touch across a given
+    # column (or row) boundary, the tiles on one side along it.
+    runs = dict()
+    for i, cluster in enumerate(self.clusters):
+      if cluster == -1:
+        continue
+      for step, direction in [(i + 1, "x"), (i + self.padded_width, "y")]:
+        other = self.clusters[step]
+        if other != -1 and other != cluster:
+          x, y = self._tile(i)
+          line = x if direction == "x" else y
+          runs.setdefault((cluster, other, direction, line), []).append(i)
+
+    portals = []
+    for (cluster, other, direction, line), tiles in runs.items():
+      # Along an x boundary, the tiles of a run are a column apart; along a
+      # y boundary, a tile apart.
+      gap = self.padded_width if direction == "x" else 1
+      offset = 1 if direction == "x" else self.padded_width
+      run = [tiles[0]]
+      for i in tiles[1:] + [None]:
+        if i is not None and i - run[-1] == gap:
+          run += [i]
+          continue
+        # Long runs get a portal at either end as well, so that paths that
+        # pass by a corner do not have to detour through the middle.
+        ends = [run[0], run[-1]] if len(run) >= LONG_RUN else []
+        for j in sorted(set([run[len(run) // 2]] + ends)):
+          portals += [(j, j + offset)]
+        run = [i]
+    return portals
+
+
+  def _search_cluster(self, source):
+    """
+    Breadth-first search from the tile index <source> within its cluster.
+    Returns the distances of the cluster's tiles from <source> and the tile
+    each was reached from.
+    """
+    cluster = self.clusters[source]
+    dists = {source: 0}
+    parents = {source: None}
+    queue = collections.deque([source])
+    while queue:
+      curr = queue.popleft()
+      for step in self._neighbors(curr):
+        if step not in dists and self.clusters[step] == cluster:
+          dists[step] = dists[curr] + 1
+          parents[step] = curr
+          queue.append(step)
+    return dists, parents
+
+
+  def _refine(self, a, b):
+    """
+    Returns the tiles of a shortest path from the tile index <a> to <b>,
+    which are either neighbors or in the same cluster.
+    """
+    if b in self._neighbors(a):
+      return [self._tile(a), self._tile(b)]
+    parents = self._search_cluster(b)[1]
+    path = [a]
+    while path[-1] != b:
+      path += [parents[path[-1]]]
+    return [self._tile(i) for i in path]
+
+
+  def _neighbors(self, i):
+    return (i - self.padded_width, i - 1, i + self.padded_width, i + 1)
+
+
+  def _h(self, a, b):
+    (ax, ay), (bx, by) = self._tile(a), self._tile(b)
+    return abs(ax - bx) + abs(ay - by)
+
+
+  def _index(self, tile):
+    return (tile[1] + 1) * self.padded_width + tile[0] + 1
+
+
+  def _tile(self, i):
+    return (i % self.padded_width - 1, i // self.padded_width - 1)
@@ -0,0 +1,270 @@
+"""
+File: instrumentation.py
+Description: Records where the backend spends its time: the wall time and
+call count of each stage of a step (perceive, retrieve, plan, reflect,
+execute, their generate_* functions and path finding, and Reverie's own
+bookkeeping), along with the LLM and embedding round trips made inside it
+and the hits and misses of the caches it looked up (e.g., path_finder's),
+for each persona and each step.
+
+Stages nest. A stage's key is its path, e.g., "plan/generate_task_decomp";
+its time includes the stages under it, and every LLM or embedding request
+is counted in all the stages that were open when it was made.
+
+The state that tells which persona and stage we are in is kept in a
+contextvars.ContextVar. It follows the cognition worker threads, and also
+the requests they make through async_gpt_structure.run_sync, which run as
+tasks on the event loop.
+
+Everything is a no-op while <metrics.enabled> is False.
+"""
+import contextvars
+import functools
+import json
+import threading
+import time
+
+# <COUNTERS> are the values we keep for each (step, persona, stage).
+COUNTERS = ["seconds", "calls", "llm_requests", "llm_seconds",
+            "embedding_requests", "embedding_seconds", "cache_hits",
+            "cache_misses"]
+
+# <_scope> is the (persona name, stage path) the current code runs in.
+_scope = contextvars.ContextVar("instrumentation_scope", default=(None, ()))
+
+
+class _NullStage:
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+  def __init__(self, instrumentation, name=None, persona=None):
+    self.instrumentation = instrumentation
+    self.name = name
+    self.persona = persona
+
+  def __enter__(self):
+    persona, path = _scope.get()
+    # A persona's stages are not nested under the stage that moves it, so
+    # that they get the same keys whichever thread they run on.
+    if self.persona is not None:
+      persona, path = self.persona, ()
+    if self.name is not None:
+      path = path + (self.name,)
+    self.key = (persona, "/".join(path))
+    self.token = _scope.set((persona, path))
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    elapsed = time.perf_counter() - self.start
+    _scope.reset(self.token)
+    if self.name is not None:
+      self.instrumentation._add(self.key, seconds=elapsed, calls=1)
+    return False
+
+
+class Instrumentation:
+  def __init__(self):
+    # <enabled> turns the recording on and off.
+    self.enabled = False
+    # <step> is the step being recorded. Steps do not overlap, so this is
+    # shared by all threads.
+    self.step = None
+
+    self.lock = threading.Lock()
+    # <step_records> holds the counters of the steps that have not been
+    # exported yet: (step, persona, stage) -> {counter: value}.
+    # <totals> holds the counters summed over all steps:
+    # (persona, stage) -> {counter: value}.
+    self.step_records = dict()
+    self.totals = dict()
+    self.steps_total = 0
+
+
+  def reset(self):
+    """
+    Forgets everything recorded so far.
+    """
+    with self.lock:
+      self.step_records = dict()
+      self.totals = dict()
+      self.steps_total = 0
+
+
+  def set_step(self, step):
+    """
+    Marks the start of <step>. Everything recorded from here on belongs to it.
+    """
+    if not self.enabled:
+      return
+    self.step = step
+    with self.lock:
+      self.steps_total += 1
+
+
+  def stage(self, name):
+    """
+    Returns a context manager that records the time spent in the stage
+    <name> (nested under the stage we are currently in).
+    """
+    if not self.enabled:
+      return _NULL_STAGE
+    return _Stage(self, name=name)
+
+
+  def persona(self, persona_name):
+    """
+    Returns a context manager under which everything is recorded for
+    <persona_name>.
+    """
+    if not self.enabled:
+      return _NULL_STAGE
+    return _Stage(self, persona=persona_name)
+
+
+  def record_request(self, backend, seconds):
+    """
+    Records one LLM ("llm") or embedding ("embedding") round trip that took
+    <seconds>, in every stage that is currently open.
+    """
+    if not self.enabled:
+      return
+    persona, path = _scope.get()
+    # Requests made outside of any stage are recorded under the stage "".
+    prefixes = [path[:i] for i in range(1, len(path) + 1)] or [()]
+    for prefix in prefixes:
+      self._add((persona, "/".join(prefix)),
+                **{f"{backend}_requests": 1, f"{backend}_seconds": seconds})
+
+
+  def record_cache(self, hit):
+    """
+    Records one cache lookup, a hit if <hit> is True and a miss otherwise,
+    in every stage that is currently open.
+    """
+    if not self.enabled:
+      return
+    persona, path = _scope.get()
+    prefixes = [path[:i] for i in range(1, len(path) + 1)] or [()]
+    counter = "cache_hits" if hit else "cache_misses"
+    for prefix in prefixes:
+      self._add((persona, "/".join(prefix)), **{counter: 1})
+
+
+  def _add(self, key, **values):
+    with self.lock:
+      for record in [self.step_records.setdefault((self.step,) + key, dict()),
+                     self.totals.setdefault(key, dict())]:
+        for counter, value in values.items():
+          record[counter] = record.get(counter, 0) + value
+
+
+  def drain_records(self):
+    """
+    Returns the per-step records that have not been exported yet (and
+    forgets them), as a list of dictionaries with the keys "step",
+    "persona", "stage" and COUNTERS.
+    """
+    with self.lock:
+      step_records = self.step_records
+      self.step_records = dict()
+
+    records = []
+    for (step, persona, stage), values in step_records.items():
+      record = {"step": step, "persona": persona, "stage": stage}
+      for counter in COUNTERS:
+        record[counter] = values.get(counter, 0)
+      records += [record]
+    return records
+
+
+  def add_records(self, records):
+    """
+    Adds <records>, as returned by drain_records (e.g., in another process),
+    to the counters.
+    """
+    if not self.enabled:
+      return
+    with self.lock:
+      for record in records:
+        key = (record["persona"], record["stage"])
+        for target in [self.step_records.setdefault((record["step"],) + key,
+                                                    dict()),
+                       self.totals.setdefault(key, dict())]:
+          for counter in COUNTERS:
+            if record[counter]:
+              target[counter] = target.get(counter, 0) + record[counter]
+
+
+  def write_json_lines(self, f_name):
+    """
+    Appends the per-step records that have not been exported yet to
+    <f_name>, one json object per line.
+    """
+    records = self.drain_records()
+    if not records:
+      return
+    with open(f_name, "a") as outfile:
+      for record in records:
+        outfile.write(json.dumps(record) + "\n")
+
+
+  def get_totals(self):
+    """
+    Returns the counters summed over all steps:
+    {(persona, stage): {counter: value}}.
+    """
+    with self.lock:
+      return {key: dict(values) for key, values in self.totals.items()}
+
+
+  def to_prometheus(self):
+    """
+    Returns a snapshot of the totals in the Prometheus text exposition
+    format.
+    """
+    totals = self.get_totals()
+    lines = ["# HELP reverie_steps_total Steps recorded.",
+             "# TYPE reverie_steps_total counter",
+             f"reverie_steps_total {str(self.steps_total)}"]
+    for counter in COUNTERS:
+      metric = f"reverie_stage_{counter}_total"
+      lines += [f"# HELP {metric} Stage {counter.replace('_', ' ')}.",
+                f"# TYPE {metric} counter"]
+      for (persona, stage), values in sorted(totals.items(),
+                                             key=lambda i: (str(i[0][0]),
+                                                            i[0][1])):
+        if counter not in values:
+          continue
+        labels = f'persona="{_escape(persona or "")}",stage="{_escape(stage)}"'
+        lines += [f"{metric}{{{labels}}} {str(values[counter])}"]
+    return "\n".join(lines) + "\n"
+
+
+def _escape(label):
+  return label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# <metrics> is the instrumentation every module records to.
+metrics = Instrumentation()
+
+
+def timed_stage(func):
+  """
+  Decorator that records each call of <func> as a stage named after it.
+  """
+  @functools.wraps(func)
+  def wrapper(*args, **kwargs):
+    if not metrics.enabled:
+      return func(*args, **kwargs)
+    with metrics.stage(func.__name__):
+      return func(*args, **kwargs)
+  return wrapper
@@ -11,198 +11,463 @@ import datetime
 import pickle
 import time
 import math
+import os
+import glob
+import hashlib
+import collections
+import threading
+from multiprocessing import shared_memory
 
 from global_methods import *
 from utils import *
+from tile_event_store import TileEventStore
+from path_finder import (path_finder, path_finder_batch, get_distance_field,
+                         path_from_distance_field, mark_collision_changed)
+from hierarchical_path_finder import HierarchicalPathFinder, CLUSTER_SIZE
+
+# <STATIC_LAYERS> are the layers of the static maze grid (see 
+# load_static_maze). The "collision" layer holds the block ids of the 
+# collision maze (0 where there is none); the others hold indices into the 
+# layer's labels (0, i.e., "", where there is none). 
+STATIC_LAYERS = ["collision", "sector", "arena", "game_object", 
+                 "spawning_location"]
+
+# <PATH_LEVELS> are the levels of a tile path (see Maze.get_tile_path). 
+PATH_LEVELS = ["world", "sector", "arena", "game_object"]
+
+# <ADDRESS_KINDS> are the kinds of string addresses in the maze's 
+# address_tiles, in the order they are listed for each tile. 
+ADDRESS_KINDS = ["sector", "arena", "game_object", "spawning_location"]
+
+# <DISTANCE_FIELD_CACHE_SIZE> is the number of distance fields (see 
+# Maze.get_distance_field) a maze keeps, the least recently used ones being
+# dropped first. 
+DISTANCE_FIELD_CACHE_SIZE = 64
+
+# <HIERARCHICAL_PATH_MIN_TILES> is the number of tiles from which on a maze 
+# finds long paths through a graph of portals (see Maze.find_path) rather 
+# than over the whole grid. The Ville (140x100) is below it. 
+HIERARCHICAL_PATH_MIN_TILES = 40000
+
+# <MAZE_CACHE_VERSION> is bumped whenever the layout of the compiled maze 
+# cache (see load_static_maze) changes, so that old caches are rebuilt. 
+MAZE_CACHE_VERSION = 1
+
+
+def get_maze_cache_file(): 
+  """
+  Returns the path of the compiled maze cache, which sits next to the 
+  <env_matrix> folder it is compiled from. 
+  """
+  matrix_folder = os.path.normpath(env_matrix)
+  return f"{matrix_folder}_compiled.npz"
+
+
+def get_maze_source_fingerprint(): 
+  """
+  Returns a fingerprint of the files in <env_matrix> that the static maze is
+  compiled from: a hash of their names, sizes and modification times. 
+  """
+  source = hashlib.sha1(str(MAZE_CACHE_VERSION).encode())
+  for f in sorted(glob.glob(f"{env_matrix}/**/*", recursive=True)): 
+    if not os.path.isfile(f): 
+      continue
+    f_stat = os.stat(f)
+    source.update(f"{os.path.relpath(f, env_matrix)}:{str(f_stat.st_size)}:"
+                  f"{str(f_stat.st_mtime_ns)}\n".encode())
+  return source.hexdigest()
+
+
+def load_static_maze(maze_name): 
+  """
+  Returns the static part of the maze (see compile_static_maze). It is read
+  from the compiled maze cache (see get_maze_cache_file) if the cache was 
+  compiled from the current <env_matrix> files; otherwise, it is compiled 
+  and the cache is (re)written. 
+
+  INPUT
+    maze_name: The name of the maze. 
+  OUTPUT
+    static: See compile_static_maze. 
+  """
+  cache_file = get_maze_cache_file()
+  fingerprint = get_maze_source_fingerprint()
+  if os.path.exists(cache_file): 
+    try: 
+      static = _read_maze_cache(cache_file, fingerprint)
+      if static: 
+        static["maze_name"] = maze_name
+        return static
+    except (OSError, ValueError, KeyError): 
+      pass
+
+  static = compile_static_maze(maze_name)
+  try: 
+    _write_maze_cache(cache_file, fingerprint, static)
+  except OSError as e: 
+    print (f"Could not write the compiled maze cache ({e}).")
+  return static
+
+
+def _write_maze_cache(cache_file, fingerprint, static): 
+  """
+  Writes <static> to <cache_file> as a numpy .npz archive. Every string in 
+  it is interned in one string table, and referred to by its index. 
+  """
+  strings = []
+  string_index = dict()
+  def intern(string): 
+    if string not in string_index: 
+      string_index[string] = len(strings)
+      strings.append(string)
+    return string_index[string]
+
+  meta = {"fingerprint": fingerprint, 
+          "maze_width": static["maze_width"], 
+          "maze_height": static["maze_height"], 
+          "sq_tile_size": static["sq_tile_size"], 
+          "special_constraint": intern(static["special_constraint"]), 
+          "world": intern(static["world"])}
+  arrays = dict()
+  for layer, labels in static["labels"].items(): 
+    arrays[f"labels_{layer}"] = numpy.array([intern(i) for i in labels], 
+                                            dtype=numpy.int32)
+  arrays["addresses"] = numpy.array([intern(i) 
+                                     for i in static["addresses"]], 
+                                    dtype=numpy.int32)
+  arrays["address_kinds"] = static["address_kinds"]
+  arrays["address_tiles"] = static["address_tiles"]
+  arrays["grid"] = static["grid"]
+  arrays["strings"] = numpy.array(strings, dtype=str)
+  arrays["meta"] = numpy.array(json.dumps(meta))
+
+  # We write to a temporary file first so that no process ever reads a 
+  # half written cache. 
+  temp_file = f"{cache_file}.{str(os.getpid())}.tmp"
+  with open(temp_file, "wb") as outfile: 
+    numpy.savez(outfile, **arrays)
+  os.replace(temp_file, cache_file)
+
+
+def _read_maze_cache(cache_file, fingerprint): 
+  """
+  Reads the static maze from <cache_file> (see _write_maze_cache), or 
+  returns None if it was not compiled from the files with <fingerprint>. 
+  """
+  with numpy.load(cache_file, allow_pickle=False) as cache: 
+    meta = json.loads(str(cache["meta"]))
+    if meta["fingerprint"] != fingerprint: 
+      return None
+    strings = cache["strings"].tolist()
+    static = dict()
+    static["maze_width"] = meta["maze_width"]
+    static["maze_height"] = meta["maze_height"]
+    static["sq_tile_size"] = meta["sq_tile_size"]
+    static["special_constraint"] = strings[meta["special_constraint"]]
+    static["world"] = strings[meta["world"]]
+    static["labels"] = dict()
+    for layer in STATIC_LAYERS[1:]: 
+      static["labels"][layer] = [strings[i] 
+                                 for i in cache[f"labels_{layer}"].tolist()]
+    static["addresses"] = [strings[i] for i in cache["addresses"].tolist()]
+    static["address_kinds"] = cache["address_kinds"]
+    static["address_tiles"] = cache["address_tiles"]
+    static["grid"] = cache["grid"]
+  return static
+
+
+def compile_static_maze(maze_name): 
+  """
+  Reads the static part of the maze -- its meta information and its 
+  collision, sector, arena, game object and spawning location matrices -- 
+  from the <env_matrix> folder, and works out its string addresses. 
+
+  INPUT
+    maze_name: The name of the maze. 
+  OUTPUT
+    static: A dictionary with the keys "maze_name", "maze_width", 
+            "maze_height", "sq_tile_size", "special_constraint", "world", 
+            "labels" (the label list of each layer but "collision"), 
+            "grid" (an int32 numpy array of shape 
+            (len(STATIC_LAYERS), maze_height, maze_width)), "addresses" 
+            (the list of string addresses, see Maze.address_tiles), 
+            "address_kinds" (the index in ADDRESS_KINDS of each address's
+            kind) and "address_tiles" (an int32 numpy array of 
+            (address index, x, y) rows, one for each tile of each address).
+  """
+  # Reading in the meta information about the world. If you want tp see the
+  # example variables, check out the maze_meta_info.json file. 
+  meta_info = json.load(open(f"{env_matrix}/maze_meta_info.json"))
+  static = dict()
+  static["maze_name"] = maze_name
+  # <maze_width> and <maze_height> denote the number of tiles make up the 
+  # height and width of the map. 
+  static["maze_width"] = int(meta_info["maze_width"])
+  static["maze_height"] = int(meta_info["maze_height"])
+  # <sq_tile_size> denotes the pixel height/width of a tile. 
+  static["sq_tile_size"] = int(meta_info["sq_tile_size"])
+  # <special_constraint> is a string description of any relevant special 
+  # constraints the world might have. 
+  # e.g., "planning to stay at home all day and never go out of her home"
+  static["special_constraint"] = meta_info["special_constraint"]
+
+  # READING IN SPECIAL BLOCKS
+  # Special blocks are those that are colored in the Tiled map. 
+
+  # Here is an example row for the arena block file: 
+  # e.g., "25335, Double Studio, Studio, Common Room"
+  # And here is another example row for the game object block file: 
+  # e.g, "25331, Double Studio, Studio, Bedroom 2, Painting"
+
+  # Notice that the first element here is the color marker digit from the 
+  # Tiled export. Then we basically have the block path: 
+  # World, Sector, Arena, Game Object -- again, these paths need to be 
+  # unique within an instance of Reverie. 
+  blocks_folder = f"{env_matrix}/special_blocks"
+
+  _wb = blocks_folder + "/world_blocks.csv"
+  wb_rows = read_file_to_list(_wb, header=False)
+  static["world"] = wb_rows[0][-1]
+
+  block_files = {"sector": "sector_blocks.csv", 
+                 "arena": "arena_blocks.csv", 
+                 "game_object": "game_object_blocks.csv", 
+                 "spawning_location": "spawning_location_blocks.csv"}
+  block_dicts = dict()
+  for layer, block_file in block_files.items(): 
+    block_dicts[layer] = dict()
+    for i in read_file_to_list(f"{blocks_folder}/{block_file}", header=False):
+      block_dicts[layer][i[0]] = i[-1]
+
+  # [SECTION 3] Reading in the matrices 
+  # This is your typical two dimensional matrices. It's made up of 0s and 
+  # the number that represents the color block from the blocks folder. 
+  # The mazes are taken directly from the json exports of Tiled maps. They 
+  # should be in csv format. Importantly, they are "not" in a 2-d matrix 
+  # format -- they are single row matrices with the length of width x 
+  # height of the maze. So we need to convert here. 
+  # example format: [['0', '0', ... '25309', '0',...], ['0',...]...]
+  # 25309 is the collision bar number right now.
+  maze_folder = f"{env_matrix}/maze"
+  shape = (static["maze_height"], static["maze_width"])
+  grid = numpy.zeros((len(STATIC_LAYERS),) + shape, dtype=numpy.int32)
+  static["labels"] = dict()
+  for count, layer in enumerate(STATIC_LAYERS): 
+    raw = read_file_to_list(f"{maze_folder}/{layer}_maze.csv", 
+                            header=False)[0]
+    if layer == "collision": 
+      grid[count] = numpy.array([int(i) for i in raw]).reshape(shape)
+      continue
+
+    labels = [""]
+    label_index = {"": 0}
+    values = []
+    for i in raw: 
+      label = block_dicts[layer].get(i, "")
+      if label not in label_index: 
+        label_index[label] = len(labels)
+        labels += [label]
+      values += [label_index[label]]
+    grid[count] = numpy.array(values).reshape(shape)
+    static["labels"][layer] = labels
+  static["grid"] = grid
+
+  # The string addresses of each tile, e.g., 
+  # "the Ville:Hobbs Cafe:cafe:refrigerator" for a game object, or 
+  # "<spawn_loc>bedroom-2-a" for a spawning location. 
+  addresses = []
+  address_kinds = []
+  address_index = dict()
+  address_tiles = []
+  labels = static["labels"]
+  world = static["world"]
+  for i in range(static["maze_height"]): 
+    for j in range(static["maze_width"]): 
+      sector, arena, game_object, spawning_location = [
+        labels[layer][grid[count + 1][i][j]] 
+        for count, layer in enumerate(STATIC_LAYERS[1:])]
+      tile_addresses = []
+      if sector: 
+        tile_addresses += [(0, f"{world}:{sector}")]
+      if arena: 
+        tile_addresses += [(1, f"{world}:{sector}:{arena}")]
+      if game_object: 
+        tile_addresses += [(2, f"{world}:{sector}:{arena}:{game_object}")]
+      if spawning_location: 
+        tile_addresses += [(3, f"<spawn_loc>{spawning_location}")]
+      for kind, address in tile_addresses: 
+        if address not in address_index: 
+          address_index[address] = len(addresses)
+          addresses += [address]
+          address_kinds += [kind]
+        address_tiles += [(address_index[address], j, i)]
+  static["addresses"] = addresses
+  static["address_kinds"] = numpy.array(address_kinds, dtype=numpy.int8)
+  static["address_tiles"] = numpy.array(address_tiles, 
+                                        dtype=numpy.int32).reshape(-1, 3)
+  return static
+
 
 class Maze: 
-  def __init__(self, maze_name): 
+  def __init__(self, maze_name, static=None): 
+    """
+    Loads the maze <maze_name>. If <static> (see load_static_maze) is given,
+    the maze is built from it instead of being read from its files. 
+    """
+    if static is None: 
+      static = load_static_maze(maze_name)
+    # <static> is kept so that the maze can be shared (see share_static). 
+    # <shared_memory> is the shared memory block its grid lives in, if any.
+    self.static = static
+    self.shared_memory = None
+
     # READING IN THE BASIC META INFORMATION ABOUT THE MAP
     self.maze_name = maze_name
-    # Reading in the meta information about the world. If you want tp see the
-    # example variables, check out the maze_meta_info.json file. 
-    meta_info = json.load(open(f"{env_matrix}/maze_meta_info.json"))
-    # <maze_width> and <maze_height> denote the number of tiles make up the 
-    # height and width of the map. 
-    self.maze_width = int(meta_info["maze_width"])
-    self.maze_height = int(meta_info["maze_height"])
-    # <sq_tile_size> denotes the pixel height/width of a tile. 
-    self.sq_tile_size = int(meta_info["sq_tile_size"])
-    # <special_constraint> is a string description of any relevant special 
-    # constraints the world might have. 
-    # e.g., "planning to stay at home all day and never go out of her home"
-    self.special_constraint = meta_info["special_constraint"]
-
-    # READING IN SPECIAL BLOCKS
-    # Special blocks are those that are colored in the Tiled map. 
-
-    # Here is an example row for the arena block file: 
-    # e.g., "25335, Double Studio, Studio, Common Room"
-    # And here is another example row for the game object block file: 
-    # e.g, "25331, Double Studio, Studio, Bedroom 2, Painting"
-
-    # Notice that the first element here is the color marker digit from the 
-    # Tiled export. Then we basically have the block path: 
-    # World, Sector, Arena, Game Object -- again, these paths need to be 
-    # unique within an instance of Reverie. 
-    blocks_folder = f"{env_matrix}/special_blocks"
-
-    _wb = blocks_folder + "/world_blocks.csv"
-    wb_rows = read_file_to_list(_wb, header=False)
-    wb = wb_rows[0][-1]
-   
-    _sb = blocks_folder + "/sector_blocks.csv"
-    sb_rows = read_file_to_list(_sb, header=False)
-    sb_dict = dict()
-    for i in sb_rows: sb_dict[i[0]] = i[-1]
-    
-    _ab = blocks_folder + "/arena_blocks.csv"
-    ab_rows = read_file_to_list(_ab, header=False)
-    ab_dict = dict()
-    for i in ab_rows: ab_dict[i[0]] = i[-1]
-    
-    _gob = blocks_folder + "/game_object_blocks.csv"
-    gob_rows = read_file_to_list(_gob, header=False)
-    gob_dict = dict()
-    for i in gob_rows: gob_dict[i[0]] = i[-1]
-    
-    _slb = blocks_folder + "/spawning_location_blocks.csv"
-    slb_rows = read_file_to_list(_slb, header=False)
-    slb_dict = dict()
-    for i in slb_rows: slb_dict[i[0]] = i[-1]
-
-    # [SECTION 3] Reading in the matrices 
-    # This is your typical two dimensional matrices. It's made up of 0s and 
-    # the number that represents the color block from the blocks folder. 
-    maze_folder = f"{env_matrix}/maze"
-
-    _cm = maze_folder + "/collision_maze.csv"
-    collision_maze_raw = read_file_to_list(_cm, header=False)[0]
-    _sm = maze_folder + "/sector_maze.csv"
-    sector_maze_raw = read_file_to_list(_sm, header=False)[0]
-    _am = maze_folder + "/arena_maze.csv"
-    arena_maze_raw = read_file_to_list(_am, header=False)[0]
-    _gom = maze_folder + "/game_object_maze.csv"
-    game_object_maze_raw = read_file_to_list(_gom, header=False)[0]
-    _slm = maze_folder + "/spawning_location_maze.csv"
-    spawning_location_maze_raw = read_file_to_list(_slm, header=False)[0]
-
-    # Loading the maze. The mazes are taken directly from the json exports of
-    # Tiled maps. They should be in csv format. 
-    # Importantly, they are "not" in a 2-d matrix format -- they are single 
-    # row matrices with the length of width x height of the maze. So we need
-    # to convert here. 
-    # We can do this all at once since the dimension of all these matrices are
-    # identical (e.g., 70 x 40).
-    # example format: [['0', '0', ... '25309', '0',...], ['0',...]...]
-    # 25309 is the collision bar number right now.
-    self.collision_maze = []
-    sector_maze = []
-    arena_maze = []
-    game_object_maze = []
-    spawning_location_maze = []
-    for i in range(0, len(collision_maze_raw), meta_info["maze_width"]): 
-      tw = meta_info["maze_width"]
-      self.collision_maze += [collision_maze_raw[i:i+tw]]
-      sector_maze += [sector_maze_raw[i:i+tw]]
-      arena_maze += [arena_maze_raw[i:i+tw]]
-      game_object_maze += [game_object_maze_raw[i:i+tw]]
-      spawning_location_maze += [spawning_location_maze_raw[i:i+tw]]
-
-    # Once we are done loading in the maze, we now set up self.tiles. This is
-    # a matrix accessed by row:col where each access point is a dictionary
-    # that contains all the things that are taking place in that tile. 
-    # More specifically, it contains information about its "world," "sector,"
-    # "arena," "game_object," "spawning_location," as well as whether it is a
-    # collision block, and a set of all events taking place in it. 
-    # e.g., self.tiles[32][59] = {'world': 'double studio', 
-    #            'sector': '', 'arena': '', 'game_object': '', 
-    #            'spawning_location': '', 'collision': False, 'events': set()}
-    # e.g., self.tiles[9][58] = {'world': 'double studio', 
-    #         'sector': 'double studio', 'arena': 'bedroom 2', 
-    #         'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
-    #         'collision': False,
-    #         'events': {('double studio:double studio:bedroom 2:bed',
-    #                    None, None)}} 
-    self.tiles = []
-    for i in range(self.maze_height): 
-      row = []
-      for j in range(self.maze_width):
-        tile_details = dict()
-        tile_details["world"] = wb
-        
-        tile_details["sector"] = ""
-        if sector_maze[i][j] in sb_dict: 
-          tile_details["sector"] = sb_dict[sector_maze[i][j]]
-        
-        tile_details["arena"] = ""
-        if arena_maze[i][j] in ab_dict: 
-          tile_details["arena"] = ab_dict[arena_maze[i][j]]
-        
-        tile_details["game_object"] = ""
-        if game_object_maze[i][j] in gob_dict: 
-          tile_details["game_object"] = gob_dict[game_object_maze[i][j]]
-        
-        tile_details["spawning_location"] = ""
-        if spawning_location_maze[i][j] in slb_dict: 
-          tile_details["spawning_location"] = slb_dict[spawning_location_maze[i][j]]
-        
-        tile_details["collision"] = False
-        if self.collision_maze[i][j] != "0": 
-          tile_details["collision"] = True
-
-        tile_details["events"] = set()
-        
-        row += [tile_details]
-      self.tiles += [row]
-    # Each game object occupies an event in the tile. We are setting up the 
-    # default event value here. 
-    for i in range(self.maze_height):
-      for j in range(self.maze_width): 
-        if self.tiles[i][j]["game_object"]:
-          object_name = ":".join([self.tiles[i][j]["world"], 
-                                  self.tiles[i][j]["sector"], 
-                                  self.tiles[i][j]["arena"], 
-                                  self.tiles[i][j]["game_object"]])
-          go_event = (object_name, None, None, None)
-          self.tiles[i][j]["events"].add(go_event)
+    self.maze_width = static["maze_width"]
+    self.maze_height = static["maze_height"]
+    self.sq_tile_size = static["sq_tile_size"]
+    self.special_constraint = static["special_constraint"]
+
+    # The tiles are kept as a struct of arrays: one (maze_height, 
+    # maze_width) numpy grid per attribute, indexed [y, x]. 
+    # <collision_grid> tells whether each tile is a collision block. 
+    # <label_grids> holds, for "sector", "arena", "game_object" and 
+    # "spawning_location", the id of each tile's label, which <labels> 
+    # turns back into the name (0, i.e., "", where there is none) and 
+    # <label_ids> into the id. 
+    # e.g., self.labels["arena"][self.label_grids["arena"][9, 58]] 
+    #         == "bedroom 2"
+    grid = static["grid"]
+    self.world = static["world"]
+    self.collision_grid = grid[STATIC_LAYERS.index("collision")] != 0
+    self.labels = static["labels"]
+    self.label_ids = {layer: {name: count for count, name in enumerate(i)}
+                      for layer, i in self.labels.items()}
+    self.label_grids = {layer: grid[count + 1] 
+                        for count, layer in enumerate(STATIC_LAYERS[1:])}
+
+    # <location_grid> holds the id of each tile's (world, sector, arena, 
+    # game_object) location in <locations>, and <location_paths> the 
+    # tile path (see get_tile_path) of each location at each PATH_LEVELS
+    # level. <path_grids> holds, for each level, the id of each tile's path
+    # in <paths>, so that comparing the paths of two tiles (e.g., whether 
+    # they are in the same arena) is comparing two integers. 
+    location_keys = numpy.stack([self.label_grids[layer].reshape(-1) 
+                                 for layer in PATH_LEVELS[1:]], axis=1)
+    location_ids, location_grid = numpy.unique(location_keys, axis=0, 
+                                               return_inverse=True)
+    self.location_grid = location_grid.reshape(
+                           self.maze_height, self.maze_width).astype(
+                           numpy.int32)
+    self.locations = []
+    self.location_paths = []
+    for sector_id, arena_id, game_object_id in location_ids.tolist(): 
+      location = (self.world, self.labels["sector"][sector_id], 
+                  self.labels["arena"][arena_id], 
+                  self.labels["game_object"][game_object_id])
+      self.locations += [location]
+      self.location_paths += [tuple(":".join(location[:count + 1]) 
+                                    for count in range(len(PATH_LEVELS)))]
+    self.paths = dict()
+    self.path_ids = dict()
+    self.path_grids = dict()
+    for count, level in enumerate(PATH_LEVELS): 
+      self.paths[level] = []
+      self.path_ids[level] = dict()
+      location_path_ids = []
+      for location_path in self.location_paths: 
+        path = location_path[count]
+        if path not in self.path_ids[level]: 
+          self.path_ids[level][path] = len(self.paths[level])
+          self.paths[level] += [path]
+        location_path_ids += [self.path_ids[level][path]]
+      self.path_grids[level] = numpy.array(location_path_ids, 
+                                           dtype=numpy.int32)[
+                                             self.location_grid]
+
+    # <collision_maze> is the collision matrix path finding runs on, with 
+    # the block ids as strings (e.g., "0", "32125"). Tiles with the same 
+    # block id share one string. 
+    collision = grid[STATIC_LAYERS.index("collision")]
+    block_ids = {i: str(i) for i in numpy.unique(collision).tolist()}
+    self.collision_maze = [[block_ids[i] for i in row] 
+                           for row in collision.tolist()]
+
+    # <event_store> holds the set of all events taking place in each tile, 
+    # indexed by tile, by subject, by event and by arena (see 
+    # tile_event_store.py). 
+    # e.g., self.event_store.get((58, 9)) = 
+    #         {('double studio:double studio:bedroom 2:bed', None, None, 
+    #           None)}
+    self.event_store = TileEventStore(self.path_grids["arena"])
 
     # Reverse tile access. 
     # <self.address_tiles> -- given a string address, we return a set of all 
     # tile coordinates belonging to that address (this is opposite of  
-    # self.tiles that give you the string address given a coordinate). This is
-    # an optimization component for finding paths for the personas' movement. 
+    # access_tile that gives you the string address given a coordinate). 
+    # This is an optimization component for finding paths for the personas'
+    # movement. 
     # self.address_tiles['<spawn_loc>bedroom-2-a'] == {(58, 9)}
     # self.address_tiles['double studio:recreation:pool table'] 
     #   == {(29, 14), (31, 11), (30, 14), (32, 11), ...}, 
+    # The addresses are worked out once, when the maze is compiled (see 
+    # compile_static_maze). 
+    addresses = static["addresses"]
     self.address_tiles = dict()
-    for i in range(self.maze_height):
-      for j in range(self.maze_width): 
-        addresses = []
-        if self.tiles[i][j]["sector"]: 
-          add = f'{self.tiles[i][j]["world"]}:'
-          add += f'{self.tiles[i][j]["sector"]}'
-          addresses += [add]
-        if self.tiles[i][j]["arena"]: 
-          add = f'{self.tiles[i][j]["world"]}:'
-          add += f'{self.tiles[i][j]["sector"]}:'
-          add += f'{self.tiles[i][j]["arena"]}'
-          addresses += [add]
-        if self.tiles[i][j]["game_object"]: 
-          add = f'{self.tiles[i][j]["world"]}:'
-          add += f'{self.tiles[i][j]["sector"]}:'
-          add += f'{self.tiles[i][j]["arena"]}:'
-          add += f'{self.tiles[i][j]["game_object"]}'
-          addresses += [add]
-        if self.tiles[i][j]["spawning_location"]: 
-          add = f'<spawn_loc>{self.tiles[i][j]["spawning_location"]}'
-          addresses += [add]
-
-        for add in addresses: 
-          if add in self.address_tiles: 
-            self.address_tiles[add].add((j, i))
-          else: 
-            self.address_tiles[add] = set([(j, i)])
+    for address_id, x, y in static["address_tiles"].tolist(): 
+      add = addresses[address_id]
+      if add in self.address_tiles: 
+        self.address_tiles[add].add((x, y))
+      else: 
+        self.address_tiles[add] = set([(x, y)])
+
+    # Each game object occupies an event in the tile. We are setting up the 
+    # default event value here. 
+    game_object_kind = ADDRESS_KINDS.index("game_object")
+    for count, add in enumerate(addresses): 
+      if static["address_kinds"][count] == game_object_kind: 
+        go_event = (add, None, None, None)
+        for tile in self.address_tiles[add]: 
+          self.event_store.add(go_event, tile)
+
+    # <event_diffs> records the changes made to the tiles' events, as 
+    # (operation, event or subject, tile) triples, while it is a list. This 
+    # is how other copies of the maze are kept up to date (see 
+    # apply_event_diffs). It is None, and nothing is recorded, by default. 
+    self.event_diffs = None
+
+    # <distance_fields> holds the distance fields of the addresses personas 
+    # recently headed to (see get_distance_field), least recently used 
+    # first. The cognition threads share it, so it is only touched with 
+    # <distance_fields_lock> held. 
+    self.distance_fields = collections.OrderedDict()
+    self.distance_fields_lock = threading.Lock()
+    # <path_graph> is the graph of portals long paths are found through on 
+    # large mazes (see find_path). It is built when first needed. 
+    self.path_graph = None
+
+
+  def share_static(self): 
+    """
+    Copies the static grid of the maze (see load_static_maze) into a new 
+    multiprocessing.shared_memory block, so that other processes can build
+    their copy of the maze on it without reading or holding their own. 
+
+    INPUT
+      None
+    OUTPUT
+      shm: The SharedMemory block. The caller closes and unlinks it once no
+           process uses it anymore. 
+      spec: A small picklable dictionary to pass to attach_shared_maze. 
+    """
+    grid = self.static["grid"]
+    shm = shared_memory.SharedMemory(create=True, size=grid.nbytes)
+    numpy.ndarray(grid.shape, dtype=grid.dtype, buffer=shm.buf)[:] = grid
+    spec = {key: val for key, val in self.static.items() if key != "grid"}
+    spec["shm_name"] = shm.name
+    spec["grid_shape"] = grid.shape
+    spec["grid_dtype"] = grid.dtype.str
+    return shm, spec
 
 
   def turn_coordinate_to_tile(self, px_coordinate): 
@@ -225,8 +490,11 @@ class Maze:
 
   def access_tile(self, tile): 
     """
-    Returns the tiles details dictionary that is stored in self.tiles of the 
-    designated x, y location. 
+    Returns the tile details dictionary of the designated x, y location, 
+    put together from the maze's grids. This is kept for compatibility; the
+    grids (or get_tile_path and get_tile_events) are cheaper to read. The 
+    events in it are the tile's own set if it has one, but they should only
+    be changed through add_event_from_tile and the like. 
 
     INPUT
       tile: The tile coordinate of our interest in (x, y) form.
@@ -234,16 +502,61 @@ class Maze:
       The tile detail dictionary for the designated tile. 
     EXAMPLE OUTPUT
       Given (58, 9), 
-      self.tiles[9][58] = {'world': 'double studio', 
-            'sector': 'double studio', 'arena': 'bedroom 2', 
-            'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
-            'collision': False,
-            'events': {('double studio:double studio:bedroom 2:bed',
-                       None, None)}} 
+      {'world': 'double studio', 
+       'sector': 'double studio', 'arena': 'bedroom 2', 
+       'game_object': 'bed', 'spawning_location': 'bedroom-2-a', 
+       'collision': False,
+       'events': {('double studio:double studio:bedroom 2:bed',
+                  None, None)}} 
     """
     x = tile[0]
     y = tile[1]
-    return self.tiles[y][x]
+    world, sector, arena, game_object = self.locations[
+                                          self.location_grid[y, x]]
+    spawning_location = self.labels["spawning_location"][
+                          self.label_grids["spawning_location"][y, x]]
+    tile_details = dict()
+    tile_details["world"] = world
+    tile_details["sector"] = sector
+    tile_details["arena"] = arena
+    tile_details["game_object"] = game_object
+    tile_details["spawning_location"] = spawning_location
+    tile_details["collision"] = bool(self.collision_grid[y, x])
+    tile_details["events"] = self.get_tile_events(tile)
+    return tile_details
+
+
+  def get_tile_events(self, tile): 
+    """
+    Returns the set of events taking place in the designated x, y location
+    (which must not be changed directly). 
+    """
+    return self.event_store.get(tile)
+
+
+  def get_subject_tiles(self, subject): 
+    """
+    Returns the tiles on which <subject> (e.g., a persona's name or a game 
+    object's address) has events, without scanning the maze. 
+    """
+    return self.event_store.get_subject_tiles(subject)
+
+
+  def get_arena_events(self, arena_path): 
+    """
+    Returns the events taking place in an arena, without scanning the maze. 
+
+    INPUT: 
+      arena_path: The arena's string address. 
+        e.g., "the Ville:Hobbs Cafe:cafe"
+    OUTPUT: 
+      A dictionary of the tiles each event is on in the arena (which must 
+      not be changed directly). 
+    """
+    if arena_path not in self.path_ids["arena"]: 
+      return dict()
+    return self.event_store.get_arena_events(
+      self.path_ids["arena"][arena_path])
 
 
   def get_tile_path(self, tile, level): 
@@ -262,33 +575,19 @@ class Maze:
     """
     x = tile[0]
     y = tile[1]
-    tile = self.tiles[y][x]
-
-    path = f"{tile['world']}"
-    if level == "world": 
-      return path
-    else: 
-      path += f":{tile['sector']}"
-    
-    if level == "sector": 
-      return path
-    else: 
-      path += f":{tile['arena']}"
+    location_paths = self.location_paths[self.location_grid[y, x]]
+    if level in PATH_LEVELS: 
+      return location_paths[PATH_LEVELS.index(level)]
+    return location_paths[-1]
 
-    if level == "arena": 
-      return path
-    else: 
-      path += f":{tile['game_object']}"
 
-    return path
-
-
-  def get_nearby_tiles(self, tile, vision_r): 
+  def get_nearby_bounds(self, tile, vision_r): 
     """
-    Given the current tile and vision_r, return a list of tiles that are 
-    within the radius. Note that this implementation looks at a square 
-    boundary when determining what is within the radius. 
-    i.e., for vision_r, returns x's. 
+    Given the current tile and vision_r, returns the bounds of the square of
+    tiles that are within the radius, clipped to the maze. Note that this 
+    implementation looks at a square boundary when determining what is 
+    within the radius. 
+    i.e., for vision_r, covers x's. 
     x x x x x 
     x x x x x
     x x P x x 
@@ -299,29 +598,211 @@ class Maze:
       tile: The tile coordinate of our interest in (x, y) form.
       vision_r: The radius of the persona's vision. 
     OUTPUT: 
-      nearby_tiles: a list of tiles that are within the radius. 
+      (left_end, right_end, top_end, bottom_end), where the right and bottom
+      ends are excluded. 
+    """
+    left_end = max(tile[0] - vision_r, 0)
+    right_end = min(tile[0] + vision_r + 1, self.maze_width)
+    top_end = max(tile[1] - vision_r, 0)
+    bottom_end = min(tile[1] + vision_r + 1, self.maze_height)
+    return left_end, right_end, top_end, bottom_end
+
+
+  def get_nearby_window(self, tile, vision_r): 
+    """
+    Returns the square of tiles within vision_r of the current tile (see 
+    get_nearby_bounds) as a (rows, columns) pair of slices, which index the
+    maze's grids (e.g., self.location_grid[window] or 
+    self.path_grids["arena"][window]) without copying them. 
+
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+      vision_r: The radius of the persona's vision. 
+    OUTPUT: 
+      window: a (slice of y, slice of x) pair. 
+    """
+    left_end, right_end, top_end, bottom_end = self.get_nearby_bounds(
+                                                 tile, vision_r)
+    return (slice(top_end, bottom_end), slice(left_end, right_end))
+
+
+  def get_nearby_locations(self, tile, vision_r): 
+    """
+    Returns the ids of the locations (see self.locations) within vision_r 
+    of the current tile, each once, in the order they first show up when 
+    going through the tiles column by column (x, then y). 
+
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+      vision_r: The radius of the persona's vision. 
+    OUTPUT: 
+      A numpy array of location ids. 
     """
-    left_end = 0
-    if tile[0] - vision_r > left_end: 
-      left_end = tile[0] - vision_r
+    window_ids = self.location_grid[self.get_nearby_window(tile, vision_r)]
+    location_ids, first_index = numpy.unique(window_ids.T.reshape(-1), 
+                                             return_index=True)
+    return location_ids[numpy.argsort(first_index)]
 
-    right_end = self.maze_width - 1
-    if tile[0] + vision_r + 1 < right_end: 
-      right_end = tile[0] + vision_r + 1
 
-    bottom_end = self.maze_height - 1
-    if tile[1] + vision_r + 1 < bottom_end: 
-      bottom_end = tile[1] + vision_r + 1
+  def get_arena_events_in_view(self, tile, vision_r): 
+    """
+    Returns the events taking place in the arena of <tile> on the tiles 
+    within vision_r of it (see get_nearby_bounds), looked up in the arena's
+    events (see tile_event_store.py) rather than tile by tile. Each event 
+    comes with the first of its tiles in view, going column by column (x, 
+    then y), and the events are ordered as a scan of those tiles would find
+    them, with the events that share a tile in the order of get_event_key. 
 
-    top_end = 0
-    if tile[1] - vision_r > top_end: 
-      top_end = tile[1] - vision_r 
+    INPUT: 
+      tile: The tile coordinate of our interest in (x, y) form.
+      vision_r: The radius of the persona's vision. 
+    OUTPUT: 
+      A list of (tile, event) pairs. 
+    """
+    left_end, right_end, top_end, bottom_end = self.get_nearby_bounds(
+                                                 tile, vision_r)
+    arena_id = int(self.path_grids["arena"][tile[1], tile[0]])
+    # <first_events> holds the events whose first tile in view is each tile. 
+    first_events = dict()
+    for event, event_tiles in (self.event_store.get_arena_events(arena_id)
+                                               .items()): 
+      in_view = [i for i in event_tiles 
+                 if left_end <= i[0] < right_end 
+                 and top_end <= i[1] < bottom_end]
+      if in_view: 
+        first_events.setdefault(min(in_view), set()).add(event)
+
+    events_in_view = []
+    for i in sorted(first_events): 
+      events_in_view += [(i, event) for event in sorted(first_events[i], 
+                                                        key=get_event_key)]
+    return events_in_view
+
+
+  def collision_changed(self): 
+    """
+    Has to be called after self.collision_maze is changed at runtime, so 
+    that the paths and distance fields worked out on the old one are 
+    dropped (see path_finder.mark_collision_changed). 
+    """
+    mark_collision_changed(self.collision_maze)
+    with self.distance_fields_lock: 
+      self.distance_fields.clear()
+    self.path_graph = None
 
-    nearby_tiles = []
-    for i in range(left_end, right_end): 
-      for j in range(top_end, bottom_end): 
-        nearby_tiles += [(i, j)]
-    return nearby_tiles
+
+  def find_path(self, start, end): 
+    """
+    Returns a path from <start> to <end>. On mazes of at least 
+    HIERARCHICAL_PATH_MIN_TILES tiles, paths longer than two clusters are 
+    found through the graph of portals (see hierarchical_path_finder.py), 
+    and are then shortest only through the portals; otherwise, and whenever
+    the graph finds none, path_finder searches the whole grid. 
+
+    INPUT: 
+      start: The tile coordinate to start from, in (x, y) form. 
+      end: The tile coordinate to reach, in (x, y) form. 
+    OUTPUT: 
+      The path, as a list of (x, y) tiles from <start> to <end> (just 
+      [<end>] if <end> cannot be reached). 
+    """
+    if (self.maze_width * self.maze_height >= HIERARCHICAL_PATH_MIN_TILES 
+        and abs(start[0] - end[0]) + abs(start[1] - end[1]) 
+            > 2 * CLUSTER_SIZE): 
+      if self.path_graph is None: 
+        self.path_graph = HierarchicalPathFinder(self.collision_maze, 
+                                                 collision_block_id, 
+                                                 self.path_grids["arena"])
+      path = self.path_graph.find_path(start, end)
+      if path: 
+        return path
+    return path_finder(self.collision_maze, start, end, collision_block_id)
+
+
+  def find_paths(self, queries): 
+    """
+    Answers many path queries at once (see path_finder.path_finder_batch): 
+    for each (start, goals) query, a shortest path to the closest of its 
+    candidate goals. On mazes of at least HIERARCHICAL_PATH_MIN_TILES 
+    tiles, each goal is looked up with find_path instead. 
+
+    INPUT: 
+      queries: A list of (start, goals) pairs, with the tiles in (x, y) 
+        form. 
+        e.g., [((72, 14), [(60, 20), (61, 20)]), ...]
+    OUTPUT: 
+      A list with, for each query, the (goal index, path) of its closest 
+      reachable goal (the first one, if several are as close), or None if 
+      none of its goals can be reached. 
+    """
+    if self.maze_width * self.maze_height < HIERARCHICAL_PATH_MIN_TILES: 
+      return path_finder_batch(self.collision_maze, queries, 
+                               collision_block_id)
+
+    results = []
+    for start, goals in queries: 
+      best = None
+      for count, goal in enumerate(goals): 
+        path = self.find_path(start, goal)
+        if tuple(path[0]) != tuple(start): 
+          continue
+        if best is None or len(path) < len(best[1]): 
+          best = (count, path)
+      results += [best]
+    return results
+
+
+  def get_distance_field(self, address, excluded_tiles=()): 
+    """
+    Returns the distance field to the tiles of a string address, less 
+    <excluded_tiles> (see path_finder.get_distance_field). The fields are 
+    worked out when first asked for, and the DISTANCE_FIELD_CACHE_SIZE most 
+    recently used ones are kept. 
+
+    INPUT: 
+      address: The string address (a key of self.address_tiles). 
+        e.g., "the Ville:Hobbs Cafe:cafe:cafe customer seating"
+      excluded_tiles: The tiles of the address to leave out. 
+    OUTPUT: 
+      The distance field. 
+    """
+    key = (address, frozenset(excluded_tiles))
+    with self.distance_fields_lock: 
+      field = self.distance_fields.get(key)
+      if field is not None: 
+        self.distance_fields.move_to_end(key)
+        return field
+
+    # We work the field out without the lock, so that other threads are not
+    # held up; if two of them do so for the same key, the last one wins. 
+    targets = [i for i in self.address_tiles[address] 
+               if i not in key[1]]
+    field = get_distance_field(self.collision_maze, targets, 
+                               collision_block_id)
+    with self.distance_fields_lock: 
+      self.distance_fields[key] = field
+      self.distance_fields.move_to_end(key)
+      if len(self.distance_fields) > DISTANCE_FIELD_CACHE_SIZE: 
+        self.distance_fields.popitem(last=False)
+    return field
+
+
+  def find_path_to_address(self, tile, address, excluded_tiles=()): 
+    """
+    Returns a shortest path from <tile> to the nearest tile of a string 
+    address, less <excluded_tiles>, read off the address's distance field 
+    (see get_distance_field). 
+
+    INPUT: 
+      tile: The tile coordinate to start from, in (x, y) form. 
+      address: The string address (a key of self.address_tiles). 
+      excluded_tiles: The tiles of the address to leave out. 
+    OUTPUT: 
+      The path, as a list of (x, y) tiles from <tile> to the target tile, or
+      None if none of the address's tiles can be reached. 
+    """
+    field = self.get_distance_field(address, excluded_tiles)
+    return path_from_distance_field(self.collision_maze, field, tile)
 
 
   def add_event_from_tile(self, curr_event, tile): 
@@ -336,7 +817,9 @@ class Maze:
     OUPUT: 
       None
     """
-    self.tiles[tile[1]][tile[0]]["events"].add(curr_event)
+    self.event_store.add(curr_event, tile)
+    if self.event_diffs is not None: 
+      self.event_diffs += [("add", curr_event, tile)]
 
 
   def remove_event_from_tile(self, curr_event, tile):
@@ -351,19 +834,15 @@ class Maze:
     OUPUT: 
       None
     """
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event == curr_event:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
+    self.event_store.remove(curr_event, tile)
+    if self.event_diffs is not None: 
+      self.event_diffs += [("remove", curr_event, tile)]
 
 
   def turn_event_from_tile_idle(self, curr_event, tile):
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event == curr_event:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
-        new_event = (event[0], None, None, None)
-        self.tiles[tile[1]][tile[0]]["events"].add(new_event)
+    self.event_store.turn_idle(curr_event, tile)
+    if self.event_diffs is not None: 
+      self.event_diffs += [("idle", curr_event, tile)]
 
 
   def remove_subject_events_from_tile(self, subject, tile):
@@ -376,10 +855,76 @@ class Maze:
     OUPUT: 
       None
     """
-    curr_tile_ev_cp = self.tiles[tile[1]][tile[0]]["events"].copy()
-    for event in curr_tile_ev_cp: 
-      if event[0] == subject:  
-        self.tiles[tile[1]][tile[0]]["events"].remove(event)
+    self.event_store.remove_subject(subject, tile)
+    if self.event_diffs is not None: 
+      self.event_diffs += [("remove_subject", subject, tile)]
+
+
+  def get_events(self): 
+    """
+    Returns the events of every tile that has any, as a list of 
+    (tile, list of events) pairs, for set_events. 
+    """
+    events = []
+    for tile, tile_events in self.event_store.items(): 
+      events += [(tile, list(tile_events))]
+    return events
+
+
+  def set_events(self, events): 
+    """
+    Replaces the events of every tile with <events> (see get_events). 
+    """
+    self.event_store.clear()
+    for tile, tile_events in events: 
+      for event in tile_events: 
+        self.event_store.add(tuple(event), tile)
+
+
+  def apply_event_diffs(self, event_diffs): 
+    """
+    Applies the changes another copy of the maze recorded in its 
+    <event_diffs> to this one. 
+    """
+    operations = {"add": self.add_event_from_tile, 
+                  "remove": self.remove_event_from_tile, 
+                  "idle": self.turn_event_from_tile_idle, 
+                  "remove_subject": self.remove_subject_events_from_tile}
+    for operation, event, tile in event_diffs: 
+      operations[operation](event, tile)
+
+
+def get_event_key(event): 
+  """
+  Returns the key events that share a tile are ordered by. The tiles hold 
+  their events in sets, whose order depends on the hashes of the events 
+  (which, for those holding None, differ from process to process) and on 
+  the order they were added in, neither of which other copies of the maze 
+  share. 
+  """
+  return tuple("" if i is None else i for i in event)
+
+
+def attach_shared_maze(spec): 
+  """
+  Builds a maze on the static grid another process shared with 
+  Maze.share_static. 
+
+  INPUT
+    spec: The spec share_static returned. 
+  OUTPUT
+    The Maze. Its <shared_memory> is the attached block, which has to stay
+    open for as long as the maze is used. 
+  """
+  shm = shared_memory.SharedMemory(name=spec["shm_name"])
+  static = {key: val for key, val in spec.items() 
+            if key not in ["shm_name", "grid_shape", "grid_dtype"]}
+  static["grid"] = numpy.ndarray(spec["grid_shape"], 
+                                 dtype=numpy.dtype(spec["grid_dtype"]), 
+                                 buffer=shm.buf)
+  maze = Maze(spec["maze_name"], static)
+  maze.shared_memory = shm
+  return maze
 
 
 
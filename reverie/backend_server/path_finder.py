@@ -5,8 +5,16 @@ File: path_finder.py
 Description: Implements various path finding functions for generative agents.
 Some of the functions are defunct. 
 """
+import collections
+import threading
 import numpy as np
 
+from instrumentation import metrics, timed_stage
+
+# <PATH_CACHE_SIZE> is the number of paths path_finder keeps, the least 
+# recently used ones being dropped first. 
+PATH_CACHE_SIZE = 4096
+
 def print_maze(maze):
   for row in maze:
     for item in row:
@@ -161,20 +169,336 @@ def path_finder_v2(a, start, end, collision_block_char, verbose=False):
   return the_path
 
 
+# <_passable_grids> holds the passability grid of each collision maze (see 
+# get_passable_grid), keyed by the id of the maze and the collision block 
+# character, along with the maze itself so that its id is not reused. 
+_passable_grids = dict()
+# <_collision_versions> holds the version of each collision maze that was 
+# changed at runtime (see mark_collision_changed), keyed by the id of the 
+# maze, along with the maze itself. 
+_collision_versions = dict()
+# <_path_cache> holds the paths path_finder found, least recently used 
+# first: (id of the maze, collision block character, start, end) -> 
+# (collision version, path). A maze with cached paths is kept alive by 
+# <_passable_grids> or <_collision_versions>, so its id is not reused. 
+_path_cache = collections.OrderedDict()
+_path_cache_lock = threading.Lock()
+
+
+def get_collision_version(maze): 
+  """
+  Returns the version of the collision maze <maze>: 0, plus the number of 
+  times it was marked as changed. 
+  """
+  return _collision_versions.get(id(maze), (maze, 0))[1]
+
+
+def mark_collision_changed(maze): 
+  """
+  Tells path finding that the collision maze <maze> was changed: its 
+  passability grids are worked out again, and the paths cached for it no 
+  longer count, as its version is bumped. 
+  """
+  with _path_cache_lock: 
+    for key in [i for i in _passable_grids if i[0] == id(maze)]: 
+      del _passable_grids[key]
+    _collision_versions[id(maze)] = (maze, get_collision_version(maze) + 1)
+
+
+def get_passable_grid(maze, collision_block_char): 
+  """
+  Returns the passability grid of a collision maze: a numpy bool array of 
+  its shape that is True where there is no collision block. The grid is 
+  worked out once per collision maze, which is expected not to change 
+  afterwards (as is the case for Maze.collision_maze). 
+  """
+  key = (id(maze), collision_block_char)
+  if key not in _passable_grids: 
+    passable = np.array([[j != collision_block_char for j in row] 
+                         for row in maze], dtype=bool)
+    # <padded> is the flattened grid with a border of impassable tiles 
+    # around it, so that the search never has to check the maze's bounds. 
+    padded = np.zeros((passable.shape[0] + 2, passable.shape[1] + 2), 
+                      dtype=bool)
+    padded[1:-1, 1:-1] = passable
+    _passable_grids[key] = (maze, passable, padded.reshape(-1).tolist())
+  return _passable_grids[key][1]
+
+
+def path_finder_v3(a, start, end, collision_block_char, verbose=False):
+  """
+  Finds a shortest path from <start> to <end> on the collision maze <a>, 
+  with a breadth-first search from <start> over the maze's passability grid
+  (see get_passable_grid) that stops as soon as it reaches <end>. It returns
+  the same path path_finder_v2 does, as the path is traced back from <end> 
+  the same way, but it takes time in proportion to the tiles it reaches 
+  rather than to the distance times the size of the maze, and it has no 
+  limit on the length of the path. 
+
+  INPUT: 
+    a: The collision maze, as a list of rows. 
+    start: The (row, column) tile to start from. 
+    end: The (row, column) tile to reach. 
+    collision_block_char: The value of the collision maze's blocked tiles. 
+  OUTPUT: 
+    The path, as a list of (row, column) tiles from <start> to <end>. If 
+    <end> cannot be reached, the path is just [<end>]. 
+  """
+  get_passable_grid(a, collision_block_char)
+  passable = _passable_grids[(id(a), collision_block_char)][2]
+  width = len(a[0]) + 2
+  start_index = (start[0] + 1) * width + start[1] + 1
+  end_index = (end[0] + 1) * width + end[1] + 1
+
+  # <m> holds, for each reached tile of the padded grid, 1 plus its 
+  # distance from <start> (0 for the tiles not reached yet). 
+  m = [0] * len(passable)
+  m[start_index] = 1
+  queue = collections.deque([start_index])
+  while queue and not m[end_index]: 
+    curr = queue.popleft()
+    k = m[curr] + 1
+    for step in (curr - width, curr - 1, curr + width, curr + 1): 
+      if passable[step] and not m[step]: 
+        m[step] = k
+        queue.append(step)
+
+  the_path = _trace_path(m, end_index, width)
+  return [(i // width - 1, i % width - 1) for i in the_path]
+
+
+def _trace_path(m, end_index, width): 
+  """
+  Traces the path to <end_index> back to the start of the search that 
+  labeled the padded tiles <m> (see path_finder_v3), preferring the tiles 
+  above, to the left, below and to the right, in that order, like 
+  path_finder_v2. Returns the path's padded tile indices, from the start. 
+  """
+  curr = end_index
+  k = m[curr]
+  the_path = [end_index]
+  while k > 1: 
+    for step in (curr - width, curr - 1, curr + width, curr + 1): 
+      if m[step] == k - 1: 
+        curr = step
+        break
+    the_path.append(curr)
+    k -= 1
+
+  the_path.reverse()
+  return the_path
+
+
+def get_distance_field(maze, targets, collision_block_char): 
+  """
+  Works out how far every tile of the collision maze <maze> is from the 
+  nearest of <targets>, with one breadth-first search from all of them at 
+  once. Targets with a collision block are left out, as path_finder cannot
+  reach them either. 
+
+  INPUT: 
+    maze: The collision maze, as a list of rows. 
+    targets: The (x, y) tiles to work out the distances to. 
+    collision_block_char: The value of the collision maze's blocked tiles. 
+  OUTPUT: 
+    The distance field: a flat numpy array over the maze's tiles, padded 
+    like the passability grid (see get_passable_grid), holding 1 plus the 
+    distance to the nearest target of each tile (0 for the tiles that 
+    cannot reach any). Read paths off it with path_from_distance_field. 
+  """
+  get_passable_grid(maze, collision_block_char)
+  passable = _passable_grids[(id(maze), collision_block_char)][2]
+  width = len(maze[0]) + 2
+
+  m = [0] * len(passable)
+  queue = collections.deque()
+  for x, y in targets: 
+    target_index = (y + 1) * width + x + 1
+    if passable[target_index] and not m[target_index]: 
+      m[target_index] = 1
+      queue.append(target_index)
+  while queue: 
+    curr = queue.popleft()
+    k = m[curr] + 1
+    for step in (curr - width, curr - 1, curr + width, curr + 1): 
+      if passable[step] and not m[step]: 
+        m[step] = k
+        queue.append(step)
+  return np.array(m, dtype=np.int32)
+
+
+def path_from_distance_field(maze, field, start): 
+  """
+  Reads the shortest path from <start> to the nearest target of a distance
+  field (see get_distance_field) off it, by stepping to a neighbor one 
+  step closer each time, preferring the tiles above, to the left, below 
+  and to the right, in that order. 
+
+  INPUT: 
+    maze: The collision maze the field was worked out on. 
+    field: The distance field. 
+    start: The (x, y) tile to start from. It does not have to be passable. 
+  OUTPUT: 
+    The path, as a list of (x, y) tiles from <start> to the target, or None
+    if <start> cannot reach any target. 
+  """
+  width = len(maze[0]) + 2
+  curr = (start[1] + 1) * width + start[0] + 1
+  k = int(field[curr])
+  if not k: 
+    # <start> itself may be blocked (or it is not connected to any target);
+    # we then set off to its closest neighbor, if any. 
+    steps = [step for step in (curr - width, curr - 1, curr + width, curr + 1)
+             if field[step]]
+    if not steps: 
+      return None
+    k = min(int(field[step]) for step in steps) + 1
+
+  the_path = [curr]
+  while k > 1: 
+    for step in (curr - width, curr - 1, curr + width, curr + 1): 
+      if field[step] == k - 1: 
+        curr = step
+        break
+    the_path.append(curr)
+    k -= 1
+  return [(i % width - 1, i // width - 1) for i in the_path]
+
+
+@timed_stage
 def path_finder(maze, start, end, collision_block_char, verbose=False):
   # EMERGENCY PATCH
   start = (start[1], start[0])
   end = (end[1], end[0])
   # END EMERGENCY PATCH
 
-  path = path_finder_v2(maze, start, end, collision_block_char, verbose)
+  # Personas travel the same routes over and over, so we keep the paths we 
+  # found, for as long as the collision maze stays the same version. 
+  key = (id(maze), collision_block_char, tuple(start), tuple(end))
+  version = get_collision_version(maze)
+  path = _get_cached_path(key, version)
+  if path is not None: 
+    return path
+
+  path = path_finder_v3(maze, start, end, collision_block_char, verbose)
 
   new_path = []
   for i in path: 
     new_path += [(i[1], i[0])]
   path = new_path
-  
-  return path
+
+  _cache_path(key, version, path)
+  return list(path)
+
+
+@timed_stage
+def path_finder_batch(maze, queries, collision_block_char): 
+  """
+  Answers many path queries at once. Each query asks for a shortest path 
+  from a start tile to the closest of a few candidate goal tiles. Rather 
+  than one search per goal, all the queries that set off from the same 
+  tile share one breadth-first search, which runs until every one of their
+  goals is reached (or cannot be). The paths found are the ones path_finder
+  returns, and go to and come from the same path cache. 
+
+  INPUT: 
+    maze: The collision maze, as a list of rows. 
+    queries: A list of (start, goals) pairs, with the tiles in (x, y) form. 
+    collision_block_char: The value of the collision maze's blocked tiles. 
+  OUTPUT: 
+    A list with, for each query, the (goal index, path) of its closest 
+    reachable goal (the first one, if several are as close), the path being
+    a list of (x, y) tiles from the start to the goal, or None if none of 
+    its goals can be reached. 
+  """
+  version = get_collision_version(maze)
+  # <paths> holds the path to each (start, goal) pair, in (x, y) form. 
+  paths = dict()
+  # <searches> holds the goals that are not cached yet for each start. 
+  searches = dict()
+  for start, goals in queries: 
+    start = tuple(start)
+    for goal in goals: 
+      goal = tuple(goal)
+      if (start, goal) in paths or goal in searches.get(start, ()): 
+        continue
+      key = (id(maze), collision_block_char, (start[1], start[0]), 
+             (goal[1], goal[0]))
+      path = _get_cached_path(key, version)
+      if path is not None: 
+        paths[(start, goal)] = path
+      else: 
+        searches.setdefault(start, set()).add(goal)
+
+  if searches: 
+    get_passable_grid(maze, collision_block_char)
+    passable = _passable_grids[(id(maze), collision_block_char)][2]
+    width = len(maze[0]) + 2
+  for start, goals in searches.items(): 
+    goal_indices = set((y + 1) * width + x + 1 for x, y in goals)
+    start_index = (start[1] + 1) * width + start[0] + 1
+    m = [0] * len(passable)
+    m[start_index] = 1
+    remaining = len(goal_indices - {start_index})
+    queue = collections.deque([start_index])
+    while queue and remaining: 
+      curr = queue.popleft()
+      k = m[curr] + 1
+      for step in (curr - width, curr - 1, curr + width, curr + 1): 
+        if passable[step] and not m[step]: 
+          m[step] = k
+          queue.append(step)
+          if step in goal_indices: 
+            remaining -= 1
+
+    # Like path_finder, a goal that cannot be reached gets the path 
+    # [goal]. 
+    for goal in goals: 
+      goal_index = (goal[1] + 1) * width + goal[0] + 1
+      path = [(i % width - 1, i // width - 1) 
+              for i in _trace_path(m, goal_index, width)]
+      key = (id(maze), collision_block_char, (start[1], start[0]), 
+             (goal[1], goal[0]))
+      _cache_path(key, version, path)
+      paths[(start, goal)] = path
+
+  results = []
+  for start, goals in queries: 
+    start = tuple(start)
+    best = None
+    for count, goal in enumerate(goals): 
+      path = paths[(start, tuple(goal))]
+      if path[0] != start: 
+        continue
+      if best is None or len(path) < len(best[1]): 
+        best = (count, list(path))
+    results += [best]
+  return results
+
+
+def _get_cached_path(key, version): 
+  """
+  Returns a copy of the path cached under <key> for the collision maze 
+  version <version>, or None if there is none, and records the hit or 
+  miss. 
+  """
+  with _path_cache_lock: 
+    cached = _path_cache.get(key)
+    if cached and cached[0] == version: 
+      _path_cache.move_to_end(key)
+  if cached and cached[0] == version: 
+    metrics.record_cache(True)
+    return list(cached[1])
+  metrics.record_cache(False)
+  return None
+
+
+def _cache_path(key, version, path): 
+  with _path_cache_lock: 
+    _path_cache[key] = (version, path)
+    _path_cache.move_to_end(key)
+    if len(_path_cache) > PATH_CACHE_SIZE: 
+      _path_cache.popitem(last=False)
 
 
 def closest_coordinate(curr_coordinate, target_coordinates): 
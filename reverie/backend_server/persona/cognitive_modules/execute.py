@@ -41,6 +41,9 @@ def execute(persona, maze, personas, plan):
     # <target_tiles> is a list of tile coordinates where the persona may go 
     # to execute the current action. The goal is to pick one of them.
     target_tiles = None
+    # <path> is the path to the target, as a list of tile coordinates 
+    # starting with the persona's current tile. 
+    path = None
 
     print ('aldhfoaf/????')
     print (plan)
@@ -49,25 +52,21 @@ def execute(persona, maze, personas, plan):
       # Executing persona-persona interaction.
       target_p_tile = (personas[plan.split("<persona>")[-1].strip()]
                        .scratch.curr_tile)
-      potential_path = path_finder(maze.collision_maze, 
-                                   persona.scratch.curr_tile, 
-                                   target_p_tile, 
-                                   collision_block_id)
+      potential_path = maze.find_path(persona.scratch.curr_tile, 
+                                      target_p_tile)
       if len(potential_path) <= 2: 
         target_tiles = [potential_path[0]]
       else: 
-        potential_1 = path_finder(maze.collision_maze, 
-                                persona.scratch.curr_tile, 
-                                potential_path[int(len(potential_path)/2)], 
-                                collision_block_id)
-        potential_2 = path_finder(maze.collision_maze, 
-                                persona.scratch.curr_tile, 
-                                potential_path[int(len(potential_path)/2)+1], 
-                                collision_block_id)
-        if len(potential_1) <= len(potential_2): 
-          target_tiles = [potential_path[int(len(potential_path)/2)]]
+        # We head to whichever of the two tiles half-way is closer, both 
+        # answered by one search (see Maze.find_paths). 
+        potential_tiles = [potential_path[int(len(potential_path)/2)], 
+                           potential_path[int(len(potential_path)/2)+1]]
+        closest = maze.find_paths([(persona.scratch.curr_tile, 
+                                    potential_tiles)])[0]
+        if closest is None: 
+          target_tiles = [potential_tiles[0]]
         else: 
-          target_tiles = [potential_path[int(len(potential_path)/2+1)]]
+          target_tiles = [potential_tiles[closest[0]]]
     
     elif "<waiting>" in plan: 
       # Executing interaction where the persona has decided to wait before 
@@ -80,7 +79,7 @@ def execute(persona, maze, personas, plan):
       # Executing a random location action.
       plan = ":".join(plan.split(":")[:-1])
       target_tiles = maze.address_tiles[plan]
-      target_tiles = random.sample(list(target_tiles), 1)
+      target_tiles = persona.rng.sample(list(target_tiles), 1)
 
     else: 
       # This is our default execution. We simply take the persona to the
@@ -92,53 +91,61 @@ def execute(persona, maze, personas, plan):
         maze.address_tiles["Johnson Park:park:park garden"] #ERRORRRRRRR
       else: 
         target_tiles = maze.address_tiles[plan]
-
-    # There are sometimes more than one tile returned from this (e.g., a tabe
-    # may stretch many coordinates). So, we sample a few here. And from that 
-    # random sample, we will take the closest ones. 
-    if len(target_tiles) < 4: 
-      target_tiles = random.sample(list(target_tiles), len(target_tiles))
-    else:
-      target_tiles = random.sample(list(target_tiles), 4)
-    # If possible, we want personas to occupy different tiles when they are 
-    # headed to the same location on the maze. It is ok if they end up on the 
-    # same time, but we try to lower that probability. 
-    # We take care of that overlap here.  
-    persona_name_set = set(personas.keys())
-    new_target_tiles = []
-    for i in target_tiles: 
-      curr_event_set = maze.access_tile(i)["events"]
-      pass_curr_tile = False
-      for j in curr_event_set: 
-        if j[0] in persona_name_set: 
-          pass_curr_tile = True
-      if not pass_curr_tile: 
-        new_target_tiles += [i]
-    if len(new_target_tiles) == 0: 
-      new_target_tiles = target_tiles
-    target_tiles = new_target_tiles
-
-    # Now that we've identified the target tile, we find the shortest path to
-    # one of the target tiles. 
-    curr_tile = persona.scratch.curr_tile
-    collision_maze = maze.collision_maze
-    closest_target_tile = None
-    path = None
-    for i in target_tiles: 
-      # path_finder takes a collision_mze and the curr_tile coordinate as 
-      # an input, and returns a list of coordinate tuples that becomes the
+        # We head to the closest of the target tiles, which the maze reads 
+        # off the address's cached distance field. If possible, we want 
+        # personas to occupy different tiles when they are headed to the 
+        # same location on the maze, so we leave out the tiles other 
+        # personas are on, unless they are on all of them. 
+        occupied_tiles = set()
+        for persona_name in personas: 
+          occupied_tiles.update(maze.get_subject_tiles(persona_name))
+        occupied_tiles &= target_tiles
+        if len(occupied_tiles) == len(target_tiles): 
+          occupied_tiles = set()
+        path = maze.find_path_to_address(persona.scratch.curr_tile, plan, 
+                                         occupied_tiles)
+
+    if path is None: 
+      # There are sometimes more than one tile returned from this (e.g., a 
+      # tabe may stretch many coordinates). So, we sample a few here. And 
+      # from that random sample, we will take the closest ones. 
+      if len(target_tiles) < 4: 
+        target_tiles = persona.rng.sample(list(target_tiles), 
+                                            len(target_tiles))
+      else:
+        target_tiles = persona.rng.sample(list(target_tiles), 4)
+      # If possible, we want personas to occupy different tiles when they 
+      # are headed to the same location on the maze. It is ok if they end up
+      # on the same time, but we try to lower that probability. 
+      # We take care of that overlap here.  
+      persona_name_set = set(personas.keys())
+      new_target_tiles = []
+      for i in target_tiles: 
+        curr_event_set = maze.get_tile_events(i)
+        pass_curr_tile = False
+        for j in curr_event_set: 
+          if j[0] in persona_name_set: 
+            pass_curr_tile = True
+        if not pass_curr_tile: 
+          new_target_tiles += [i]
+      if len(new_target_tiles) == 0: 
+        new_target_tiles = target_tiles
+      target_tiles = new_target_tiles
+
+      # Now that we've identified the target tile, we find the shortest path
+      # to one of the target tiles, all of them in one query (see 
+      # Maze.find_paths). It returns the closest target tile that can be 
+      # reached, along with a list of coordinate tuples that becomes the 
       # path. 
       # e.g., [(0, 1), (1, 1), (1, 2), (1, 3), (1, 4)...]
-      curr_path = path_finder(maze.collision_maze, 
-                              curr_tile, 
-                              i, 
-                              collision_block_id)
-      if not closest_target_tile: 
-        closest_target_tile = i
-        path = curr_path
-      elif len(curr_path) < len(path): 
-        closest_target_tile = i
-        path = curr_path
+      curr_tile = persona.scratch.curr_tile
+      closest = maze.find_paths([(curr_tile, target_tiles)])[0]
+      if closest is None: 
+        closest_target_tile = target_tiles[0]
+        path = maze.find_path(curr_tile, closest_target_tile)
+      else: 
+        closest_target_tile = target_tiles[closest[0]]
+        path = closest[1]
 
     # Actually setting the <planned_path> and <act_path_set>. We cut the 
     # first element in the planned_path because it includes the curr_tile. 
@@ -5,13 +5,19 @@ File: perceive.py
 Description: This defines the "Perceive" module for generative agents. 
 """
 import sys
+import numpy
 sys.path.append('../../')
 
-from operator import itemgetter
 from global_methods import *
+from instrumentation import timed_stage
 from persona.prompt_template.gpt_structure import *
 from persona.prompt_template.run_gpt_prompt import *
+from persona.prompt_template.defunct_run_gpt_prompt import (
+    run_gpt_prompt_event_poignancy,
+    run_gpt_prompt_chat_poignancy
+)
 
+@timed_stage
 def generate_poig_score(persona, event_type, description): 
   if "is idle" in description: 
     return 1
@@ -22,85 +28,149 @@ def generate_poig_score(persona, event_type, description):
     return run_gpt_prompt_chat_poignancy(persona, 
                            persona.scratch.act_description)[0]
 
-def perceive(persona, maze): 
+def perceive_space(persona, maze): 
   """
-  Perceives events around the persona and saves it to the memory, both events 
-  and spaces. 
-
-  We first perceive the events nearby the persona, as determined by its 
-  <vision_r>. If there are a lot of events happening within that radius, we 
-  take the <att_bandwidth> of the closest events. Finally, we check whether
-  any of them are new, as determined by <retention>. If they are new, then we
-  save those and return the <ConceptNode> instances for those events. 
+  Stores the space the persona sees, within its vision radius, in its 
+  spatial memory.
 
   INPUT: 
     persona: An instance of <Persona> that represents the current persona. 
     maze: An instance of <Maze> that represents the current maze in which the 
           persona is acting in. 
   OUTPUT: 
-    ret_events: a list of <ConceptNode> that are perceived and new. 
+    None
   """
-  # PERCEIVE SPACE
-  # We get the nearby tiles given our current tile and the persona's vision
-  # radius. 
-  nearby_tiles = maze.get_nearby_tiles(persona.scratch.curr_tile, 
-                                       persona.scratch.vision_r)
-
-  # We then store the perceived space. Note that the s_mem of the persona is
-  # in the form of a tree constructed using dictionaries. 
-  for i in nearby_tiles: 
-    i = maze.access_tile(i)
+  # Tiles at the same location add the same branch to the tree, so we only
+  # go through each location once, in the order the tiles first show it.
+  location_ids = maze.get_nearby_locations(persona.scratch.curr_tile, 
+                                           persona.scratch.vision_r)
+
+  # Note that the s_mem of the persona is in the form of a tree constructed
+  # using dictionaries. 
+  for location_id in location_ids.tolist(): 
+    world, sector, arena, game_object = maze.locations[location_id]
+    i = {"world": world, "sector": sector, "arena": arena, 
+         "game_object": game_object}
     if i["world"]: 
       if (i["world"] not in persona.s_mem.tree): 
         persona.s_mem.tree[i["world"]] = {}
+        persona.s_mem.mark_changed()
     if i["sector"]: 
       if (i["sector"] not in persona.s_mem.tree[i["world"]]): 
         persona.s_mem.tree[i["world"]][i["sector"]] = {}
+        persona.s_mem.mark_changed()
     if i["arena"]: 
       if (i["arena"] not in persona.s_mem.tree[i["world"]]
                                               [i["sector"]]): 
         persona.s_mem.tree[i["world"]][i["sector"]][i["arena"]] = []
+        persona.s_mem.mark_changed()
     if i["game_object"]: 
       if (i["game_object"] not in persona.s_mem.tree[i["world"]]
                                                     [i["sector"]]
                                                     [i["arena"]]): 
         persona.s_mem.tree[i["world"]][i["sector"]][i["arena"]] += [
                                                              i["game_object"]]
+        persona.s_mem.mark_changed()
 
-  # PERCEIVE EVENTS. 
+
+def get_events_in_view(persona, maze): 
+  """
+  Returns the events the persona pays attention to: the <att_bandwidth> 
+  closest events within its vision radius that take place in the persona's 
+  current arena. 
+
+  INPUT: 
+    persona: An instance of <Persona> that represents the current persona. 
+    maze: An instance of <Maze> that represents the current maze in which the 
+          persona is acting in. 
+  OUTPUT: 
+    perceived_events: a list of event quadruples, closest first. 
+  """
   # We will perceive events that take place in the same arena as the
-  # persona's current arena. 
-  curr_arena_path = maze.get_tile_path(persona.scratch.curr_tile, "arena")
-  # We do not perceive the same event twice (this can happen if an object is
-  # extended across multiple tiles).
-  percept_events_set = set()
-  # We will order our percept based on the distance, with the closest ones
-  # getting priorities. 
-  percept_events_list = []
-  # First, we put all events that are occuring in the nearby tiles into the
-  # percept_events_list
-  for tile in nearby_tiles: 
-    tile_details = maze.access_tile(tile)
-    if tile_details["events"]: 
-      if maze.get_tile_path(tile, "arena") == curr_arena_path:  
-        # This calculates the distance between the persona's current tile, 
-        # and the target tile.
-        dist = math.dist([tile[0], tile[1]], 
-                         [persona.scratch.curr_tile[0], 
-                          persona.scratch.curr_tile[1]])
-        # Add any relevant events to our temp set/list with the distant info. 
-        for event in tile_details["events"]: 
-          if event not in percept_events_set: 
-            percept_events_list += [[dist, event]]
-            percept_events_set.add(event)
+  # persona's current arena. The maze looks them up in its index of the 
+  # arena's events, each with the first of its tiles in view (we do not 
+  # perceive the same event twice; this can happen if an object is extended
+  # across multiple tiles). 
+  curr_x, curr_y = persona.scratch.curr_tile
+  events_in_view = maze.get_arena_events_in_view(persona.scratch.curr_tile, 
+                                                 persona.scratch.vision_r)
+  if not events_in_view: 
+    return []
 
   # We sort, and perceive only persona.scratch.att_bandwidth of the closest
   # events. If the bandwidth is larger, then it means the persona can perceive
-  # more elements within a small area. 
-  percept_events_list = sorted(percept_events_list, key=itemgetter(0))
-  perceived_events = []
-  for dist, event in percept_events_list[:persona.scratch.att_bandwidth]: 
-    perceived_events += [event]
+  # more elements within a small area. The sort is stable, so that events 
+  # at the same distance keep the order the maze found them in. 
+  tiles = numpy.array([tile for tile, event in events_in_view], 
+                      dtype=numpy.int64)
+  dists = numpy.sqrt((tiles[:, 0] - curr_x) ** 2 + (tiles[:, 1] - curr_y) ** 2)
+  closest = numpy.argsort(dists, kind="stable")[
+              :persona.scratch.att_bandwidth]
+  perceived_events = [events_in_view[i][1] for i in closest.tolist()]
+  return perceived_events
+
+
+def get_event_triple(p_event): 
+  """
+  Returns the (subject, predicate, object) triple an event quadruple is 
+  remembered by, with events that have no predicate defaulting to "idle".
+  """
+  s, p, o, desc = p_event
+  if not p: 
+    p = "is"
+    o = "idle"
+  return (s, p, o)
+
+
+def glance(persona, maze): 
+  """
+  A light version of perceive for personas that are in the middle of an 
+  action (see cognition_scheduler.py). It stores the perceived space just 
+  like perceive does, and tells whether perceive would store any new event, 
+  without adding anything to the associative memory. 
+
+  INPUT: 
+    persona: An instance of <Persona> that represents the current persona. 
+    maze: An instance of <Maze> that represents the current maze in which the 
+          persona is acting in. 
+  OUTPUT: 
+    True if any of the events in view is new to the persona. 
+  """
+  perceive_space(persona, maze)
+
+  latest_events = persona.a_mem.get_summarized_latest_events(
+                                  persona.scratch.retention)
+  for p_event in get_events_in_view(persona, maze): 
+    if get_event_triple(p_event) not in latest_events: 
+      return True
+  return False
+
+
+def perceive(persona, maze): 
+  """
+  Perceives events around the persona and saves it to the memory, both events 
+  and spaces. 
+
+  We first perceive the events nearby the persona, as determined by its 
+  <vision_r>. If there are a lot of events happening within that radius, we 
+  take the <att_bandwidth> of the closest events. Finally, we check whether
+  any of them are new, as determined by <retention>. If they are new, then we
+  save those and return the <ConceptNode> instances for those events. 
+
+  INPUT: 
+    persona: An instance of <Persona> that represents the current persona. 
+    maze: An instance of <Maze> that represents the current maze in which the 
+          persona is acting in. 
+  OUTPUT: 
+    ret_events: a list of <ConceptNode> that are perceived and new. 
+  """
+  # PERCEIVE SPACE
+  # We store the space within the persona's vision radius around its current
+  # tile. 
+  perceive_space(persona, maze)
+
+  # PERCEIVE EVENTS. 
+  perceived_events = get_events_in_view(persona, maze)
 
   # Storing events. 
   # <ret_events> is a list of <ConceptNode> instances from the persona's 
@@ -110,11 +180,10 @@ def perceive(persona, maze):
     s, p, o, desc = p_event
     if not p: 
       # If the object is not present, then we default the event to "idle".
-      p = "is"
-      o = "idle"
       desc = "idle"
     desc = f"{s.split(':')[-1]} is {desc}"
-    p_event = (s, p, o)
+    p_event = get_event_triple(p_event)
+    s, p, o = p_event
 
     # We retrieve the latest persona.scratch.retention events. If there is  
     # something new that is happening (that is, p_event not in latest_events),
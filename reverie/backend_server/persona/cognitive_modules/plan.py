@@ -12,6 +12,7 @@ import time
 sys.path.append('../../')
 
 from global_methods import *
+from instrumentation import timed_stage
 from persona.prompt_template.run_gpt_prompt import *
 from persona.cognitive_modules.retrieve import *
 from persona.cognitive_modules.converse import *
@@ -20,7 +21,17 @@ from persona.prompt_template.defunct_run_gpt_prompt import (
     run_gpt_prompt_wake_up_hour, 
     run_gpt_prompt_task_decomp,
     run_gpt_prompt_action_sector,
-    run_gpt_prompt_action_arena
+    run_gpt_prompt_action_arena,
+    run_gpt_prompt_action_game_object,
+    run_gpt_prompt_pronunciatio,
+    run_gpt_prompt_event_triple,
+    run_gpt_prompt_act_obj_desc,
+    run_gpt_prompt_act_obj_event_triple,
+    run_gpt_prompt_new_decomp_schedule,
+    run_gpt_prompt_decide_to_talk,
+    run_gpt_prompt_decide_to_react,
+    run_gpt_prompt_create_conversation,
+    run_gpt_prompt_summarize_conversation
 )
 
 ##############################################################################
@@ -29,6 +40,7 @@ from persona.prompt_template.defunct_run_gpt_prompt import (
 
 from ..prompt_template.defunct_run_gpt_prompt import run_gpt_prompt_wake_up_hour
 
+@timed_stage
 def generate_wake_up_hour(persona):
   """
   Generates the time when the persona wakes up. This becomes an integral part
@@ -47,6 +59,7 @@ def generate_wake_up_hour(persona):
   return int(run_gpt_prompt_wake_up_hour(persona)[0])
 
 
+@timed_stage
 def generate_first_daily_plan(persona, wake_up_hour): 
   """
   Generates the daily plan for the persona. 
@@ -77,6 +90,7 @@ def generate_first_daily_plan(persona, wake_up_hour):
   return run_gpt_prompt_daily_plan(persona, wake_up_hour)[0]
 
 
+@timed_stage
 def generate_hourly_schedule(persona, wake_up_hour): 
   """
   Based on the daily req, creates an hourly schedule -- one hour at a time. 
@@ -147,6 +161,7 @@ def generate_hourly_schedule(persona, wake_up_hour):
   return n_m1_hourly_compressed
 
 
+@timed_stage
 def generate_task_decomp(persona, task, duration): 
   """
   A few shot decomposition of a task given the task description 
@@ -180,6 +195,7 @@ def generate_task_decomp(persona, task, duration):
     return [("Perform generic task", duration)]
 
 
+@timed_stage
 def generate_action_sector(act_desp, persona, maze): 
   """TODO 
   Given the persona and the task description, choose the action_sector. 
@@ -198,6 +214,7 @@ def generate_action_sector(act_desp, persona, maze):
   return run_gpt_prompt_action_sector(act_desp, persona, maze, repeat=5)[0]
 
 
+@timed_stage
 def generate_action_arena(act_desp, persona, maze, act_world, act_sector): 
   """TODO 
   Given the persona and the task description, choose the action_arena. 
@@ -216,6 +233,7 @@ def generate_action_arena(act_desp, persona, maze, act_world, act_sector):
   return run_gpt_prompt_action_arena(act_desp, persona, maze, act_world, act_sector)[0]
 
 
+@timed_stage
 def generate_action_game_object(act_desp, act_address, persona, maze):
   """TODO
   Given the action description and the act address (the address where
@@ -239,6 +257,7 @@ def generate_action_game_object(act_desp, act_address, persona, maze):
   return run_gpt_prompt_action_game_object(act_desp, persona, maze, act_address)[0]
 
 
+@timed_stage
 def generate_action_pronunciatio(act_desp, persona): 
   """TODO 
   Given an action description, creates an emoji string description via a few
@@ -265,6 +284,7 @@ def generate_action_pronunciatio(act_desp, persona):
   return x
 
 
+@timed_stage
 def generate_action_event_triple(act_desp, persona): 
   """TODO 
 
@@ -280,16 +300,19 @@ def generate_action_event_triple(act_desp, persona):
   return run_gpt_prompt_event_triple(act_desp, persona)[0]
 
 
+@timed_stage
 def generate_act_obj_desc(act_game_object, act_desp, persona): 
   if debug: print ("GNS FUNCTION: <generate_act_obj_desc>")
   return run_gpt_prompt_act_obj_desc(act_game_object, act_desp, persona)[0]
 
 
+@timed_stage
 def generate_act_obj_event_triple(act_game_object, act_obj_desc, persona): 
   if debug: print ("GNS FUNCTION: <generate_act_obj_event_triple>")
   return run_gpt_prompt_act_obj_event_triple(act_game_object, act_obj_desc, persona)[0]
 
 
+@timed_stage
 def generate_convo(maze, init_persona, target_persona): 
   curr_loc = maze.access_tile(init_persona.scratch.curr_tile)
 
@@ -309,11 +332,13 @@ def generate_convo(maze, init_persona, target_persona):
   return convo, convo_length
 
 
+@timed_stage
 def generate_convo_summary(persona, convo): 
   convo_summary = run_gpt_prompt_summarize_conversation(persona, convo)[0]
   return convo_summary
 
 
+@timed_stage
 def generate_decide_to_talk(init_persona, target_persona, retrieved): 
   x =run_gpt_prompt_decide_to_talk(init_persona, target_persona, retrieved)[0]
   if debug: print ("GNS FUNCTION: <generate_decide_to_talk>")
@@ -324,11 +349,13 @@ def generate_decide_to_talk(init_persona, target_persona, retrieved):
     return False
 
 
+@timed_stage
 def generate_decide_to_react(init_persona, target_persona, retrieved): 
   if debug: print ("GNS FUNCTION: <generate_decide_to_react>")
   return run_gpt_prompt_decide_to_react(init_persona, target_persona, retrieved)[0]
 
 
+@timed_stage
 def generate_new_decomp_schedule(persona, inserted_act, inserted_act_dur,  start_hour, end_hour): 
   # Step 1: Setting up the core variables for the function. 
   # <p> is the persona whose schedule we are editing right now. 
@@ -700,7 +727,7 @@ def _choose_retrieved(persona, retrieved):
         and curr_event.subject != persona.name): 
       priority += [rel_ctx]
   if priority: 
-    return random.choice(priority)
+    return persona.rng.choice(priority)
 
   # Skip idle. 
   for event_desc, rel_ctx in retrieved.items(): 
@@ -708,7 +735,7 @@ def _choose_retrieved(persona, retrieved):
     if "is idle" not in event_desc: 
       priority += [rel_ctx]
   if priority: 
-    return random.choice(priority)
+    return persona.rng.choice(priority)
   return None
 
 
@@ -1005,6 +1032,22 @@ def plan(persona, maze, personas, new_day, retrieved):
       #   _chat_react(persona, focused_event, reaction_mode, personas)
 
   # Step 3: Chat-related state clean up. 
+  update_chat_state(persona)
+
+  return persona.scratch.act_address
+
+
+def update_chat_state(persona): 
+  """
+  The chat-related bookkeeping plan does at the end of every step. This is
+  also called on its own for personas that skip plan in the middle of an 
+  action (see Persona.move). 
+
+  INPUT: 
+    persona: Current <Persona> instance whose chat state we are updating. 
+  OUTPUT 
+    None
+  """
   # If the persona is not chatting with anyone, we clean up any of the 
   # chat-related states here. 
   if persona.scratch.act_event[1] != "chat with":
@@ -1020,8 +1063,6 @@ def plan(persona, maze, personas, new_day, retrieved):
     if persona_name != persona.scratch.chatting_with: 
       persona.scratch.chatting_with_buffer[persona_name] -= 1
 
-  return persona.scratch.act_address
-
 
 
 
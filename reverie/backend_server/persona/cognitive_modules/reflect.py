@@ -14,10 +14,21 @@ from numpy import dot
 from numpy.linalg import norm
 
 from global_methods import *
+from instrumentation import timed_stage
 from persona.prompt_template.run_gpt_prompt import *
+from persona.prompt_template.defunct_run_gpt_prompt import (
+    run_gpt_prompt_event_triple,
+    run_gpt_prompt_event_poignancy,
+    run_gpt_prompt_chat_poignancy,
+    run_gpt_prompt_focal_pt,
+    run_gpt_prompt_insight_and_guidance,
+    run_gpt_prompt_planning_thought_on_convo,
+    run_gpt_prompt_memo_on_convo
+)
 from persona.prompt_template.gpt_structure import *
 from persona.cognitive_modules.retrieve import *
 
+@timed_stage
 def generate_focal_points(persona, n=3): 
   if debug: print ("GNS FUNCTION: <generate_focal_points>")
   
@@ -35,6 +46,7 @@ def generate_focal_points(persona, n=3):
   return run_gpt_prompt_focal_pt(persona, statements, n)[0]
 
 
+@timed_stage
 def generate_insights_and_evidence(persona, nodes, n=5): 
   if debug: print ("GNS FUNCTION: <generate_insights_and_evidence>")
 
@@ -55,6 +67,7 @@ def generate_insights_and_evidence(persona, nodes, n=5):
     return {"this is blank": "node_1"} 
 
 
+@timed_stage
 def generate_action_event_triple(act_desp, persona): 
   """TODO 
 
@@ -70,6 +83,7 @@ def generate_action_event_triple(act_desp, persona):
   return run_gpt_prompt_event_triple(act_desp, persona)[0]
 
 
+@timed_stage
 def generate_poig_score(persona, event_type, description): 
   if debug: print ("GNS FUNCTION: <generate_poig_score>")
 
@@ -84,11 +98,13 @@ def generate_poig_score(persona, event_type, description):
 
 
 
+@timed_stage
 def generate_planning_thought_on_convo(persona, all_utt):
   if debug: print ("GNS FUNCTION: <generate_planning_thought_on_convo>")
   return run_gpt_prompt_planning_thought_on_convo(persona, all_utt)[0]
 
 
+@timed_stage
 def generate_memo_on_convo(persona, all_utt):
   if debug: print ("GNS FUNCTION: <generate_memo_on_convo>")
   return run_gpt_prompt_memo_on_convo(persona, all_utt)[0]
@@ -264,7 +264,7 @@ def new_retrieve(persona, focal_points, n_count=30):
                     for key in list(master_out.keys())]
 
     for n in master_nodes: 
-      n.last_accessed = persona.scratch.curr_time
+      persona.a_mem.mark_accessed(n, persona.scratch.curr_time)
       
     retrieved[focal_pt] = master_nodes
 
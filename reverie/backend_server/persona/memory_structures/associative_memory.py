@@ -48,6 +48,12 @@ class ConceptNode:
 
 
 class AssociativeMemory: 
+  # <JOURNAL_MIN_COMPACT> is the number of journaled nodes below which we 
+  # never compact. Above it, we compact once the journal holds more nodes 
+  # than the snapshot (nodes.json), which keeps the amortized cost of a save
+  # proportional to the number of nodes added since the last one. 
+  JOURNAL_MIN_COMPACT = 500
+
   def __init__(self, f_saved): 
     self.id_to_node = dict()
 
@@ -67,40 +73,7 @@ class AssociativeMemory:
     nodes_load = json.load(open(f_saved + "/nodes.json"))
     for count in range(len(nodes_load.keys())): 
       node_id = f"node_{str(count+1)}"
-      node_details = nodes_load[node_id]
-
-      node_count = node_details["node_count"]
-      type_count = node_details["type_count"]
-      node_type = node_details["type"]
-      depth = node_details["depth"]
-
-      created = datetime.datetime.strptime(node_details["created"], 
-                                           '%Y-%m-%d %H:%M:%S')
-      expiration = None
-      if node_details["expiration"]: 
-        expiration = datetime.datetime.strptime(node_details["expiration"],
-                                                '%Y-%m-%d %H:%M:%S')
-
-      s = node_details["subject"]
-      p = node_details["predicate"]
-      o = node_details["object"]
-
-      description = node_details["description"]
-      embedding_pair = (node_details["embedding_key"], 
-                        self.embeddings[node_details["embedding_key"]])
-      poignancy =node_details["poignancy"]
-      keywords = set(node_details["keywords"])
-      filling = node_details["filling"]
-      
-      if node_type == "event": 
-        self.add_event(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
-      elif node_type == "chat": 
-        self.add_chat(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
-      elif node_type == "thought": 
-        self.add_thought(created, expiration, s, p, o, 
-                   description, keywords, poignancy, embedding_pair, filling)
+      self._add_node_details(nodes_load[node_id])
 
     kw_strength_load = json.load(open(f_saved + "/kw_strength.json"))
     if kw_strength_load["kw_strength_event"]: 
@@ -108,34 +81,194 @@ class AssociativeMemory:
     if kw_strength_load["kw_strength_thought"]: 
       self.kw_strength_thought = kw_strength_load["kw_strength_thought"]
 
+    # JOURNAL
+    # Nodes added since the last full save are appended to journal.jsonl, 
+    # one json object per line: {"node": <node details as in nodes.json>, 
+    # "embedding": <the embedding, or null if it was already saved>}. 
+    # Nodes are never changed once they are added, so replaying the journal
+    # on top of the snapshot gives back the memory as it was saved. 
+    # <snapshot_node_count> is the number of nodes in nodes.json, 
+    # <saved_node_count> the number of nodes saved (snapshot + journal), and
+    # <saved_embedding_keys> the embedding keys saved so far. 
+    self.f_saved = f_saved
+    self.snapshot_node_count = len(self.id_to_node)
+    self.saved_embedding_keys = set(self.embeddings.keys())
+
+    f_journal = f_saved + "/journal.jsonl"
+    if check_if_file_exists(f_journal): 
+      entries = []
+      for line in open(f_journal): 
+        try: 
+          entries += [json.loads(line)]
+        except ValueError: 
+          # A save that was cut short can leave a partial last line. 
+          break
+      self.add_node_entries(entries)
+      self.saved_embedding_keys = set(self.embeddings.keys())
+
+    self.saved_node_count = len(self.id_to_node)
+
+    # <accessed_node_ids> are the nodes whose last_accessed changed (see 
+    # mark_accessed) since get_access_entries was last called. 
+    self.accessed_node_ids = set()
+
+
+  def get_node_entries(self, start_count, embedding_keys): 
+    """
+    Returns the journal entries (see __init__) for the nodes added after 
+    the first <start_count> nodes. The embedding is left out of an entry if
+    its key is in <embedding_keys>; the keys of the embeddings that are 
+    included are added to <embedding_keys>. 
+    """
+    entries = []
+    for count in range(start_count + 1, len(self.id_to_node) + 1): 
+      node = self.id_to_node[f"node_{str(count)}"]
+      embedding = None
+      if node.embedding_key not in embedding_keys: 
+        embedding = self.embeddings[node.embedding_key]
+        embedding_keys.add(node.embedding_key)
+      entries += [{"node": self._get_node_details(node), 
+                   "embedding": embedding}]
+    return entries
+
+
+  def mark_accessed(self, node, curr_time): 
+    """
+    Sets the last_accessed time of <node> (retrieval does this for the 
+    nodes it returns). 
+    """
+    node.last_accessed = curr_time
+    self.accessed_node_ids.add(node.node_id)
+
+
+  def get_access_entries(self): 
+    """
+    Returns {node_id: last_accessed} for the nodes marked accessed since 
+    the last call, and forgets them. 
+    """
+    entries = {node_id: self.id_to_node[node_id].last_accessed 
+               for node_id in self.accessed_node_ids}
+    self.accessed_node_ids = set()
+    return entries
+
+
+  def set_access_entries(self, entries): 
+    """
+    Sets the last_accessed times of <entries> (see get_access_entries). 
+    """
+    for node_id, last_accessed in entries.items(): 
+      self.id_to_node[node_id].last_accessed = last_accessed
+
+
+  def add_node_entries(self, entries): 
+    """
+    Adds the nodes of the journal entries <entries> (see get_node_entries). 
+    Entries for nodes that are already in the memory are skipped, so the 
+    same entries can safely be added twice (e.g., if we were interrupted 
+    while compacting the journal). 
+    """
+    for entry in entries: 
+      if entry["node"]["node_count"] <= len(self.id_to_node): 
+        continue
+      if entry["embedding"] is not None: 
+        self.embeddings[entry["node"]["embedding_key"]] = entry["embedding"]
+      self._add_node_details(entry["node"])
+
+
+  def _add_node_details(self, node_details): 
+    """
+    Adds the node described by <node_details> (one entry of nodes.json) to
+    the memory. The node's embedding must already be in self.embeddings. 
+    """
+    node_type = node_details["type"]
+
+    created = datetime.datetime.strptime(node_details["created"], 
+                                         '%Y-%m-%d %H:%M:%S')
+    expiration = None
+    if node_details["expiration"]: 
+      expiration = datetime.datetime.strptime(node_details["expiration"],
+                                              '%Y-%m-%d %H:%M:%S')
+
+    s = node_details["subject"]
+    p = node_details["predicate"]
+    o = node_details["object"]
+
+    description = node_details["description"]
+    embedding_pair = (node_details["embedding_key"], 
+                      self.embeddings[node_details["embedding_key"]])
+    poignancy =node_details["poignancy"]
+    keywords = set(node_details["keywords"])
+    filling = node_details["filling"]
+    
+    if node_type == "event": 
+      self.add_event(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+    elif node_type == "chat": 
+      self.add_chat(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+    elif node_type == "thought": 
+      self.add_thought(created, expiration, s, p, o, 
+                 description, keywords, poignancy, embedding_pair, filling)
+
+
+  def _get_node_details(self, node): 
+    """
+    Returns the nodes.json entry for <node>. 
+    """
+    r = dict()
+    r["node_count"] = node.node_count
+    r["type_count"] = node.type_count
+    r["type"] = node.type
+    r["depth"] = node.depth
+
+    r["created"] = node.created.strftime('%Y-%m-%d %H:%M:%S')
+    r["expiration"] = None
+    if node.expiration: 
+      r["expiration"] = node.expiration.strftime('%Y-%m-%d %H:%M:%S')
+
+    r["subject"] = node.subject
+    r["predicate"] = node.predicate
+    r["object"] = node.object
+
+    r["description"] = node.description
+    r["embedding_key"] = node.embedding_key
+    r["poignancy"] = node.poignancy
+    r["keywords"] = list(node.keywords)
+    r["filling"] = node.filling
+    return r
+
     
   def save(self, out_json): 
+    """
+    Saves the memory to the <out_json> folder. When saving to the folder we
+    loaded from (or last saved to), only the nodes added since the last save
+    are written, appended to journal.jsonl; the full snapshot (nodes.json, 
+    kw_strength.json and embeddings.json) is rewritten only when the journal
+    has grown too large, or when saving somewhere else. 
+    """
+    journal_count = len(self.id_to_node) - self.snapshot_node_count
+    if (out_json != self.f_saved 
+        or journal_count > max(self.JOURNAL_MIN_COMPACT, 
+                               self.snapshot_node_count)): 
+      self.save_snapshot(out_json)
+      return
+
+    with open(out_json + "/journal.jsonl", "a") as outfile: 
+      for entry in self.get_node_entries(self.saved_node_count, 
+                                         self.saved_embedding_keys): 
+        outfile.write(json.dumps(entry) + "\n")
+    self.saved_node_count = len(self.id_to_node)
+
+
+  def save_snapshot(self, out_json): 
+    """
+    Writes the whole memory to nodes.json, kw_strength.json and 
+    embeddings.json in the <out_json> folder, and clears its journal. 
+    """
     r = dict()
     for count in range(len(self.id_to_node.keys()), 0, -1): 
       node_id = f"node_{str(count)}"
-      node = self.id_to_node[node_id]
-
-      r[node_id] = dict()
-      r[node_id]["node_count"] = node.node_count
-      r[node_id]["type_count"] = node.type_count
-      r[node_id]["type"] = node.type
-      r[node_id]["depth"] = node.depth
-
-      r[node_id]["created"] = node.created.strftime('%Y-%m-%d %H:%M:%S')
-      r[node_id]["expiration"] = None
-      if node.expiration: 
-        r[node_id]["expiration"] = (node.expiration
-                                        .strftime('%Y-%m-%d %H:%M:%S'))
-
-      r[node_id]["subject"] = node.subject
-      r[node_id]["predicate"] = node.predicate
-      r[node_id]["object"] = node.object
-
-      r[node_id]["description"] = node.description
-      r[node_id]["embedding_key"] = node.embedding_key
-      r[node_id]["poignancy"] = node.poignancy
-      r[node_id]["keywords"] = list(node.keywords)
-      r[node_id]["filling"] = node.filling
+      r[node_id] = self._get_node_details(self.id_to_node[node_id])
 
     with open(out_json+"/nodes.json", "w") as outfile:
       json.dump(r, outfile)
@@ -149,6 +282,14 @@ class AssociativeMemory:
     with open(out_json+"/embeddings.json", "w") as outfile:
       json.dump(self.embeddings, outfile)
 
+    if check_if_file_exists(out_json + "/journal.jsonl"): 
+      os.remove(out_json + "/journal.jsonl")
+
+    self.f_saved = out_json
+    self.snapshot_node_count = len(self.id_to_node)
+    self.saved_node_count = len(self.id_to_node)
+    self.saved_embedding_keys = set(self.embeddings.keys())
+
 
   def add_event(self, created, expiration, s, p, o, 
                       description, keywords, poignancy, 
@@ -310,8 +451,10 @@ class AssociativeMemory:
       if i in self.kw_to_thought: 
         ret += self.kw_to_thought[i.lower()]
 
-    ret = set(ret)
-    return ret
+    # We drop the nodes found under more than one keyword, but keep the 
+    # order they were found in; a set of nodes would be ordered by their ids,
+    # which differ from one run (and process) to the next. 
+    return list(dict.fromkeys(ret))
 
 
   def retrieve_relevant_events(self, s_content, p_content, o_content): 
@@ -322,8 +465,10 @@ class AssociativeMemory:
       if i in self.kw_to_event: 
         ret += self.kw_to_event[i]
 
-    ret = set(ret)
-    return ret
+    # We drop the nodes found under more than one keyword, but keep the 
+    # order they were found in; a set of nodes would be ordered by their ids,
+    # which differ from one run (and process) to the next. 
+    return list(dict.fromkeys(ret))
 
 
   def get_last_chat(self, target_persona_name): 
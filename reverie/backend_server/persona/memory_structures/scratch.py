@@ -160,78 +160,89 @@ class Scratch:
 
     if check_if_file_exists(f_saved): 
       # If we have a bootstrap file, load that here. 
-      scratch_load = json.load(open(f_saved))
-
-      self.vision_r = scratch_load["vision_r"]
-      self.att_bandwidth = scratch_load["att_bandwidth"]
-      self.retention = scratch_load["retention"]
-
-      if scratch_load["curr_time"]: 
-        self.curr_time = datetime.datetime.strptime(scratch_load["curr_time"],
-                                                  "%B %d, %Y, %H:%M:%S")
-      else: 
-        self.curr_time = None
-      self.curr_tile = scratch_load["curr_tile"]
-      self.daily_plan_req = scratch_load["daily_plan_req"]
-
-      self.name = scratch_load["name"]
-      self.first_name = scratch_load["first_name"]
-      self.last_name = scratch_load["last_name"]
-      self.age = scratch_load["age"]
-      self.innate = scratch_load["innate"]
-      self.learned = scratch_load["learned"]
-      self.currently = scratch_load["currently"]
-      self.lifestyle = scratch_load["lifestyle"]
-      self.living_area = scratch_load["living_area"]
-
-      self.concept_forget = scratch_load["concept_forget"]
-      self.daily_reflection_time = scratch_load["daily_reflection_time"]
-      self.daily_reflection_size = scratch_load["daily_reflection_size"]
-      self.overlap_reflect_th = scratch_load["overlap_reflect_th"]
-      self.kw_strg_event_reflect_th = scratch_load["kw_strg_event_reflect_th"]
-      self.kw_strg_thought_reflect_th = scratch_load["kw_strg_thought_reflect_th"]
-
-      self.recency_w = scratch_load["recency_w"]
-      self.relevance_w = scratch_load["relevance_w"]
-      self.importance_w = scratch_load["importance_w"]
-      self.recency_decay = scratch_load["recency_decay"]
-      self.importance_trigger_max = scratch_load["importance_trigger_max"]
-      self.importance_trigger_curr = scratch_load["importance_trigger_curr"]
-      self.importance_ele_n = scratch_load["importance_ele_n"]
-      self.thought_count = scratch_load["thought_count"]
-
-      self.daily_req = scratch_load["daily_req"]
-      self.f_daily_schedule = scratch_load["f_daily_schedule"]
-      self.f_daily_schedule_hourly_org = scratch_load["f_daily_schedule_hourly_org"]
-
-      self.act_address = scratch_load["act_address"]
-      if scratch_load["act_start_time"]: 
-        self.act_start_time = datetime.datetime.strptime(
-                                              scratch_load["act_start_time"],
-                                              "%B %d, %Y, %H:%M:%S")
-      else: 
-        self.curr_time = None
-      self.act_duration = scratch_load["act_duration"]
-      self.act_description = scratch_load["act_description"]
-      self.act_pronunciatio = scratch_load["act_pronunciatio"]
-      self.act_event = tuple(scratch_load["act_event"])
-
-      self.act_obj_description = scratch_load["act_obj_description"]
-      self.act_obj_pronunciatio = scratch_load["act_obj_pronunciatio"]
-      self.act_obj_event = tuple(scratch_load["act_obj_event"])
-
-      self.chatting_with = scratch_load["chatting_with"]
-      self.chat = scratch_load["chat"]
-      self.chatting_with_buffer = scratch_load["chatting_with_buffer"]
-      if scratch_load["chatting_end_time"]: 
-        self.chatting_end_time = datetime.datetime.strptime(
-                                            scratch_load["chatting_end_time"],
-                                            "%B %d, %Y, %H:%M:%S")
-      else:
-        self.chatting_end_time = None
+      self.set_state(json.load(open(f_saved)))
+
+
+  def set_state(self, scratch_load): 
+    """
+    Loads the scratch from <scratch_load>, a dictionary in the form that 
+    get_state returns (and scratch.json holds). 
+
+    INPUT: 
+      scratch_load: The scratch state dictionary. 
+    OUTPUT: 
+      None
+    """
+    self.vision_r = scratch_load["vision_r"]
+    self.att_bandwidth = scratch_load["att_bandwidth"]
+    self.retention = scratch_load["retention"]
 
-      self.act_path_set = scratch_load["act_path_set"]
-      self.planned_path = scratch_load["planned_path"]
+    if scratch_load["curr_time"]: 
+      self.curr_time = datetime.datetime.strptime(scratch_load["curr_time"],
+                                                "%B %d, %Y, %H:%M:%S")
+    else: 
+      self.curr_time = None
+    self.curr_tile = scratch_load["curr_tile"]
+    self.daily_plan_req = scratch_load["daily_plan_req"]
+
+    self.name = scratch_load["name"]
+    self.first_name = scratch_load["first_name"]
+    self.last_name = scratch_load["last_name"]
+    self.age = scratch_load["age"]
+    self.innate = scratch_load["innate"]
+    self.learned = scratch_load["learned"]
+    self.currently = scratch_load["currently"]
+    self.lifestyle = scratch_load["lifestyle"]
+    self.living_area = scratch_load["living_area"]
+
+    self.concept_forget = scratch_load["concept_forget"]
+    self.daily_reflection_time = scratch_load["daily_reflection_time"]
+    self.daily_reflection_size = scratch_load["daily_reflection_size"]
+    self.overlap_reflect_th = scratch_load["overlap_reflect_th"]
+    self.kw_strg_event_reflect_th = scratch_load["kw_strg_event_reflect_th"]
+    self.kw_strg_thought_reflect_th = scratch_load["kw_strg_thought_reflect_th"]
+
+    self.recency_w = scratch_load["recency_w"]
+    self.relevance_w = scratch_load["relevance_w"]
+    self.importance_w = scratch_load["importance_w"]
+    self.recency_decay = scratch_load["recency_decay"]
+    self.importance_trigger_max = scratch_load["importance_trigger_max"]
+    self.importance_trigger_curr = scratch_load["importance_trigger_curr"]
+    self.importance_ele_n = scratch_load["importance_ele_n"]
+    self.thought_count = scratch_load["thought_count"]
+
+    self.daily_req = scratch_load["daily_req"]
+    self.f_daily_schedule = scratch_load["f_daily_schedule"]
+    self.f_daily_schedule_hourly_org = scratch_load["f_daily_schedule_hourly_org"]
+
+    self.act_address = scratch_load["act_address"]
+    if scratch_load["act_start_time"]: 
+      self.act_start_time = datetime.datetime.strptime(
+                                            scratch_load["act_start_time"],
+                                            "%B %d, %Y, %H:%M:%S")
+    else: 
+      self.act_start_time = None
+    self.act_duration = scratch_load["act_duration"]
+    self.act_description = scratch_load["act_description"]
+    self.act_pronunciatio = scratch_load["act_pronunciatio"]
+    self.act_event = tuple(scratch_load["act_event"])
+
+    self.act_obj_description = scratch_load["act_obj_description"]
+    self.act_obj_pronunciatio = scratch_load["act_obj_pronunciatio"]
+    self.act_obj_event = tuple(scratch_load["act_obj_event"])
+
+    self.chatting_with = scratch_load["chatting_with"]
+    self.chat = scratch_load["chat"]
+    self.chatting_with_buffer = scratch_load["chatting_with_buffer"]
+    if scratch_load["chatting_end_time"]: 
+      self.chatting_end_time = datetime.datetime.strptime(
+                                          scratch_load["chatting_end_time"],
+                                          "%B %d, %Y, %H:%M:%S")
+    else:
+      self.chatting_end_time = None
+
+    self.act_path_set = scratch_load["act_path_set"]
+    self.planned_path = scratch_load["planned_path"]
 
 
   def save(self, out_json):
@@ -243,6 +254,19 @@ class Scratch:
     OUTPUT: 
       None
     """
+    with open(out_json, "w") as outfile:
+      json.dump(self.get_state(), outfile, indent=2) 
+
+
+  def get_state(self): 
+    """
+    Returns the persona's scratch as a json serializable dictionary. 
+
+    INPUT: 
+      None
+    OUTPUT: 
+      The scratch state dictionary (what scratch.json holds). 
+    """
     scratch = dict() 
     scratch["vision_r"] = self.vision_r
     scratch["att_bandwidth"] = self.att_bandwidth
@@ -283,8 +307,11 @@ class Scratch:
     scratch["f_daily_schedule_hourly_org"] = self.f_daily_schedule_hourly_org
 
     scratch["act_address"] = self.act_address
-    scratch["act_start_time"] = (self.act_start_time
-                                     .strftime("%B %d, %Y, %H:%M:%S"))
+    if self.act_start_time: 
+      scratch["act_start_time"] = (self.act_start_time
+                                       .strftime("%B %d, %Y, %H:%M:%S"))
+    else: 
+      scratch["act_start_time"] = None
     scratch["act_duration"] = self.act_duration
     scratch["act_description"] = self.act_description
     scratch["act_pronunciatio"] = self.act_pronunciatio
@@ -305,9 +332,7 @@ class Scratch:
 
     scratch["act_path_set"] = self.act_path_set
     scratch["planned_path"] = self.planned_path
-
-    with open(out_json, "w") as outfile:
-      json.dump(scratch, outfile, indent=2) 
+    return scratch
 
 
   def get_f_daily_schedule_index(self, advance=0):
@@ -543,21 +568,33 @@ class Scratch:
     """
     if not self.act_address: 
       return True
-      
-    if self.chatting_with: 
-      end_time = self.chatting_end_time
-    else: 
-      x = self.act_start_time
-      if x.second != 0: 
-        x = x.replace(second=0)
-        x = (x + datetime.timedelta(minutes=1))
-      end_time = (x + datetime.timedelta(minutes=self.act_duration))
 
+    end_time = self.get_act_end_time()
     if end_time.strftime("%H:%M:%S") == self.curr_time.strftime("%H:%M:%S"): 
       return True
     return False
 
 
+  def get_act_end_time(self): 
+    """
+    Returns the time at which the current action finishes (see 
+    act_check_finished; only the time of the day counts there). 
+
+    INPUT
+      None
+    OUTPUT 
+      datetime instance of the end time.
+    """
+    if self.chatting_with: 
+      return self.chatting_end_time
+
+    x = self.act_start_time
+    if x.second != 0: 
+      x = x.replace(second=0)
+      x = (x + datetime.timedelta(minutes=1))
+    return (x + datetime.timedelta(minutes=self.act_duration))
+
+
   def act_summarize(self):
     """
     Summarize the current action as a dictionary. 
@@ -17,6 +17,20 @@ class MemoryTree:
     self.tree = {}
     if check_if_file_exists(f_saved): 
       self.tree = json.load(open(f_saved))
+    # <version> goes up whenever the tree changes, so that those keeping a 
+    # copy of it (e.g., the write-ahead log) can tell whether it did 
+    # without comparing the trees. Whoever changes the tree in place has to
+    # call mark_changed. 
+    self.version = 0
+
+
+  def mark_changed(self): 
+    self.version += 1
+
+
+  def set_tree(self, tree): 
+    self.tree = tree
+    self.mark_changed()
 
 
   def print_tree(self): 
@@ -56,7 +70,10 @@ class MemoryTree:
     EXAMPLE STR OUTPUT
       "bedroom, kitchen, dining room, office, bathroom"
     """
-    x = ", ".join(list(self.tree[curr_world].keys()))
+    # Sectors the persona has only seen tiles without an arena of (see 
+    # perceive) have no arenas to go to, so they are left out.
+    x = ", ".join([sector for sector, arenas in self.tree[curr_world].items()
+                   if arenas])
     return x
 
 
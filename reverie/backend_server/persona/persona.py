@@ -26,6 +26,8 @@ from persona.cognitive_modules.plan import *
 from persona.cognitive_modules.reflect import *
 from persona.cognitive_modules.execute import *
 from persona.cognitive_modules.converse import *
+from persona.prompt_template.async_gpt_structure import run_in_thread
+from instrumentation import metrics
 
 class Persona: 
   def __init__(self, name, folder_mem_saved=False):
@@ -47,6 +49,22 @@ class Persona:
     scratch_saved = f"{folder_mem_saved}/bootstrap_memory/scratch.json"
     self.scratch = Scratch(scratch_saved)
 
+    # PERSONA RANDOMNESS
+    # <rng> is the random number generator that the cognitive modules draw
+    # from (e.g., when choosing which retrieved event to focus on, or which
+    # target tiles to sample). Each persona owns its own generator so that
+    # its draws do not depend on the order in which other personas happen to
+    # run -- this is what lets us run the personas' cognition concurrently
+    # and still get the same result as a serial run.
+    self.rng = random.Random()
+
+    # PERSONA ACTIVITY
+    # <perceived_new> is whether the persona's last perceive added anything
+    # new to its associative memory. It starts as True since the persona has
+    # not looked around yet. ReverieServer uses it to tell when nothing can
+    # change for a while (see ReverieServer._get_quiet_steps). 
+    self.perceived_new = True
+
 
   def save(self, save_folder): 
     """
@@ -182,10 +200,15 @@ class Persona:
     reflect(self)
 
 
-  def move(self, maze, personas, curr_tile, curr_time):
+  def move(self, maze, personas, curr_tile, curr_time, due=True):
     """
     This is the main cognitive function where our main sequence is called. 
 
+    If the persona is not <due> (see cognition_scheduler.py), it is in the 
+    middle of an action that does not end in this step. Then, unless it is 
+    a new day or it sees something new, we skip perceive, retrieve, plan and
+    reflect, which would not change anything, and just execute. 
+
     INPUT: 
       maze: The Maze class of the current world. 
       personas: A dictionary that contains all persona names as keys, and the 
@@ -193,6 +216,7 @@ class Persona:
       curr_tile: A tuple that designates the persona's current tile location 
                  in (row, col) form. e.g., (58, 39)
       curr_time: datetime instance that indicates the game's current time. 
+      due: Whether the persona has to run its full cognitive sequence. 
     OUTPUT: 
       execution: A triple set that contains the following components: 
         <next_tile> is a x,y coordinate. e.g., (58, 9)
@@ -216,19 +240,55 @@ class Persona:
       new_day = "New day"
     self.scratch.curr_time = curr_time
 
-    # Main cognitive sequence begins here. 
-    perceived = self.perceive(maze)
-    retrieved = self.retrieve(perceived)
-    plan = self.plan(maze, personas, new_day, retrieved)
-    self.reflect()
-
-    # <execution> is a triple set that contains the following components: 
-    # <next_tile> is a x,y coordinate. e.g., (58, 9)
-    # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
-    # <description> is a string description of the movement. e.g., 
-    #   writing her next novel (editing her novel) 
-    #   @ double studio:double studio:common room:sofa
-    return self.execute(maze, personas, plan)
+    # Main cognitive sequence begins here. Each stage is recorded by the 
+    # instrumentation (see instrumentation.py) when it is enabled. 
+    with metrics.persona(self.name): 
+      if not due and not new_day: 
+        with metrics.stage("glance"): 
+          self.perceived_new = glance(self, maze)
+        if not self.perceived_new: 
+          update_chat_state(self)
+          with metrics.stage("execute"): 
+            return self.execute(maze, personas, self.scratch.act_address)
+
+      with metrics.stage("perceive"): 
+        perceived = self.perceive(maze)
+        self.perceived_new = bool(perceived)
+      with metrics.stage("retrieve"): 
+        retrieved = self.retrieve(perceived)
+      with metrics.stage("plan"): 
+        plan = self.plan(maze, personas, new_day, retrieved)
+      with metrics.stage("reflect"): 
+        self.reflect()
+
+      # <execution> is a triple set that contains the following components: 
+      # <next_tile> is a x,y coordinate. e.g., (58, 9)
+      # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
+      # <description> is a string description of the movement. e.g., 
+      #   writing her next novel (editing her novel) 
+      #   @ double studio:double studio:common room:sofa
+      with metrics.stage("execute"): 
+        return self.execute(maze, personas, plan)
+
+
+  async def move_async(self, maze, personas, curr_tile, curr_time,
+                       due=True, executor=None):
+    """
+    The asynchronous variant of move. The cognitive sequence runs on a 
+    worker thread (from <executor>, or the event loop's default executor), 
+    and every LLM and embedding request it makes is awaited on the calling
+    event loop. This lets one event loop keep the requests of many personas
+    in flight at once, within the per backend limits set in
+    async_gpt_structure.BACKEND_CONCURRENCY.
+
+    INPUT: 
+      See move. 
+      executor: Optional concurrent.futures executor for the worker thread.
+    OUTPUT: 
+      See move. 
+    """
+    return await run_in_thread(self.move, maze, personas, curr_tile, 
+                               curr_time, due, executor=executor)
 
 
   def open_convo_session(self, convo_mode): 
@@ -0,0 +1,351 @@
+"""
+File: async_gpt_structure.py
+Description: Asynchronous wrappers for calling the LangFlow and OpenAI APIs.
+
+All LLM and embedding round trips are funneled through one asyncio event
+loop, so many requests (across personas and steps) can be in flight at once
+while each backend keeps a bounded number of concurrent requests. The
+synchronous functions in run_gpt_prompt.py and gpt_structure.py are thin
+wrappers around the coroutines defined here (see run_sync).
+"""
+import asyncio
+import threading
+import time
+import weakref
+
+import aiohttp
+import openai
+
+from utils import *
+from instrumentation import metrics
+from persona.prompt_template.mock_gpt_structure import (mock_embedding,
+                                                        mock_langflow_response)
+
+openai.api_key = openai_api_key
+
+# <BACKEND_CONCURRENCY> is the maximum number of requests that may be in
+# flight at the same time for each backend. Requests over the limit wait for
+# a free slot. The limits hold per process; persona worker processes each
+# get their share of them (see set_backend_concurrency).
+BACKEND_CONCURRENCY = {
+    "langflow": 32,
+    "openai_embedding": 64
+}
+
+# <_mock_backend> is set by use_mock_backend. While it is set, LangFlow and
+# embedding requests are answered locally by mock_gpt_structure.py after
+# <_mock_backend["latency"]> seconds instead of going over the network.
+_mock_backend = None
+
+# Per event loop state: the backend semaphores and the shared HTTP session.
+# asyncio primitives are bound to the loop they are first used on, so we keep
+# them separately for each loop.
+_loop_semaphores = weakref.WeakKeyDictionary()
+_loop_sessions = weakref.WeakKeyDictionary()
+
+# The background event loop used when synchronous code calls into this module
+# without an event loop of its own.
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+# <_bridge.loop> is set on worker threads that run synchronous cognition on
+# behalf of a coroutine (see run_in_thread). Requests made from those threads
+# are sent to that coroutine's loop rather than to the background loop.
+_bridge = threading.local()
+
+
+def get_background_loop():
+    """
+    Returns the background event loop, starting it in a daemon thread the
+    first time it is needed.
+    """
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever,
+                                      name="reverie-llm-loop",
+                                      daemon=True)
+            thread.start()
+            _background_loop = loop
+    return _background_loop
+
+
+def run_sync(coro):
+    """
+    Runs a coroutine to completion from synchronous code and returns its
+    result. The coroutine is scheduled on the loop bridged to the current
+    thread if there is one, and on the background loop otherwise.
+
+    This must not be called from a thread that is itself running an event
+    loop, since it blocks until the coroutine is done.
+    """
+    loop = getattr(_bridge, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = get_background_loop()
+
+    try:
+        running_loop = asyncio.get_running_loop()
+    except RuntimeError:
+        running_loop = None
+    if running_loop is not None:
+        coro.close()
+        raise RuntimeError("run_sync was called from a running event loop; "
+                           "await the coroutine instead.")
+
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+async def run_in_thread(func, *args, executor=None):
+    """
+    Runs the synchronous <func> on a worker thread and awaits its result.
+    Any LLM or embedding request <func> makes is scheduled on the calling
+    coroutine's event loop, where it shares the backend concurrency limits
+    with every other request in flight.
+
+    INPUT:
+      func: The synchronous function to run.
+      args: Positional arguments for <func>.
+      executor: Optional concurrent.futures executor to run <func> on. The
+                loop's default executor is used if None.
+    OUTPUT:
+      The return value of <func>.
+    """
+    loop = asyncio.get_running_loop()
+
+    def bridged():
+        _bridge.loop = loop
+        try:
+            return func(*args)
+        finally:
+            _bridge.loop = None
+
+    return await loop.run_in_executor(executor, bridged)
+
+
+def use_mock_backend(enabled=True, latency=0):
+    """
+    Switches LangFlow and embedding requests over to the local mock backend
+    (or back to the real ones).
+
+    INPUT:
+      enabled: True to use the mock backend, False for the real ones.
+      latency: The number of seconds each mock request takes. The requests
+               still hold their backend's concurrency slot for that long.
+    OUTPUT:
+      None
+    """
+    global _mock_backend
+    _mock_backend = {"latency": latency} if enabled else None
+
+
+def get_backend_concurrency(num_processes=1):
+    """
+    Returns each backend's share of BACKEND_CONCURRENCY when the requests
+    are split over <num_processes> processes, so that together they stay
+    within the limits (as long as there are no more processes than
+    requests allowed; every process gets at least one).
+    """
+    return {backend: max(1, limit // num_processes)
+            for backend, limit in BACKEND_CONCURRENCY.items()}
+
+
+def set_backend_concurrency(limits):
+    """
+    Sets the concurrency limits of this process (see BACKEND_CONCURRENCY)
+    to <limits>, a dictionary keyed by backend, e.g., what another process
+    got from get_backend_concurrency.
+    """
+    BACKEND_CONCURRENCY.update(limits)
+    # The semaphores are created with the limits in place when a loop first
+    # needs them, so we drop the ones made under the old limits.
+    _loop_semaphores.clear()
+
+
+def get_mock_backend():
+    """
+    Returns the settings use_mock_backend was last called with, as a
+    dictionary of its arguments (e.g., to set up the same backend in another
+    process).
+    """
+    if _mock_backend is None:
+        return {"enabled": False}
+    return {"enabled": True, "latency": _mock_backend["latency"]}
+
+
+async def _mock_latency():
+    if _mock_backend["latency"] > 0:
+        await asyncio.sleep(_mock_backend["latency"])
+
+
+def _get_semaphore(backend):
+    loop = asyncio.get_running_loop()
+    semaphores = _loop_semaphores.setdefault(loop, dict())
+    if backend not in semaphores:
+        semaphores[backend] = asyncio.Semaphore(BACKEND_CONCURRENCY[backend])
+    return semaphores[backend]
+
+
+def _get_session():
+    loop = asyncio.get_running_loop()
+    session = _loop_sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession()
+        _loop_sessions[loop] = session
+    return session
+
+
+def build_langflow_request(message, flow_config):
+    """
+    Returns the (url, payload, headers) triple for a LangFlow run request.
+    """
+    api_url = f"{LANGFLOW_BASE_API_URL}/lf/{flow_config['id']}/api/v1/run/{flow_config['endpoint']}?stream=false"
+
+    payload = {
+        "input_value": message,
+        "output_type": "chat",
+        "input_type": "chat",
+        "tweaks": {
+            "ChatInput-fO1Tz": {},
+            "ChatOutput-fIm7Y": {},
+            "OpenAIModel-VgBJv": {
+                "temperature": flow_config.get("temperature", 0.7),
+                "max_tokens": flow_config.get("max_tokens", 1000),
+                "top_p": flow_config.get("top_p", 1),
+                "frequency_penalty": flow_config.get("frequency_penalty", 0),
+                "presence_penalty": flow_config.get("presence_penalty", 0)
+            },
+            "Prompt-tRR6M": {
+                "template": "Respond based on user request:\n\nuser request: {user_request}\n\nResponse:"
+            }
+        }
+    }
+
+    headers = {
+        "Authorization": f"Bearer {APPLICATION_TOKEN}",
+        "Content-Type": "application/json"
+    }
+    return api_url, payload, headers
+
+
+async def LangFlow_request_async(message, flow_config):
+    """
+    Send a request to the LangFlow API with the given prompt and configuration.
+    """
+    start = time.perf_counter()
+    try:
+        return await _send_langflow_request(message, flow_config)
+    finally:
+        metrics.record_request("llm", time.perf_counter() - start)
+
+
+async def _send_langflow_request(message, flow_config):
+    if _mock_backend:
+        async with _get_semaphore("langflow"):
+            await _mock_latency()
+            return mock_langflow_response(message)
+
+    api_url, payload, headers = build_langflow_request(message, flow_config)
+    try:
+        async with _get_semaphore("langflow"):
+            async with _get_session().post(api_url, json=payload,
+                                           headers=headers) as response:
+                response.raise_for_status()
+                return await response.json()
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"LangFlow API Error: {str(e)}")
+        return {"error": str(e)}
+
+
+async def safe_generate_response_async(message, function_name=" ", agent_type="default", repeat=5, fail_safe_response="error", func_validate=None, func_clean_up=None, verbose=False):
+    """
+    Generates a safe response using LangFlow with optional validation and
+    cleanup. This is the coroutine behind safe_generate_response in
+    run_gpt_prompt.py; see there for the arguments.
+    """
+    # Imported here since run_gpt_prompt imports this module.
+    from persona.prompt_template.run_gpt_prompt import AGENT_FLOWS
+
+    repeat = int(repeat)
+
+    if verbose:
+        print(f"Sending message to LangFlow for agent type {agent_type}: {message}")
+
+    flow = AGENT_FLOWS.get(agent_type, AGENT_FLOWS["default"]) if isinstance(agent_type, str) else AGENT_FLOWS["default"]
+
+    for attempt in range(repeat):
+        try:
+            # Make LangFlow request
+            response = await LangFlow_request_async(message, flow)
+
+            # Extract text from response
+            if isinstance(response, dict) and "outputs" in response:
+                try:
+                    # Navigate through the response structure to get the text
+                    text_response = response["outputs"][0]["output"]
+                except (IndexError, KeyError):
+                    text_response = str(response)
+            else:
+                text_response = str(response)
+
+            # Validate and clean up (without a validator, any response
+            # will do)
+            if (func_validate is None
+                    or func_validate(text_response, prompt=message)):
+                cleaned_response = func_clean_up(text_response, prompt=message) if func_clean_up else text_response
+
+                # Additional parsing for task decomposition
+                # (unless the clean up function already parsed it).
+                if (function_name == "run_gpt_prompt_task_decomp"
+                        and isinstance(cleaned_response, str)):
+                    try:
+                        parsed_response = []
+                        for line in cleaned_response.split('\n'):
+                            if ') ' in line:
+                                task = line.split(') ', 1)[1].split(' (duration')[0].strip()
+                                duration = int(line.split('duration in minutes: ')[1].split(',')[0])
+                                parsed_response.append([task, duration])
+                        return parsed_response
+                    except:
+                        if verbose:
+                            print(f"Failed to parse task decomposition response: {cleaned_response}")
+                        continue
+
+                return cleaned_response
+
+            if verbose:
+                print(f"---- Repeat count: {attempt}")
+                print(text_response)
+                print("~~~~")
+
+        except Exception as e:
+            if verbose:
+                print(f"Attempt {attempt} failed with error: {str(e)}")
+            continue
+
+    return fail_safe_response
+
+
+async def get_embedding_async(text, model="text-embedding-ada-002"):
+    """
+    Generates an embedding for the given text using OpenAI's embedding API.
+    """
+    text = text.replace("\n", " ")
+    if not text:
+        text = "this is blank"
+    start = time.perf_counter()
+    try:
+        return await _create_embedding(text, model)
+    finally:
+        metrics.record_request("embedding", time.perf_counter() - start)
+
+
+async def _create_embedding(text, model):
+    if _mock_backend:
+        async with _get_semaphore("openai_embedding"):
+            await _mock_latency()
+            return mock_embedding(text)
+    async with _get_semaphore("openai_embedding"):
+        response = await openai.Embedding.acreate(input=[text], model=model)
+    return response['data'][0]['embedding']
@@ -7,6 +7,7 @@ interface with the safe_generate_response function.
 
 Note (March 10, 2023) -- Defunct
 """
+import json
 import re
 import datetime
 import sys
@@ -76,7 +77,7 @@ def run_gpt_prompt_wake_up_hour(persona, test_input=None, verbose=False):
   prompt = generate_prompt(prompt_input, prompt_template)
   fail_safe = get_fail_safe()
 
-  output = safe_generate_response(prompt, agent_type="default", repeat=5, fail_safe_response=fail_safe, function_name="generate_wake_up_hour")
+  output = safe_generate_response(prompt, agent_type="default", repeat=5, fail_safe_response=fail_safe, func_validate=__func_validate, func_clean_up=__func_clean_up, function_name="generate_wake_up_hour")
   
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -145,7 +146,7 @@ def run_gpt_prompt_daily_plan(persona,
   prompt = generate_prompt(prompt_input, prompt_template)
   fail_safe = get_fail_safe()
   
-  output = safe_generate_response(prompt, agent_type="default", repeat=5, fail_safe_response=fail_safe, function_name="generate_wake_up_hour")
+  output = safe_generate_response(prompt, agent_type="default", repeat=5, fail_safe_response=fail_safe, func_validate=__func_validate, func_clean_up=__func_clean_up, function_name="run_gpt_prompt_daily_plan")
   output = ([f"wake up and complete the morning routine at {wake_up_hour}:00 am"]
               + output)
 
@@ -598,7 +599,7 @@ def run_gpt_prompt_action_arena(action_description,
   y = f"{act_world}:{act_sector}"
   x = [i.strip() for i in persona.s_mem.get_str_accessible_sector_arenas(y).split(",")]
   if output not in x: 
-    output = random.choice(x)
+    output = persona.rng.choice(x)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -656,7 +657,7 @@ def run_gpt_prompt_action_game_object(action_description,
 
   x = [i.strip() for i in persona.s_mem.get_str_accessible_arena_game_objects(temp_address).split(",")]
   if output not in x: 
-    output = random.choice(x)
+    output = persona.rng.choice(x)
 
   if debug or verbose: 
     print_run_prompts(prompt_template, persona, gpt_param, 
@@ -2161,5 +2162,87 @@ def run_gpt_prompt_memo_on_convo(persona, all_utt, test_input=None, verbose=Fals
   return output, [output, prompt, gpt_param, prompt_input, fail_safe]
 
 
+def run_gpt_generate_iterative_chat_utt(maze, init_persona, target_persona, 
+                                        retrieved, curr_context, curr_chat, 
+                                        test_input=None, verbose=False): 
+  def create_prompt_input(maze, init_persona, target_persona, retrieved, 
+                          curr_context, curr_chat, test_input=None): 
+    persona = init_persona
+    prev_convo_insert = "\n"
+    if persona.a_mem.seq_chat: 
+      for i in persona.a_mem.seq_chat: 
+        if i.object == target_persona.scratch.name: 
+          v1 = int((persona.scratch.curr_time - i.created).total_seconds()/60)
+          prev_convo_insert += f'{str(v1)} minutes ago, {persona.scratch.name} and {target_persona.scratch.name} were already {i.description} This context takes place after that conversation.'
+          break
+    if prev_convo_insert == "\n": 
+      prev_convo_insert = ""
+    if persona.a_mem.seq_chat: 
+      if int((persona.scratch.curr_time - persona.a_mem.seq_chat[-1].created).total_seconds()/60) > 480: 
+        prev_convo_insert = ""
+
+    curr_sector = f"{maze.access_tile(persona.scratch.curr_tile)['sector']}"
+    curr_arena = f"{maze.access_tile(persona.scratch.curr_tile)['arena']}"
+    curr_location = f"{curr_arena} in {curr_sector}"
+
+    retrieved_str = ""
+    for key, vals in retrieved.items(): 
+      for v in vals: 
+        retrieved_str += f"- {v.description}\n"
+
+    convo_str = ""
+    for i in curr_chat:
+      convo_str += ": ".join(i) + "\n"
+    if convo_str == "": 
+      convo_str = "[The conversation has not started yet -- start it!]"
+
+    init_iss = f"Here is a brief description of {init_persona.scratch.name}.\n{init_persona.scratch.get_str_iss()}"
+    prompt_input = [init_iss, init_persona.scratch.name, retrieved_str, 
+                    prev_convo_insert, curr_location, curr_context, 
+                    init_persona.scratch.name, target_persona.scratch.name,
+                    convo_str, init_persona.scratch.name, 
+                    target_persona.scratch.name, init_persona.scratch.name, 
+                    init_persona.scratch.name, init_persona.scratch.name]
+    return prompt_input
+
+  def __func_clean_up(gpt_response, prompt=""): 
+    gpt_response = json.loads(gpt_response[gpt_response.index("{"):
+                                           gpt_response.rindex("}") + 1])
+    cleaned = list(gpt_response.values())
+    cleaned_dict = dict()
+    cleaned_dict["utterance"] = cleaned[0]
+    cleaned_dict["end"] = True
+    if "f" in str(cleaned[1]) or "F" in str(cleaned[1]): 
+      cleaned_dict["end"] = False
+    return cleaned_dict
+
+  def __func_validate(gpt_response, prompt=""): 
+    try: 
+      __func_clean_up(gpt_response, prompt)
+      return True
+    except:
+      return False 
 
+  def get_fail_safe(): 
+    cleaned_dict = dict()
+    cleaned_dict["utterance"] = "..."
+    cleaned_dict["end"] = False
+    return cleaned_dict
 
+  gpt_param = {"engine": "text-davinci-003", "max_tokens": 50, 
+               "temperature": 0, "top_p": 1, "stream": False,
+               "frequency_penalty": 0, "presence_penalty": 0, "stop": None}
+  prompt_template = "persona/prompt_template/v3_ChatGPT/iterative_convo_v1.txt"
+  prompt_input = create_prompt_input(maze, init_persona, target_persona, 
+                                     retrieved, curr_context, curr_chat)
+  prompt = generate_prompt(prompt_input, prompt_template)
+
+  fail_safe = get_fail_safe()
+  output = safe_generate_response(prompt, gpt_param, 3, fail_safe,
+                                   __func_validate, __func_clean_up)
+
+  if debug or verbose: 
+    print_run_prompts(prompt_template, init_persona, gpt_param, 
+                      prompt_input, prompt, output)
+  
+  return output, [output, prompt, gpt_param, prompt_input, fail_safe]
@@ -6,6 +6,8 @@ import os
 import openai
 from utils import *
 
+from persona.prompt_template.async_gpt_structure import *
+
 openai.api_key = openai_api_key
 
 # LangFlow Configuration
@@ -102,11 +104,7 @@ def get_embedding(text, model="text-embedding-ada-002"):
     """
     Generates an embedding for the given text using OpenAI's embedding API.
     """
-    text = text.replace("\n", " ")
-    if not text: 
-        text = "this is blank"
-    return openai.Embedding.create(
-            input=[text], model=model)['data'][0]['embedding']
+    return run_sync(get_embedding_async(text, model=model))
 
 if __name__ == '__main__':
     message = "driving to a friend's house"
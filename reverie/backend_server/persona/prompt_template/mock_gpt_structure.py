@@ -0,0 +1,328 @@
+"""
+File: mock_gpt_structure.py
+Description: A local stand-in for the LangFlow and OpenAI embedding backends,
+used for benchmarking and for running simulations offline.
+
+The mock recognizes which prompt template (v1/, v2/, v3_ChatGPT/) a prompt
+was generated from, recovers the inputs that were filled into it, and answers
+with a canned response in the format that template's run_gpt_prompt_*
+parser expects. Embeddings are hashed bag-of-words vectors, so they are
+deterministic and texts sharing words are close to each other.
+
+Everything here is deterministic: the same prompt always gets the same
+response. Enable it with use_mock_backend in async_gpt_structure.py.
+"""
+import glob
+import hashlib
+import math
+import os
+import re
+
+TEMPLATE_DIRS = ["v1", "v2", "v3_ChatGPT"]
+COMMENT_BLOCK_MARKER = "<commentblockmarker>###</commentblockmarker>"
+INPUT_PATTERN = re.compile(r"!<INPUT (\d+)>!")
+
+# <EMBEDDING_DIM> matches text-embedding-ada-002.
+EMBEDDING_DIM = 1536
+
+# The templates, loaded on first use: a list of
+# (name, static chunks, regex, input index of each regex group).
+_templates = None
+
+
+def _load_templates():
+    global _templates
+    if _templates is not None:
+        return _templates
+
+    templates = []
+    base = os.path.dirname(os.path.abspath(__file__))
+    for template_dir in TEMPLATE_DIRS:
+        for f in sorted(glob.glob(f"{base}/{template_dir}/*.txt")):
+            with open(f, "r") as template_file:
+                template = template_file.read()
+            if COMMENT_BLOCK_MARKER in template:
+                template = template.split(COMMENT_BLOCK_MARKER)[1]
+            template = template.strip()
+
+            chunks = INPUT_PATTERN.split(template)
+            static = chunks[0::2]
+            input_indices = [int(i) for i in chunks[1::2]]
+            regex = re.compile("(.*?)".join(re.escape(i) for i in static),
+                               re.DOTALL)
+            name = os.path.splitext(os.path.basename(f))[0]
+            templates += [(name, [i for i in static if i.strip()], regex,
+                           input_indices)]
+
+    # The most specific templates are tried first.
+    templates.sort(key=lambda t: -sum(len(i) for i in t[1]))
+    _templates = templates
+    return _templates
+
+
+def match_template(prompt):
+    """
+    Finds the template <prompt> was generated from.
+
+    INPUT:
+      prompt: The prompt, as returned by generate_prompt.
+    OUTPUT:
+      (template name, {input index: input}), or (None, {}) if the prompt
+      matches no template.
+    """
+    # Inputs are stripped along with the template, so the prompt may
+    # start or end with less whitespace than the template does.
+    prompt = prompt.strip()
+    for name, static, regex, input_indices in _load_templates():
+        if not all(i in prompt for i in static):
+            continue
+        match = regex.fullmatch(prompt)
+        if match:
+            return name, dict(zip(input_indices, match.groups()))
+    return None, dict()
+
+
+def _digest(text):
+    return int(hashlib.sha256(text.encode()).hexdigest(), 16)
+
+
+def _pick(options, key):
+    options = [i.strip() for i in options if i.strip()]
+    if not options:
+        return ""
+    return options[_digest(key) % len(options)]
+
+
+def _get_input(inputs, index, default=""):
+    value = inputs.get(index)
+    if value is None:
+        return default
+    return value.strip()
+
+
+def _split_options(options):
+    return [i.strip() for i in options.split(",") if i.strip()]
+
+
+def _respond_daily_plan(inputs, prompt):
+    return ("eat breakfast at 8:00 am, 3) work on the day's main project "
+            "from 9:00 am to 12:00 pm, 4) have lunch at 12:00 pm, 5) take a "
+            "walk around town from 3:00 pm to 4:00 pm, 6) have dinner at 6:00 "
+            "pm, 7) relax and read from 8:00 pm to 10:00 pm, 8) go to bed at "
+            "11:00 pm")
+
+
+def _respond_hourly_schedule(inputs, prompt):
+    return _pick(["working on the day's main project", "having a meal",
+                  "taking a short walk", "reading a book",
+                  "tidying up the room"], prompt)
+
+
+def _respond_task_decomp(inputs, prompt):
+    # The durations have to add up to the total in the prompt, in 5 minute
+    # increments.
+    try:
+        total = int(_get_input(inputs, 6))
+    except ValueError:
+        total = 60
+    name = _get_input(inputs, 7, "She")
+    task = _get_input(inputs, 4, "working")
+    steps = ["getting ready for", "working on", "finishing up"]
+    durations = [total]
+    if total >= 15:
+        first = (total // 3) - (total // 3) % 5
+        durations = [first, first, total - 2 * first]
+
+    lines = []
+    left = total
+    for count, duration in enumerate(durations):
+        left -= duration
+        subtask = (f"{steps[count]} {task} (duration in minutes: "
+                   f"{str(duration)}, minutes left: {str(left)})")
+        if count == 0:
+            lines += [f" {subtask}"]
+        else:
+            lines += [f"{str(count + 1)}) {name} is {subtask}"]
+    return "\n".join(lines)
+
+
+def _respond_sector(inputs, prompt):
+    return _pick(_split_options(_get_input(inputs, 7)), prompt) + "}"
+
+
+def _respond_arena(inputs, prompt):
+    return _pick(_split_options(_get_input(inputs, 5)), prompt) + "}"
+
+
+def _respond_game_object(inputs, prompt):
+    return _pick(_split_options(_get_input(inputs, 1)), prompt)
+
+
+def _respond_pronunciatio(inputs, prompt):
+    return _pick(["🙂", "💼", "🍽️", "📖", "🚶", "😴"], prompt)
+
+
+def _respond_event_triple(inputs, prompt):
+    words = _get_input(inputs, 1, "idle").replace(",", " ").split()
+    if not words:
+        words = ["idle"]
+    return f" {words[0]}, {words[-1]})"
+
+
+def _respond_obj_event(inputs, prompt):
+    return " being used"
+
+
+def _respond_new_decomp_schedule(inputs, prompt):
+    # The last line of the prompt is the start of the open time slot; we
+    # close it at the end of the revised schedule.
+    end = _get_input(inputs, 9, "23:59")[:5]
+    plan = [i for i in _get_input(inputs, 3).split("\n") if " -- " in i]
+    action = plan[-1].split(" -- ")[-1].strip() if plan else "idle"
+    return f" {end} -- {action}"
+
+
+def _respond_decide_to_talk(inputs, prompt):
+    answer = "yes" if _digest(prompt) % 4 == 0 else "no"
+    return f"They are both nearby.\nAnswer in yes or no: {answer}"
+
+
+def _respond_decide_to_react(inputs, prompt):
+    return f"It is better not to wait.\nAnswer: Option {_pick(['2', '3'], prompt)}"
+
+
+def _respond_conversation(first, other):
+    return (f'Hi {other.split(" ")[0]}, how is your day going?"\n'
+            f'{other}: "Pretty good, thanks for asking."\n'
+            f'{first}: "Glad to hear it. See you around."')
+
+
+def _respond_create_conversation(inputs, prompt):
+    first = _get_input(inputs, 15, "Someone")
+    other = _get_input(inputs, 13, "Someone")
+    if other == first:
+        other = _get_input(inputs, 12, "Someone")
+    return _respond_conversation(first, other)
+
+
+def _respond_agent_chat(inputs, prompt):
+    return 'Hi, how is your day going?"'
+
+
+def _respond_iterative_convo(inputs, prompt):
+    name = _get_input(inputs, 11, "Someone")
+    other = _get_input(inputs, 10, "Someone")
+    # The conversation ends once both have spoken twice.
+    turns = len([i for i in _get_input(inputs, 8).split("\n") if ": " in i])
+    utterance = (f"Hi {other.split(' ')[0]}, how is your day going?" 
+                 if turns == 0 else "Pretty good, thanks for asking.")
+    end = "true" if turns >= 3 else "false"
+    return (f'{{\n"{name}": "{utterance}",\n'
+            f'"Did the conversation end with {name}\'s utterance?": "{end}"\n}}')
+
+
+def _respond_keywords(inputs, prompt):
+    words = [i for i in re.findall(r"[a-z]+", _get_input(inputs, 0).lower())
+             if len(i) > 3]
+    factual = ", ".join(words[:3]) or "event"
+    return f" {factual}\nEmotive keywords: calm, content"
+
+
+def _respond_poignancy(inputs, prompt):
+    return str(1 + _digest(prompt) % 9)
+
+
+def _respond_focal_pt(inputs, prompt):
+    try:
+        n = int(_get_input(inputs, 1))
+    except ValueError:
+        n = 3
+    questions = ["What is the most important thing happening today?",
+                 "Who has been around lately?",
+                 "What are the plans for the rest of the week?"]
+    return "\n".join(f"{str(i + 1)}) {questions[i % len(questions)]}"
+                     for i in range(n))[3:]
+
+
+def _respond_insight_and_evidence(inputs, prompt):
+    try:
+        n = int(_get_input(inputs, 1))
+    except ValueError:
+        n = 3
+    return "\n".join(f"{str(i + 1)}. The day is going as planned "
+                     f"({str(i + 1)}) (because of {str(i + 1)})"
+                     for i in range(n))[3:]
+
+
+def _respond_quoted_text(inputs, prompt):
+    return 'They are getting along well and share some plans for the day."'
+
+
+# <RESPONDERS> maps a template name to the function that writes its
+# response. Templates not listed get DEFAULT_RESPONSE.
+RESPONDERS = {
+    "wake_up_hour_v1": lambda inputs, prompt: "7am",
+    "daily_planning_v6": _respond_daily_plan,
+    "generate_hourly_schedule_v2": _respond_hourly_schedule,
+    "task_decomp_v3": _respond_task_decomp,
+    "action_location_sector_v2": _respond_sector,
+    "action_location_object_v1": _respond_arena,
+    "action_object_v2": _respond_game_object,
+    "generate_pronunciatio_v1": _respond_pronunciatio,
+    "generate_event_triple_v1": _respond_event_triple,
+    "generate_obj_event_v1": _respond_obj_event,
+    "new_decomp_schedule_v1": _respond_new_decomp_schedule,
+    "decide_to_talk_v2": _respond_decide_to_talk,
+    "decide_to_react_v1": _respond_decide_to_react,
+    "create_conversation_v2": _respond_create_conversation,
+    "agent_chat_v1": _respond_agent_chat,
+    "iterative_convo_v1": _respond_iterative_convo,
+    "summarize_conversation_v1": lambda inputs, prompt: "their plans for the day",
+    "get_keywords_v1": _respond_keywords,
+    "poignancy_event_v1": _respond_poignancy,
+    "poignancy_thought_v1": _respond_poignancy,
+    "poignancy_chat_v1": _respond_poignancy,
+    "generate_focal_pt_v1": _respond_focal_pt,
+    "insight_and_evidence_v1": _respond_insight_and_evidence,
+    "summarize_chat_ideas_v1": _respond_quoted_text,
+    "summarize_chat_relationship_v1": _respond_quoted_text,
+    "summarize_ideas_v1": _respond_quoted_text,
+    "generate_next_convo_line_v1": _respond_quoted_text,
+    "whisper_inner_thought_v1": _respond_quoted_text,
+    "planning_thought_on_convo_v1": _respond_quoted_text,
+    "memo_on_convo_v1": _respond_quoted_text,
+}
+
+DEFAULT_RESPONSE = "okay"
+
+
+def mock_response_text(prompt):
+    """
+    Returns the mock LLM completion for <prompt>.
+    """
+    name, inputs = match_template(prompt)
+    if name not in RESPONDERS:
+        return DEFAULT_RESPONSE
+    return RESPONDERS[name](inputs, prompt)
+
+
+def mock_langflow_response(message):
+    """
+    Returns the mock LangFlow run response for <message>, in the shape
+    safe_generate_response_async reads it.
+    """
+    return {"outputs": [{"output": mock_response_text(message)}]}
+
+
+def mock_embedding(text):
+    """
+    Returns a deterministic, unit length EMBEDDING_DIM vector for <text>:
+    every word adds +1 or -1 to a dimension picked by its hash.
+    """
+    vector = [0.0] * EMBEDDING_DIM
+    words = re.findall(r"\w+", text.lower()) or [text]
+    for word in words:
+        digest = _digest(word)
+        vector[digest % EMBEDDING_DIM] += 1.0 if (digest >> 16) % 2 else -1.0
+    norm = math.sqrt(sum(i * i for i in vector)) or 1.0
+    return [i / norm for i in vector]
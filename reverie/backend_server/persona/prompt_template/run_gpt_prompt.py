@@ -5,6 +5,8 @@ import time
 from utils import *
 import openai
 
+from persona.prompt_template.async_gpt_structure import *
+
 # OpenAI Configuration
 openai.api_key = openai_api_key
 
@@ -44,105 +46,29 @@ def temp_sleep(seconds=0.1):
     time.sleep(seconds)
 
 def safe_generate_response(message, function_name=" ", agent_type="default", repeat=5, fail_safe_response="error", func_validate=None, func_clean_up=None, verbose=False):
-    repeat = int(repeat)
-    
-    if not isinstance(repeat, int):
-        raise ValueError(f"Invalid repeat value: {repeat}. It must be an integer.")
     """
     Generates a safe response using LangFlow with optional validation and cleanup.
+    This is a synchronous wrapper around safe_generate_response_async.
     """
-    if verbose: 
-        print(f"Sending message to LangFlow for agent type {agent_type}: {message}")
-
-    flow = AGENT_FLOWS.get(agent_type, AGENT_FLOWS["default"]) if isinstance(agent_type, str) else AGENT_FLOWS["default"]
-
-    for attempt in range(repeat): 
-        try:
-            # Make LangFlow request
-            response = LangFlow_request(message, flow)
-            
-            # Extract text from response
-            if isinstance(response, dict) and "outputs" in response:
-                try:
-                    # Navigate through the response structure to get the text
-                    text_response = response["outputs"][0]["output"]
-                except (IndexError, KeyError):
-                    text_response = str(response)
-            else:
-                text_response = str(response)
-
-            # Validate and clean up
-            if func_validate and func_validate(text_response, prompt=message): 
-                cleaned_response = func_clean_up(text_response, prompt=message) if func_clean_up else text_response
-                
-                # Additional parsing for task decomposition
-                if function_name == "run_gpt_prompt_task_decomp":
-                    try:
-                        parsed_response = []
-                        for line in cleaned_response.split('\n'):
-                            if ') ' in line:
-                                task = line.split(') ', 1)[1].split(' (duration')[0].strip()
-                                duration = int(line.split('duration in minutes: ')[1].split(',')[0])
-                                parsed_response.append([task, duration])
-                        return parsed_response
-                    except:
-                        if verbose:
-                            print(f"Failed to parse task decomposition response: {cleaned_response}")
-                        continue
-                
-                return cleaned_response
-            
-            if verbose: 
-                print(f"---- Repeat count: {attempt}")
-                print(text_response)
-                print("~~~~")
-                
-        except Exception as e:
-            if verbose:
-                print(f"Attempt {attempt} failed with error: {str(e)}")
-            continue
-            
-    return fail_safe_response
+    # The prompt functions in defunct_run_gpt_prompt.py still pass the old
+    # positional arguments (message, gpt_param, repeat, fail_safe_response,
+    # func_validate, func_clean_up).
+    if isinstance(function_name, dict):
+        repeat, fail_safe_response, func_validate, func_clean_up = (
+            agent_type, repeat, fail_safe_response, func_validate)
+        function_name, agent_type = " ", "default"
+    return run_sync(safe_generate_response_async(
+        message, function_name=function_name, agent_type=agent_type,
+        repeat=repeat, fail_safe_response=fail_safe_response,
+        func_validate=func_validate, func_clean_up=func_clean_up,
+        verbose=verbose))
 
 def LangFlow_request(message, flow_config):
     """
     Send a request to the LangFlow API with the given prompt and configuration.
+    This is a synchronous wrapper around LangFlow_request_async.
     """
-    try:
-        api_url = f"{LANGFLOW_BASE_API_URL}/lf/{flow_config['id']}/api/v1/run/{flow_config['endpoint']}?stream=false"
-        
-        payload = {
-            "input_value": message,
-            "output_type": "chat",
-            "input_type": "chat",
-            "tweaks": {
-                "ChatInput-fO1Tz": {},
-                "ChatOutput-fIm7Y": {},
-                "OpenAIModel-VgBJv": {
-                    "temperature": flow_config.get("temperature", 0.7),
-                    "max_tokens": flow_config.get("max_tokens", 1000),
-                    "top_p": flow_config.get("top_p", 1),
-                    "frequency_penalty": flow_config.get("frequency_penalty", 0),
-                    "presence_penalty": flow_config.get("presence_penalty", 0)
-                },
-                "Prompt-tRR6M": {
-                    "template": "Respond based on user request:\n\nuser request: {user_request}\n\nResponse:"
-                }
-            }
-        }
-
-        headers = {
-            "Authorization": f"Bearer {APPLICATION_TOKEN}",
-            "Content-Type": "application/json"
-        }
-
-        response = requests.post(api_url, json=payload, headers=headers)
-        response.raise_for_status()
-        return response.json()
-
-    except requests.exceptions.RequestException as e:
-        print(f"LangFlow API Error: {str(e)}")
-        return {"error": str(e)}
+    return run_sync(LangFlow_request_async(message, flow_config))
 
 def run_gpt_prompt_generate_hourly_schedule(persona, curr_hour_str, n_m1_activity, hour_str, test_input=None):
     """
@@ -180,11 +106,7 @@ def get_embedding(text, model="text-embedding-ada-002"):
     """
     Generates an embedding for the given text using OpenAI's embedding API.
     """
-    text = text.replace("\n", " ")
-    if not text: 
-        text = "this is blank"
-    return openai.Embedding.create(
-            input=[text], model=model)['data'][0]['embedding']
+    return run_sync(get_embedding_async(text, model=model))
 
 if __name__ == '__main__':
     message = "driving to a friend's house"
@@ -0,0 +1,523 @@
+"""
+File: persona_workers.py
+Description: Runs the personas' cognitive chains in worker processes, so
+that a step's cognition is not bound to the one core the GIL gives the
+cognition worker threads.
+
+Workers are either child processes of the server, which build their copy
+of the maze on the static grid the server shares with them (see
+Maze.share_static), or worker nodes -- on this machine or others -- that
+connect to the server over TCP and get a copy of the static grid instead.
+A worker node is started with:
+  python persona_workers.py <server host>:<server port> [<key>]
+where <key> is the hex key the server printed when it started listening
+(or, if left out, the one in the REVERIE_PERSONA_NODE_KEY environment
+variable). Nodes and the server exchange pickles, so the key must be kept
+secret: the server makes up a random one for each pool, unless it is given
+one in REVERIE_PERSONA_NODE_KEY, and only listens on an address other than
+the loopback one if it is.
+The server, as the coordinator, owns the maze's events and the personas'
+tiles, and runs every step as a barrier: it sends each worker the changes
+made to the maze's events since the last step (see Maze.event_diffs) and
+some of the groups returned by ReverieServer._get_cognition_groups, and
+waits for all of them. Since personas in different groups cannot affect
+each other within a step, the workers move their groups independently;
+personas within a group move one after another in the order of
+ReverieServer.personas, as they would in the server.
+
+Every worker holds a replica of every persona, but the personas are
+sharded: each is owned by the worker that last moved it, and a group goes
+to the worker that owns most of its members. What moving a persona changed
+-- its scratch, the nodes added to its associative memory and the ones
+retrieval accessed, its spatial memory and its random number generator --
+comes back as a persona delta (see get_persona_delta). The server applies
+the deltas to its own personas, and holds them (merged) for the other
+workers, which only get them once they are sent a group with that persona
+in it, i.e., when the persona's state crosses shards.
+
+A PersonaPool lives for one ReverieServer.start_server call; changes the
+server makes to the personas in between (e.g., in a conversation session)
+are picked up by the next pool.
+"""
+import asyncio
+import datetime
+import ipaddress
+import multiprocessing
+import os
+import pickle
+import secrets
+import sys
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+
+from cognition_scheduler import get_wake, get_wake_key
+from instrumentation import metrics
+from maze import Maze, attach_shared_maze
+from persona.prompt_template.async_gpt_structure import (
+  get_backend_concurrency, get_mock_backend, set_backend_concurrency,
+  use_mock_backend, run_sync)
+
+# <PERSONA_NODE_KEY_ENV> is the environment variable that holds the key
+# (in hex) worker nodes authenticate to the server with (see
+# multiprocessing.connection), if the user gives one.
+PERSONA_NODE_KEY_ENV = "REVERIE_PERSONA_NODE_KEY"
+
+
+def get_persona_node_key():
+  """
+  Returns the key the user gave in the <PERSONA_NODE_KEY_ENV> environment
+  variable, or None if there is none.
+  """
+  key = os.environ.get(PERSONA_NODE_KEY_ENV)
+  if not key:
+    return None
+  return bytes.fromhex(key)
+
+
+def is_loopback(host):
+  """
+  Returns whether <host> is a loopback address (e.g., "localhost" or
+  "127.0.0.1"), which only this machine can connect to.
+  """
+  if host == "localhost":
+    return True
+  try:
+    return ipaddress.ip_address(host).is_loopback
+  except ValueError:
+    return False
+
+
+def get_sync_state(persona):
+  """
+  Returns what get_persona_delta compares <persona> against to tell what
+  changed: the number of nodes in its associative memory, its embedding
+  keys, the version of its spatial memory and its random number generator
+  state.
+  """
+  return {"node_count": len(persona.a_mem.id_to_node),
+          "embedding_keys": set(persona.a_mem.embeddings.keys()),
+          "s_mem_version": persona.s_mem.version,
+          "rng": persona.rng.getstate()}
+
+
+def get_persona_delta(persona, sync):
+  """
+  Returns what changed in <persona> since <sync> (see get_sync_state), and
+  brings <sync> up to date.
+
+  INPUT
+    persona: The Persona that moved.
+    sync: The persona's sync state.
+  OUTPUT
+    delta: A picklable dictionary for apply_persona_delta.
+  """
+  delta = dict()
+  delta["scratch"] = pickle.dumps(persona.scratch)
+  delta["perceived_new"] = persona.perceived_new
+  delta["nodes"] = persona.a_mem.get_node_entries(sync["node_count"],
+                                                  sync["embedding_keys"])
+  sync["node_count"] = len(persona.a_mem.id_to_node)
+  delta["accessed"] = persona.a_mem.get_access_entries()
+
+  if persona.s_mem.version != sync["s_mem_version"]:
+    delta["s_mem"] = pickle.dumps(persona.s_mem.tree)
+    sync["s_mem_version"] = persona.s_mem.version
+  rng = persona.rng.getstate()
+  if rng != sync["rng"]:
+    delta["rng"] = rng
+    sync["rng"] = rng
+  return delta
+
+
+def apply_persona_delta(persona, delta, sync=None):
+  """
+  Applies <delta> (see get_persona_delta) to <persona>, a replica of the
+  persona it was taken from. If <sync> is given, it is brought up to date
+  as well.
+  """
+  if "scratch" in delta:
+    persona.scratch = pickle.loads(delta["scratch"])
+  if "perceived_new" in delta:
+    persona.perceived_new = delta["perceived_new"]
+  if delta.get("nodes"):
+    persona.a_mem.add_node_entries(delta["nodes"])
+  if delta.get("accessed"):
+    persona.a_mem.set_access_entries(delta["accessed"])
+  if "s_mem" in delta:
+    persona.s_mem.set_tree(pickle.loads(delta["s_mem"]))
+  if "rng" in delta:
+    persona.rng.setstate(delta["rng"])
+
+  if sync is not None:
+    sync["node_count"] = len(persona.a_mem.id_to_node)
+    for entry in delta.get("nodes", []):
+      sync["embedding_keys"].add(entry["node"]["embedding_key"])
+    sync["s_mem_version"] = persona.s_mem.version
+    if "rng" in delta:
+      sync["rng"] = delta["rng"]
+
+
+def merge_persona_deltas(delta, new_delta):
+  """
+  Returns one delta that has the effect of applying <delta> and then
+  <new_delta>.
+  """
+  merged = dict(delta)
+  for key, val in new_delta.items():
+    if key == "nodes":
+      merged["nodes"] = delta.get("nodes", []) + val
+    elif key == "accessed":
+      merged["accessed"] = dict(delta.get("accessed", dict()))
+      merged["accessed"].update(val)
+    else:
+      merged[key] = val
+  return merged
+
+
+def _move_groups(maze, personas, syncs, request, executor):
+  """
+  Moves the personas of the groups in <request> (see PersonaPool.move) in
+  a worker process.
+  """
+  metrics.enabled = request["metrics"]
+  metrics.set_step(request["step"])
+  maze.apply_event_diffs(request["event_diffs"])
+  for persona_name, delta in request["deltas"]:
+    apply_persona_delta(personas[persona_name], delta, syncs[persona_name])
+
+  scheduled_keys = request["scheduled_keys"]
+  sec_per_step = request["sec_per_step"]
+  next_time = request["curr_time"] + datetime.timedelta(seconds=sec_per_step)
+
+  def move_group(group):
+    group_movements = dict()
+    for persona_name in group:
+      persona = personas[persona_name]
+      due = (persona_name not in scheduled_keys
+             or scheduled_keys[persona_name] != get_wake_key(persona))
+      execution = persona.move(maze, personas,
+                               request["personas_tile"][persona_name],
+                               request["curr_time"], due)
+      # A later persona in the group may still change this persona's chat
+      # and wake key (see ReverieServer._get_movement and get_wake), so we
+      # take them now.
+      group_movements[persona_name] = (execution, persona.scratch.chat,
+                                       get_wake(persona, next_time,
+                                                sec_per_step))
+    return group_movements
+
+  async def move_all():
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*[loop.run_in_executor(executor, move_group,
+                                                       i)
+                                  for i in request["groups"]])
+
+  movements = dict()
+  if executor:
+    for group_movements in run_sync(move_all()):
+      movements.update(group_movements)
+  else:
+    for group in request["groups"]:
+      movements.update(move_group(group))
+
+  deltas = []
+  for group in request["groups"]:
+    for persona_name in group:
+      deltas += [(persona_name, get_persona_delta(personas[persona_name],
+                                                  syncs[persona_name]))]
+  return {"movements": movements,
+          "deltas": deltas,
+          "records": metrics.drain_records()}
+
+
+def _run_worker(conn):
+  """
+  The main loop of a worker, which talks to the server over <conn>. The
+  first message sets the worker up (see PersonaPool.__init__).
+  """
+  command, init = conn.recv()
+  use_mock_backend(**init["mock_backend"])
+  set_backend_concurrency(init["backend_concurrency"])
+  if "shm_name" in init["maze"]:
+    maze = attach_shared_maze(init["maze"])
+  else:
+    maze = Maze(init["maze"]["maze_name"], init["maze"])
+  maze.set_events(init["events"])
+  personas = pickle.loads(init["personas"])
+  syncs = {name: get_sync_state(persona)
+           for name, persona in personas.items()}
+  threads = init["threads"]
+  executor = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+
+  while True:
+    command, request = conn.recv()
+    if command == "close":
+      break
+    try:
+      conn.send(("ok", _move_groups(maze, personas, syncs, request,
+                                    executor)))
+    except Exception:
+      conn.send(("error", traceback.format_exc()))
+
+  if executor:
+    executor.shutdown()
+  # The maze's static grid is a view of the shared memory block, which
+  # cannot be closed while it is in use.
+  shm = maze.shared_memory
+  del maze
+  if shm:
+    shm.close()
+  conn.close()
+
+
+def run_worker_node(address, authkey):
+  """
+  Connects to the server listening for worker nodes at <address> (a
+  (host, port) pair) with the key <authkey>, and works for it until it
+  closes the pool.
+  """
+  _run_worker(Client(address, authkey=authkey))
+
+
+class PersonaPool:
+  def __init__(self, num_workers, maze, personas, threads=1, address=None,
+               spawn_nodes=True, authkey=None):
+    """
+    Starts <num_workers> workers that hold replicas of <personas> and of
+    <maze>, which the caller keeps. From here on, the changes made to the
+    maze's events are recorded (see Maze.event_diffs) for the workers until
+    the pool is closed.
+
+    INPUT
+      num_workers: The number of workers.
+      maze: The server's Maze.
+      personas: The server's dictionary of personas, which the pool keeps
+                up to date.
+      threads: The number of cognition threads in each worker (see
+               ReverieServer.cognition_workers).
+      address: If given, the (host, port) pair we listen on for worker
+               nodes; the workers are then child processes connected by
+               pipes otherwise.
+      spawn_nodes: Whether we start the worker nodes ourselves, as local
+                   processes, or wait for <num_workers> of them to connect.
+      authkey: The key worker nodes authenticate with. If not given, the
+               one in <PERSONA_NODE_KEY_ENV>, if any, or else a random
+               one, in which case we only listen on a loopback address.
+    OUTPUT
+      None
+    """
+    self.maze = maze
+    self.personas = personas
+    # <owners> is the worker that owns (i.e., last moved) each persona. We
+    # start by splitting the personas evenly in their order.
+    self.owners = dict()
+    for count, persona_name in enumerate(personas.keys()):
+      self.owners[persona_name] = count * num_workers // len(personas)
+    # <pending_deltas> are, for each worker, the persona deltas it has not
+    # seen yet, merged into one per persona.
+    self.pending_deltas = [dict() for i in range(num_workers)]
+
+    if address and not authkey:
+      authkey = get_persona_node_key()
+      if not authkey:
+        if not is_loopback(address[0]):
+          raise ValueError(f"Listening for persona worker nodes on "
+                           f"{address[0]} needs a key; set "
+                           f"{PERSONA_NODE_KEY_ENV} to a secret hex key "
+                           f"on the server and the nodes.")
+        authkey = secrets.token_bytes(32)
+        if not spawn_nodes:
+          print (f"Persona worker node key: {authkey.hex()}")
+
+    self.shm = None
+    self.listener = None
+    self.conns = []
+    self.processes = []
+    if address:
+      maze_spec = maze.static
+    else:
+      self.shm, maze_spec = maze.share_static()
+    init = {"maze": maze_spec,
+            "events": maze.get_events(),
+            "personas": pickle.dumps(personas),
+            "mock_backend": get_mock_backend(),
+            # The workers split the backends' concurrency limits between
+            # them, rather than each having all of it.
+            "backend_concurrency": get_backend_concurrency(num_workers),
+            "threads": threads}
+    maze.event_diffs = []
+
+    # We spawn (rather than fork) local workers; the server may have
+    # threads, such as the event loop of async_gpt_structure, running.
+    context = multiprocessing.get_context("spawn")
+    try:
+      if address:
+        self.listener = Listener(address, authkey=authkey)
+        if spawn_nodes:
+          for i in range(num_workers):
+            process = context.Process(target=run_worker_node,
+                                      args=(self.listener.address, authkey),
+                                      daemon=True)
+            process.start()
+            self.processes += [process]
+        else:
+          print (f"Waiting for {str(num_workers)} persona worker nodes on "
+                 f"{address[0]}:{str(address[1])}.")
+        for i in range(num_workers):
+          self.conns += [self.listener.accept()]
+      else:
+        for i in range(num_workers):
+          conn, worker_conn = context.Pipe()
+          process = context.Process(target=_run_worker, args=(worker_conn,),
+                                    daemon=True)
+          process.start()
+          worker_conn.close()
+          self.conns += [conn]
+          self.processes += [process]
+      for conn in self.conns:
+        conn.send(("init", init))
+    except:
+      self.close()
+      raise
+
+
+  def push_personas(self, persona_names):
+    """
+    Passes changes the server made to the scratch of <persona_names>
+    outside of the workers (e.g., when fast forwarding) on to the workers.
+    """
+    for persona_name in persona_names:
+      delta = {"scratch": pickle.dumps(self.personas[persona_name].scratch)}
+      for pending in self.pending_deltas:
+        pending[persona_name] = merge_persona_deltas(
+                                  pending.get(persona_name, dict()), delta)
+
+
+  def _assign_groups(self, groups):
+    """
+    Returns the groups each worker moves: a group goes to the worker that
+    owns most of its members, unless that worker already has its share of
+    the personas, in which case it goes to the one with the fewest.
+    """
+    num_workers = len(self.conns)
+    share = -(-len(self.personas) // num_workers)
+    assignments = [[] for i in range(num_workers)]
+    loads = [0] * num_workers
+    for group in sorted(groups, key=lambda i: -len(i)):
+      owned = [0] * num_workers
+      for persona_name in group:
+        owned[self.owners[persona_name]] += 1
+      worker = max(range(num_workers), key=lambda i: (owned[i], -loads[i]))
+      if loads[worker] + len(group) > share:
+        worker = min(range(num_workers), key=lambda i: loads[i])
+      assignments[worker] += [group]
+      loads[worker] += len(group)
+    return assignments
+
+
+  def move(self, step, curr_time, sec_per_step, personas_tile, groups,
+           scheduled_keys):
+    """
+    Moves every persona for the current step in the workers, and applies
+    the changes to the server's personas. This is the step barrier: we
+    return once every worker is done.
+
+    INPUT
+      step: The current step.
+      curr_time: The current time.
+      sec_per_step: The number of seconds a step takes.
+      personas_tile: The current tile of every persona.
+      groups: The cognition groups (see ReverieServer._get_cognition_groups).
+      scheduled_keys: The wake key of every persona that is scheduled and
+                      whose wake step has not come up (see
+                      CognitionScheduler.is_due); everyone else is due.
+    OUTPUT
+      movements: A dictionary keyed by persona name, with the execution
+                 Persona.move returned, and the persona's chat and what
+                 get_wake returned right after it moved.
+    """
+    assignments = self._assign_groups(groups)
+    event_diffs = self.maze.event_diffs
+    self.maze.event_diffs = []
+    for count, conn in enumerate(self.conns):
+      # A worker only needs to catch up on the personas it moves.
+      deltas = []
+      for group in assignments[count]:
+        for persona_name in group:
+          if persona_name in self.pending_deltas[count]:
+            deltas += [(persona_name,
+                        self.pending_deltas[count].pop(persona_name))]
+      conn.send(("move", {"step": step,
+                          "curr_time": curr_time,
+                          "sec_per_step": sec_per_step,
+                          "personas_tile": personas_tile,
+                          "event_diffs": event_diffs,
+                          "deltas": deltas,
+                          "groups": assignments[count],
+                          "scheduled_keys": scheduled_keys,
+                          "metrics": metrics.enabled}))
+
+    results = []
+    for count, conn in enumerate(self.conns):
+      status, result = conn.recv()
+      if status == "error":
+        raise RuntimeError(f"Persona worker {str(count)} failed:\n{result}")
+      results += [result]
+
+    movements = dict()
+    for count, result in enumerate(results):
+      movements.update(result["movements"])
+      metrics.add_records(result["records"])
+      for persona_name, delta in result["deltas"]:
+        apply_persona_delta(self.personas[persona_name], delta)
+        self.owners[persona_name] = count
+        for other, pending in enumerate(self.pending_deltas):
+          if other != count:
+            pending[persona_name] = merge_persona_deltas(
+                                      pending.get(persona_name, dict()),
+                                      delta)
+    return movements
+
+
+  def close(self):
+    """
+    Stops the workers and frees the shared maze.
+    """
+    for conn in self.conns:
+      try:
+        conn.send(("close", None))
+      except (BrokenPipeError, OSError):
+        pass
+    for process in self.processes:
+      process.join(timeout=10)
+      if process.is_alive():
+        process.terminate()
+    for conn in self.conns:
+      conn.close()
+    self.conns = []
+    self.processes = []
+    if self.listener:
+      self.listener.close()
+      self.listener = None
+
+    self.maze.event_diffs = None
+    if self.shm:
+      self.shm.close()
+      self.shm.unlink()
+      self.shm = None
+
+
+if __name__ == '__main__':
+  # Runs a worker node for the server at <host>:<port>, with the key given
+  # after it or in <PERSONA_NODE_KEY_ENV>.
+  host, port = sys.argv[1].rsplit(":", 1)
+  if len(sys.argv) > 2:
+    authkey = bytes.fromhex(sys.argv[2])
+  else:
+    authkey = get_persona_node_key()
+  if not authkey:
+    sys.exit(f"No key given; pass the one the server printed, or set "
+             f"{PERSONA_NODE_KEY_ENV}.")
+  run_worker_node((host, int(port)), authkey)
@@ -18,6 +18,8 @@ term "personas" to refer to generative agents, "associative memory" to refer
 to the memory stream, and "reverie" to refer to the overarching simulation 
 framework.
 """
+import asyncio
+import copy
 import json
 import numpy
 import datetime
@@ -28,12 +30,46 @@ import os
 import shutil
 import traceback
 
-from selenium import webdriver
+from concurrent.futures import ThreadPoolExecutor
 
 from global_methods import *
 from utils import *
+from instrumentation import metrics
+from cognition_scheduler import (CognitionScheduler, get_steps_to_wake, 
+                                 get_wake, get_wake_key)
 from maze import *
+from persona_workers import (PERSONA_NODE_KEY_ENV, PersonaPool,
+                             get_persona_node_key, is_loopback)
 from persona.persona import *
+from persona.prompt_template.async_gpt_structure import run_sync
+from step_channel import STEP_CHANNEL_KEY_FILE, StepChannel
+from step_log import StepLog, is_sealed_segment
+from trajectory_store import TrajectoryStore
+
+def is_history_step_file(f, step): 
+  """
+  Returns whether the file <f> is environment or movement history that a 
+  simulation at <step> will never write to again: either a sealed segment of
+  the step log, or the legacy per-step file of a step before <step>. 
+
+  INPUT
+    f: The path to the file. 
+    step: The current step of the simulation. 
+  OUTPUT 
+    True if <f> is a sealed "<...>/environment/log_<i>.jsonl" segment (see 
+    step_log.py), or "<...>/environment/<i>.json" for some i < step (and 
+    likewise for movement). 
+  """
+  folder, file_name = os.path.split(f)
+  if os.path.basename(folder) not in ["environment", "movement"]: 
+    return False
+  if is_sealed_segment(f): 
+    return True
+  if not file_name.endswith(".json"): 
+    return False
+  file_step = file_name[:-len(".json")]
+  return file_step.isdigit() and int(file_step) < step
+
 
 ##############################################################################
 #                                  REVERIE                                   #
@@ -42,7 +78,8 @@ from persona.persona import *
 class ReverieServer: 
   def __init__(self, 
                fork_sim_code,
-               sim_code):
+               sim_code,
+               fork_mode="link"):
     # FORKING FROM A PRIOR SIMULATION:
     # <fork_sim_code> indicates the simulation we are forking from. 
     # Interestingly, all simulations must be forked from some initial 
@@ -53,9 +90,20 @@ class ReverieServer:
     # <sim_code> indicates our current simulation. The first step here is to 
     # copy everything that's in <fork_sim_code>, but edit its 
     # reverie/meta/json's fork variable. 
+    # <fork_mode> decides how the forked simulation's history is brought 
+    # over. With "copy", everything is copied. With "link", the environment
+    # and movement files of the steps before the fork point are hardlinked,
+    # since the forked simulation only ever writes steps after it; only the 
+    # personas' memory, the meta file and the latest steps are copied. 
     self.sim_code = sim_code
     sim_folder = f"{fs_storage}/{self.sim_code}"
-    copyanything(fork_folder, sim_folder)
+    with open(f"{fork_folder}/reverie/meta.json") as json_file:  
+      fork_step = json.load(json_file)["step"]
+    if fork_mode == "link": 
+      linkanything(fork_folder, sim_folder, 
+                   lambda f: is_history_step_file(f, fork_step))
+    else: 
+      copyanything(fork_folder, sim_folder)
 
     with open(f"{sim_folder}/reverie/meta.json") as json_file:  
       reverie_meta = json.load(json_file)
@@ -105,6 +153,11 @@ class ReverieServer:
     # The tile take the form of a set, (row, col). 
     # e.g., ["Isabella Rodriguez"] = (58, 39)
     self.personas_tile = dict()
+    # <personas_next_tile> is a dictionary that contains the tile each 
+    # persona was told to move to in the last step (i.e., the "movement" the
+    # backend sent to the frontend). It is empty until the first step. 
+    # e.g., ["Isabella Rodriguez"] = (58, 40)
+    self.personas_next_tile = dict()
     
     # # <persona_convo_match> is a dictionary that describes which of the two
     # # personas are talking to each other. It takes a key of a persona's full
@@ -118,9 +171,19 @@ class ReverieServer:
     # # e.g., dict[("Adam Abraham", "Zane Xu")] = "Adam: baba \n Zane:..."
     # self.persona_convo = dict()
 
+    # <environment_log> and <movement_log> are the step logs that record the
+    # personas' locations (as reported by the frontend) and the movements 
+    # we send back, for each step. See step_log.py. 
+    self.environment_log = StepLog(f"{sim_folder}/environment")
+    self.movement_log = StepLog(f"{sim_folder}/movement")
+    # <trajectory> is the columnar copy of the movements (positions as an 
+    # int16 array, the rest interned), for replay and analysis. See 
+    # trajectory_store.py. 
+    self.trajectory = TrajectoryStore(f"{sim_folder}/trajectory", 
+                                      reverie_meta['persona_names'])
+
     # Loading in all personas. 
-    init_env_file = f"{sim_folder}/environment/{str(self.step)}.json"
-    init_env = json.load(open(init_env_file))
+    init_env = self.environment_log.read(self.step)
     for persona_name in reverie_meta['persona_names']: 
       persona_folder = f"{sim_folder}/personas/{persona_name}"
       p_x = init_env[persona_name]["x"]
@@ -129,13 +192,84 @@ class ReverieServer:
 
       self.personas[persona_name] = curr_persona
       self.personas_tile[persona_name] = (p_x, p_y)
-      self.maze.tiles[p_y][p_x]["events"].add(curr_persona.scratch
-                                              .get_curr_event_and_desc())
+      self.maze.add_event_from_tile(curr_persona.scratch
+                                    .get_curr_event_and_desc(), (p_x, p_y))
 
     # REVERIE SETTINGS PARAMETERS:  
     # <server_sleep> denotes the amount of time that our while loop rests each
     # cycle; this is to not kill our machine. 
     self.server_sleep = 0.1
+    # <cognition_workers> denotes the number of worker threads that run the
+    # personas' cognitive chains (perceive, retrieve, plan, reflect, execute)
+    # in each step. With 1, the personas move one after another. With more
+    # than 1, personas that cannot interact with each other in the current
+    # step run concurrently; see _get_cognition_groups.
+    self.cognition_workers = 1
+    # <persona_processes> denotes the number of worker processes that the 
+    # personas' cognitive chains run in during "run". With 1, they run in 
+    # this process. With more than 1, the cognition groups are spread over
+    # the processes (each of which runs its groups on <cognition_workers> 
+    # threads); see persona_workers.py. 
+    # <persona_nodes_address> is the (host, port) pair we listen on for 
+    # worker nodes, if the workers are to be nodes that connect over TCP 
+    # (started by hand on any machine with "python persona_workers.py 
+    # <host>:<port> <key>", or by us as local processes if <spawn_persona_nodes>
+    # is on) rather than child processes. 
+    # <persona_pool> is the PersonaPool while the server runs. 
+    self.persona_processes = 1
+    self.persona_nodes_address = None
+    self.spawn_persona_nodes = False
+    self.persona_pool = None
+    # <write_step_files> denotes whether we keep logging each step's 
+    # environment and movements to <environment_log> and <movement_log>. 
+    # The frontend no longer needs them when the step channel is up, but 
+    # replay and compress_sim_storage read them. 
+    self.write_step_files = True
+    # <headless> denotes whether we run without the frontend. When True, the
+    # backend does not wait for the frontend to report the personas' 
+    # locations; it moves each persona to the tile it was sent to in the 
+    # last step and carries on, so "run" goes as fast as the personas can 
+    # think. 
+    self.headless = False
+    # <fast_forward> denotes whether, in headless mode, we skip ahead over 
+    # stretches of steps in which nothing can change (e.g., at night, when 
+    # everyone is asleep). The skipped steps share one "no change" record in
+    # the step logs. See _get_quiet_steps. 
+    self.fast_forward = False
+    # <personas_maze_events> is a dictionary that contains the events each
+    # persona put on the maze in the last step (its own event, and the event
+    # of the object it is using, if it got there). 
+    self.personas_maze_events = dict()
+    # <cognition_scheduling> denotes whether only the personas that are due 
+    # run their full cognitive chain in each step; the rest, who are in the
+    # middle of an action and see nothing new, just move along their path.
+    # <cognition_scheduler> keeps the step at which each persona is next 
+    # due. See cognition_scheduler.py. 
+    self.cognition_scheduling = True
+    self.cognition_scheduler = CognitionScheduler()
+    # <metrics_file> is where the per-step instrumentation records (time,
+    # calls and LLM/embedding round trips per stage and persona) are 
+    # appended as json lines while the instrumentation is on. See 
+    # instrumentation.py. 
+    self.metrics_file = f"{sim_folder}/reverie/metrics.jsonl"
+
+    # RESUMING FROM THE WRITE-AHEAD LOG: 
+    # <wal_file> is the write-ahead log of the simulation. After every step,
+    # we append what changed in the personas' state (new associative memory
+    # nodes, changed scratch values, and the spatial memory tree if it 
+    # changed) along with Reverie's own step state. save() clears it. If the
+    # server died before the last save, we replay it here to pick up at the 
+    # last completed step without redoing any of the LLM calls. 
+    # <wal_state> holds, for each persona, the state as of the last record. 
+    # <wal_sync_steps> is the number of steps between fsyncs of the log. 
+    # Every record is handed to the OS right away, so this only bounds what
+    # a crash of the machine (rather than of the server) can lose. 
+    # <wal_unsynced> counts the records written since the last fsync. 
+    self.wal_file = f"{sim_folder}/reverie/wal.jsonl"
+    self.wal_state = dict()
+    self.wal_sync_steps = 10
+    self.wal_unsynced = 0
+    self._replay_wal()
 
     # SIGNALING THE FRONTEND SERVER: 
     # curr_sim_code.json contains the current simulation code, and
@@ -153,6 +287,13 @@ class ReverieServer:
     with open(f"{fs_temp_storage}/curr_step.json", "w") as outfile: 
       outfile.write(json.dumps(curr_step, indent=2))
 
+    # <step_channel> is the local message channel the frontend server pushes
+    # each step's environment through, and waits on for the movements. It is
+    # only open while start_server runs. When it is None (or could not be 
+    # opened), the two servers signal each other through the per-step files
+    # as before. 
+    self.step_channel = None
+
 
   def save(self): 
     """
@@ -186,6 +327,136 @@ class ReverieServer:
       save_folder = f"{sim_folder}/personas/{persona_name}/bootstrap_memory"
       persona.save(save_folder)
 
+    # Everything in the write-ahead log is now saved. 
+    if check_if_file_exists(self.wal_file): 
+      os.remove(self.wal_file)
+    self._reset_wal_state()
+
+
+  def _reset_wal_state(self): 
+    for persona_name, persona in self.personas.items(): 
+      self.wal_state[persona_name] = {
+        "node_count": len(persona.a_mem.id_to_node), 
+        "embedding_keys": set(persona.a_mem.embeddings.keys()), 
+        "scratch": dict(), 
+        "s_mem_version": None}
+
+
+  def _write_wal(self): 
+    """
+    Appends the record of the step that just finished to the write-ahead 
+    log. A persona's record only holds what changed since the last record:
+    its new associative memory nodes, the scratch values that changed, and 
+    the spatial memory tree if it changed. 
+
+    INPUT
+      None
+    OUTPUT 
+      None
+    """
+    record = dict()
+    record["step"] = self.step
+    record["curr_time"] = self.curr_time.strftime("%B %d, %Y, %H:%M:%S")
+    record["personas_tile"] = self.personas_tile
+    record["personas_next_tile"] = self.personas_next_tile
+    record["personas"] = dict()
+    for persona_name, persona in self.personas.items(): 
+      wal_state = self.wal_state[persona_name]
+      persona_record = dict()
+
+      a_mem = persona.a_mem.get_node_entries(wal_state["node_count"], 
+                                             wal_state["embedding_keys"])
+      wal_state["node_count"] = len(persona.a_mem.id_to_node)
+      if a_mem: 
+        persona_record["a_mem"] = a_mem
+
+      # We keep copies of the values we wrote, since the lists and 
+      # dictionaries in the scratch are changed in place. 
+      last_scratch = wal_state["scratch"]
+      scratch_delta = dict()
+      for key, val in persona.scratch.get_state().items(): 
+        if key not in last_scratch or last_scratch[key] != val: 
+          scratch_delta[key] = val
+          last_scratch[key] = copy.deepcopy(val)
+      if scratch_delta: 
+        persona_record["scratch"] = scratch_delta
+
+      if persona.s_mem.version != wal_state["s_mem_version"]: 
+        persona_record["s_mem"] = persona.s_mem.tree
+        wal_state["s_mem_version"] = persona.s_mem.version
+
+      record["personas"][persona_name] = persona_record
+
+    with open(self.wal_file, "a") as outfile: 
+      outfile.write(json.dumps(record) + "\n")
+      outfile.flush()
+      self.wal_unsynced += 1
+      if self.wal_unsynced >= self.wal_sync_steps: 
+        os.fsync(outfile.fileno())
+        self.wal_unsynced = 0
+
+
+  def _replay_wal(self): 
+    """
+    Replays the write-ahead log (if there is one) on top of the state we 
+    loaded from the last save, bringing the simulation back to the last 
+    step that was completed. 
+
+    INPUT
+      None
+    OUTPUT 
+      None
+    """
+    self._reset_wal_state()
+    if not check_if_file_exists(self.wal_file): 
+      return
+
+    replayed = 0
+    for line in open(self.wal_file): 
+      try: 
+        record = json.loads(line)
+      except ValueError: 
+        # The server died while writing this record. 
+        break
+      if record["step"] <= self.step: 
+        continue
+
+      for persona_name, persona_record in record["personas"].items(): 
+        persona = self.personas[persona_name]
+        wal_state = self.wal_state[persona_name]
+        if "a_mem" in persona_record: 
+          persona.a_mem.add_node_entries(persona_record["a_mem"])
+          wal_state["node_count"] = len(persona.a_mem.id_to_node)
+          wal_state["embedding_keys"].update(persona.a_mem.embeddings.keys())
+        if "scratch" in persona_record: 
+          wal_state["scratch"].update(persona_record["scratch"])
+        if "s_mem" in persona_record: 
+          persona.s_mem.set_tree(persona_record["s_mem"])
+          wal_state["s_mem_version"] = persona.s_mem.version
+
+      self.step = record["step"]
+      self.curr_time = datetime.datetime.strptime(record["curr_time"], 
+                                                  "%B %d, %Y, %H:%M:%S")
+      for persona_name, tile in record["personas_tile"].items(): 
+        # We move the persona's event on the backend tile map along. 
+        self.maze.remove_subject_events_from_tile(
+          persona_name, self.personas_tile[persona_name])
+        self.personas_tile[persona_name] = tuple(tile)
+      for persona_name, tile in record["personas_next_tile"].items(): 
+        self.personas_next_tile[persona_name] = tuple(tile)
+      replayed += 1
+
+    if not replayed: 
+      return
+
+    for persona_name, persona in self.personas.items(): 
+      if self.wal_state[persona_name]["scratch"]: 
+        persona.scratch.set_state(json.loads(json.dumps(
+          self.wal_state[persona_name]["scratch"])))
+      self.maze.add_event_from_tile(persona.scratch.get_curr_event_and_desc(),
+                                    self.personas_tile[persona_name])
+    print (f"Resumed from the write-ahead log at step {self.step}.")
+
 
   def start_path_tester_server(self): 
     """
@@ -245,23 +516,25 @@ class ReverieServer:
           if curr_tile_det["world"] not in s_mem: 
             s_mem[world] = dict()
 
-          # Iterating throughn the nearby tiles.
-          nearby_tiles = self.maze.get_nearby_tiles(curr_camera, curr_vision)
-          for i in nearby_tiles: 
-            i_det = self.maze.access_tile(i)
-            if (curr_tile_det["sector"] == i_det["sector"] 
-                and curr_tile_det["arena"] == i_det["arena"]): 
-              if i_det["sector"] != "": 
-                if i_det["sector"] not in s_mem[world]: 
-                  s_mem[world][i_det["sector"]] = dict()
-              if i_det["arena"] != "": 
-                if i_det["arena"] not in s_mem[world][i_det["sector"]]: 
-                  s_mem[world][i_det["sector"]][i_det["arena"]] = list()
-              if i_det["game_object"] != "": 
-                if (i_det["game_object"] 
-                    not in s_mem[world][i_det["sector"]][i_det["arena"]]):
-                  s_mem[world][i_det["sector"]][i_det["arena"]] += [
-                                                         i_det["game_object"]]
+          # Iterating through the locations of the nearby tiles that are in 
+          # the camera's arena, in the order the tiles first show them. 
+          window = self.maze.get_nearby_window(curr_camera, curr_vision)
+          arena_grid = self.maze.path_grids["arena"]
+          in_arena = (arena_grid[window].T 
+                      == arena_grid[curr_camera[1], curr_camera[0]])
+          location_ids, first_index = numpy.unique(
+            self.maze.location_grid[window].T[in_arena], return_index=True)
+          for location_id in location_ids[numpy.argsort(first_index)].tolist(): 
+            world, sector, arena, game_object = self.maze.locations[location_id]
+            if sector != "": 
+              if sector not in s_mem[world]: 
+                s_mem[world][sector] = dict()
+            if arena != "": 
+              if arena not in s_mem[world][sector]: 
+                s_mem[world][sector][arena] = list()
+            if game_object != "": 
+              if game_object not in s_mem[world][sector][arena]:
+                s_mem[world][sector][arena] += [game_object]
 
         # Incrementally outputting the s_mem and saving the json file. 
         print ("= " * 15)
@@ -276,7 +549,409 @@ class ReverieServer:
       time.sleep(self.server_sleep * 10)
 
 
-  def start_server(self, int_counter): 
+  def _get_cognition_groups(self):
+    """
+    Partitions the personas into groups that cannot affect each other in the
+    current step.
+
+    A persona's cognition only reaches into another persona's state when it
+    perceives that persona (which is what _should_react and _chat_react in
+    plan.py act upon), or when its current action is directed at that
+    persona (e.g., "<persona> Maria Lopez" in execute, or chatting_with in
+    reflect). Since the maze is not modified while the personas are moving,
+    we can tell who could perceive whom before any of them move: it is
+    exactly the persona events in the same arena within the persona's
+    vision radius. We join personas that could interact into the same group.
+
+    INPUT
+      None
+    OUTPUT
+      groups: A list of lists of persona names. Every persona appears in
+              exactly one group, and the names within each group (as well as
+              the groups themselves) keep the order of self.personas.
+    """
+    persona_names = list(self.personas.keys())
+    persona_index = {name: count for count, name in enumerate(persona_names)}
+    parent = list(range(len(persona_names)))
+
+    def find(i):
+      while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+      return i
+
+    def union(i, j):
+      i, j = find(i), find(j)
+      if i != j:
+        parent[max(i, j)] = min(i, j)
+
+    for persona_name, persona in self.personas.items():
+      curr_tile = self.personas_tile[persona_name]
+      related = set()
+
+      # Other personas this persona could perceive in this step.
+      for tile, event in self.maze.get_arena_events_in_view(
+                           curr_tile, persona.scratch.vision_r):
+        if event[0] in persona_index:
+          related.add(event[0])
+
+      # Other personas this persona is currently acting upon.
+      if (persona.scratch.act_address
+          and "<persona>" in persona.scratch.act_address):
+        related.add(persona.scratch.act_address.split("<persona>")[-1]
+                                               .strip())
+      if persona.scratch.chatting_with:
+        related.add(persona.scratch.chatting_with)
+
+      for other_name in related:
+        if other_name in persona_index and other_name != persona_name:
+          union(persona_index[persona_name], persona_index[other_name])
+
+    groups = dict()
+    for count, persona_name in enumerate(persona_names):
+      groups.setdefault(find(count), []).append(persona_name)
+    return list(groups.values())
+
+
+  def _move_personas(self):
+    """
+    Runs the cognitive chain of every persona for the current step and
+    collects their movements.
+
+    If <cognition_workers> is larger than 1, the groups returned by
+    _get_cognition_groups run concurrently (see _move_personas_async); 
+    with a <persona_pool>, they run in its worker processes (see 
+    _move_personas_in_pool).
+    Personas within a group still move one after another in the order of
+    self.personas, so given the same LLM outputs (and persona.rng states),
+    the outcome is the same as moving everyone serially.
+
+    With <cognition_scheduling> on, personas that are not due (see _is_due)
+    skip their full cognitive chain unless they see something new.
+
+    INPUT
+      None
+    OUTPUT
+      movements: A dictionary keyed by persona name, where each value is a
+                 dictionary with the keys "movement", "pronunciatio",
+                 "description", and "chat".
+    """
+    due_names = self.cognition_scheduler.pop_due(self.step)
+    if self.persona_pool:
+      return self._move_personas_in_pool(due_names)
+    if self.cognition_workers > 1:
+      return run_sync(self._move_personas_async(due_names))
+
+    movements = dict()
+    for persona_name, persona in self.personas.items():
+      execution = persona.move(self.maze, self.personas,
+                               self.personas_tile[persona_name],
+                               self.curr_time,
+                               self._is_due(persona_name, persona, due_names))
+      movements[persona_name] = self._get_movement(persona, execution)
+      self._schedule_wake(persona_name, persona)
+    return movements
+
+
+  async def _move_personas_async(self, due_names):
+    """
+    The asynchronous variant of _move_personas. Every group of personas is
+    its own task on the event loop, and each persona's cognitive chain runs
+    on a pool of <cognition_workers> threads (see Persona.move_async). All
+    their LLM and embedding requests share the event loop and its per
+    backend concurrency limits.
+
+    INPUT
+      due_names: The personas whose wake step came up (see _is_due). 
+    OUTPUT
+      movements: See _move_personas.
+    """
+    async def move_group(group, pool):
+      group_movements = dict()
+      for persona_name in group:
+        persona = self.personas[persona_name]
+        due = self._is_due(persona_name, persona, due_names)
+        execution = await persona.move_async(self.maze, self.personas,
+                                             self.personas_tile[persona_name],
+                                             self.curr_time, due,
+                                             executor=pool)
+        group_movements[persona_name] = self._get_movement(persona,
+                                                           execution)
+        self._schedule_wake(persona_name, persona)
+      return group_movements
+
+    groups = self._get_cognition_groups()
+    all_movements = dict()
+    with ThreadPoolExecutor(max_workers=self.cognition_workers) as pool:
+      for group_movements in await asyncio.gather(
+                                  *[move_group(i, pool) for i in groups]):
+        all_movements.update(group_movements)
+
+    # We return the movements in the order of self.personas regardless of
+    # the order in which the groups finished.
+    movements = dict()
+    for persona_name in self.personas.keys():
+      movements[persona_name] = all_movements[persona_name]
+    return movements
+
+
+  def _move_personas_in_pool(self, due_names):
+    """
+    The variant of _move_personas that moves the personas in the worker
+    processes of <persona_pool>. The changes the personas went through come
+    back to self.personas before we return. 
+
+    INPUT
+      due_names: The personas whose wake step came up (see _is_due). 
+    OUTPUT
+      movements: See _move_personas.
+    """
+    # Whether a persona is due is decided in the worker, right before it 
+    # moves, as in _is_due. 
+    scheduled_keys = dict()
+    if self.cognition_scheduling: 
+      for persona_name, wake_key in self.cognition_scheduler.wake_keys.items():
+        if persona_name not in due_names: 
+          scheduled_keys[persona_name] = wake_key
+
+    executions = self.persona_pool.move(self.step, self.curr_time, 
+                                        self.sec_per_step, 
+                                        self.personas_tile, 
+                                        self._get_cognition_groups(), 
+                                        scheduled_keys)
+    movements = dict()
+    for persona_name, persona in self.personas.items():
+      execution, chat, wake = executions[persona_name]
+      movements[persona_name] = self._get_movement(persona, execution)
+      movements[persona_name]["chat"] = chat
+      self._schedule_wake(persona_name, persona, wake)
+    return movements
+
+
+  def _get_movement(self, persona, execution):
+    """
+    Turns the execution returned by Persona.move into the movement record
+    we send to the frontend.
+
+    Note that we read the chat right after the persona moves: a persona that
+    moves later in the same step may still start a conversation with this
+    persona.
+
+    INPUT
+      persona: The <Persona> instance that just moved.
+      execution: The (next_tile, pronunciatio, description) triple that
+                 Persona.move returned.
+    OUTPUT
+      A dictionary with the keys "movement", "pronunciatio", "description",
+      and "chat".
+    """
+    # <next_tile> is a x,y coordinate. e.g., (58, 9)
+    # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
+    # <description> is a string description of the movement. e.g.,
+    #   writing her next novel (editing her novel)
+    #   @ double studio:double studio:common room:sofa
+    next_tile, pronunciatio, description = execution
+    movement = dict()
+    movement["movement"] = next_tile
+    movement["pronunciatio"] = pronunciatio
+    movement["description"] = description
+    movement["chat"] = persona.scratch.chat
+    return movement
+
+
+  def _get_maze_events(self, persona): 
+    """
+    Returns the events <persona> puts on the maze in the current step: its 
+    own event, and the event of the object it is using (None while it is 
+    still on its way there). 
+    """
+    obj_event = None
+    if not persona.scratch.planned_path: 
+      obj_event = persona.scratch.get_curr_obj_event_and_desc()
+    return (persona.scratch.get_curr_event_and_desc(), obj_event)
+
+
+  def _get_quiet_steps(self): 
+    """
+    Returns the number of steps, starting from the current one, in which 
+    nothing can change: every persona stays where it is and keeps doing what
+    it is doing, so their cognitive chains would not add anything to their
+    memory or make a single LLM call. 
+
+    That is the case while, for every persona, 
+      - it is standing still at the end of its path (and not on a <random>
+        action, which picks a new spot whenever it gets there), 
+      - it is not chatting, 
+      - it shows the same events on the maze as in the last step, so that 
+        everyone perceives the same world as in the last step, 
+      - its last perceive found nothing new, and its reflection is not due, 
+        and 
+      - it does not wake up (see _get_steps_to_wake). 
+
+    INPUT
+      None
+    OUTPUT 
+      The number of steps that can be skipped (0 if none). 
+    """
+    quiet_steps = None
+    for persona_name, persona in self.personas.items(): 
+      scratch = persona.scratch
+      if (persona.perceived_new
+          or scratch.planned_path
+          or not scratch.act_path_set
+          or not scratch.act_address
+          or "<random>" in scratch.act_address
+          or scratch.chatting_with
+          or scratch.chatting_end_time
+          or (self.personas_next_tile.get(persona_name) 
+              != self.personas_tile[persona_name])
+          or (self.personas_maze_events.get(persona_name) 
+              != self._get_maze_events(persona))): 
+        return 0
+      if (scratch.importance_trigger_curr <= 0 
+          and [] != persona.a_mem.seq_event + persona.a_mem.seq_thought): 
+        return 0
+
+      persona_steps = self._get_steps_to_wake(persona, self.curr_time)
+      if quiet_steps is None or persona_steps < quiet_steps: 
+        quiet_steps = persona_steps
+    return quiet_steps or 0
+
+
+  def _get_steps_to_wake(self, persona, curr_time): 
+    """
+    Returns the number of steps, starting from the one at <curr_time>, 
+    before <persona> has to run its full cognitive chain again (see 
+    cognition_scheduler.get_steps_to_wake). 
+    """
+    return get_steps_to_wake(persona, curr_time, self.sec_per_step)
+
+
+  def _is_due(self, persona_name, persona, due_names): 
+    """
+    Returns whether <persona> has to run its full cognitive chain in the 
+    current step. <due_names> are the personas whose wake step came up (see
+    CognitionScheduler.pop_due). 
+    """
+    if not self.cognition_scheduling or persona_name in due_names: 
+      return True
+    return self.cognition_scheduler.is_due(persona_name, 
+                                           get_wake_key(persona))
+
+
+  def _schedule_wake(self, persona_name, persona, wake=None): 
+    """
+    Schedules the next step at which <persona>, which just moved in the 
+    current step, has to run its full cognitive chain. If it moved in a 
+    worker process, <wake> is what get_wake returned there right after it 
+    moved (see persona_workers.py). 
+    """
+    if not self.cognition_scheduling: 
+      return
+    if wake is None: 
+      next_time = self.curr_time + datetime.timedelta(
+                                     seconds=self.sec_per_step)
+      wake = get_wake(persona, next_time, self.sec_per_step)
+    steps_to_wake, wake_key = wake
+    self.cognition_scheduler.schedule(persona_name, 
+                                      self.step + 1 + steps_to_wake, 
+                                      wake_key)
+
+
+  def _fast_forward(self, num_steps, movements): 
+    """
+    Skips <num_steps> steps in which nothing changes (see _get_quiet_steps)
+    in one go. The personas stay put, the logs get one "no change" record 
+    that stands for all of the skipped steps, and the personas' clocks (and
+    whatever else their cognitive chains would have counted down) move 
+    ahead as if they ran. 
+
+    INPUT
+      num_steps: The number of steps to skip. 
+      movements: The movements of the last step. 
+    OUTPUT 
+      None
+    """
+    first_step = self.step
+    last_step = self.step + num_steps - 1
+
+    # The record's curr_time is that of the first step; a reader can work 
+    # out the others from "no_change". 
+    record = {"persona": movements["persona"], 
+              "meta": {"curr_time": self.curr_time.strftime(
+                                      "%B %d, %Y, %H:%M:%S"), 
+                       "no_change": {"first_step": first_step, 
+                                     "last_step": last_step, 
+                                     "sec_per_step": self.sec_per_step}}}
+    if self.write_step_files: 
+      env = dict()
+      for persona_name, tile in self.personas_tile.items(): 
+        env[persona_name] = {"maze": self.maze.maze_name, 
+                             "x": tile[0], "y": tile[1]}
+      self.environment_log.append_range(first_step, last_step, env)
+      self.movement_log.append_range(first_step, last_step, record)
+      self.trajectory.append(first_step, record, num_steps)
+
+    # The personas last "ran" at the last skipped step. Each step, plan 
+    # counts down the chatting buffers of everyone they are not chatting 
+    # with. 
+    last_time = (self.curr_time 
+                 + datetime.timedelta(seconds=self.sec_per_step 
+                                              * (num_steps - 1)))
+    for persona_name, persona in self.personas.items(): 
+      persona.scratch.curr_time = last_time
+      for name in persona.scratch.chatting_with_buffer: 
+        if name != persona.scratch.chatting_with: 
+          persona.scratch.chatting_with_buffer[name] -= num_steps
+    if self.persona_pool: 
+      self.persona_pool.push_personas(self.personas.keys())
+
+    self.step += num_steps
+    self.curr_time += datetime.timedelta(seconds=self.sec_per_step 
+                                                 * num_steps)
+    self._write_wal()
+
+
+  def _get_environment(self): 
+    """
+    Returns the environment the frontend output for the current step, or 
+    None if it is not there yet. The environment is taken from the step 
+    channel if the frontend pushed it there (waiting for up to 
+    <server_sleep> seconds), and from the environment log otherwise.
+    In headless mode, we do not wait for the frontend; every persona is 
+    simply where the last step's movement sent them. 
+
+    INPUT
+      None
+    OUTPUT 
+      The environment dictionary, keyed by persona name, e.g., 
+      {"Maria Lopez": {"maze": "the_ville", "x": 58, "y": 9}}
+    """
+    if self.headless: 
+      new_env = dict()
+      for persona_name, tile in self.personas_tile.items(): 
+        x, y = self.personas_next_tile.get(persona_name, tile)
+        new_env[persona_name] = {"maze": self.maze.maze_name, "x": x, "y": y}
+      if self.write_step_files: 
+        self.environment_log.append(self.step, new_env)
+      return new_env
+
+    if self.step_channel: 
+      new_env = self.step_channel.get_environment(self.step, 
+                                                  self.server_sleep)
+      if new_env: 
+        if self.write_step_files: 
+          self.environment_log.append(self.step, new_env)
+        return new_env
+
+    try: 
+      # Try and save block for robustness of the while loop.
+      return self.environment_log.read(self.step)
+    except: 
+      return None
+
+
+  def start_server(self, int_counter):
     """
     The main backend server of Reverie. 
     This function retrieves the environment file from the frontend to 
@@ -286,12 +961,41 @@ class ReverieServer:
     INPUT
       int_counter: Integer value for the number of steps left for us to take
                    in this iteration. 
-    OUTPUT 
+    OUTPUT
+      None
+    """
+    # The step channel is open for as long as we run; in between runs, the
+    # frontend falls back to the per-step files. 
+    self.step_channel = StepChannel(self.sim_code, 
+                               f"{fs_temp_storage}/{STEP_CHANNEL_KEY_FILE}")
+    if not self.step_channel.start(): 
+      self.step_channel = None
+    try:
+      # With more than one persona process, the personas move in a pool of
+      # worker processes for as long as we run.
+      if self.persona_processes > 1:
+        self.persona_pool = PersonaPool(self.persona_processes, self.maze,
+                                        self.personas, self.cognition_workers,
+                                        self.persona_nodes_address,
+                                        self.spawn_persona_nodes)
+      self._run_steps(int_counter)
+    finally:
+      if self.persona_pool:
+        self.persona_pool.close()
+        self.persona_pool = None
+      if self.step_channel: 
+        self.step_channel.close()
+        self.step_channel = None
+
+
+  def _run_steps(self, int_counter):
+    """
+    The main while loop of start_server.
+    INPUT
+      int_counter: See start_server.
+    OUTPUT
       None
     """
-    # <sim_folder> points to the current simulation folder.
-    sim_folder = f"{fs_storage}/{self.sim_code}"
-
     # When a persona arrives at a game object, we give a unique event
     # to that object. 
     # e.g., ('double studio[...]:bed', 'is', 'unmade', 'unmade')
@@ -308,23 +1012,17 @@ class ReverieServer:
       if int_counter == 0: 
         break
 
-      # <curr_env_file> file is the file that our frontend outputs. When the
-      # frontend has done its job and moved the personas, then it will put a 
-      # new environment file that matches our step count. That's when we run 
+      # <new_env> is the environment that our frontend outputs. When the
+      # frontend has done its job and moved the personas, then it will push 
+      # a new environment that matches our step count. That's when we run 
       # the content of this for loop. Otherwise, we just wait. 
-      curr_env_file = f"{sim_folder}/environment/{self.step}.json"
-      if check_if_file_exists(curr_env_file):
-        # If we have an environment file, it means we have a new perception
-        # input to our personas. So we first retrieve it.
-        try: 
-          # Try and save block for robustness of the while loop.
-          with open(curr_env_file) as json_file:
-            new_env = json.load(json_file)
-            env_retrieved = True
-        except: 
-          pass
-      
-        if env_retrieved: 
+      new_env = self._get_environment()
+      if new_env: 
+        metrics.set_step(self.step)
+
+        with metrics.stage("update_maze"): 
+          # If we have a new environment, it means we have a new perception
+          # input to our personas. 
           # This is where we go through <game_obj_cleanup> to clean up all 
           # object actions that were used in this cylce. 
           for key, val in game_obj_cleanup.items(): 
@@ -364,52 +1062,70 @@ class ReverieServer:
                        None, None, None)
               self.maze.remove_event_from_tile(blank, new_tile)
 
-          # Then we need to actually have each of the personas perceive and
-          # move. The movement for each of the personas comes in the form of
-          # x y coordinates where the persona will move towards. e.g., (50, 34)
-          # This is where the core brains of the personas are invoked. 
-          movements = {"persona": dict(), 
+            self.personas_maze_events[persona_name] = self._get_maze_events(
+                                                        persona)
+
+        # Then we need to actually have each of the personas perceive and
+        # move. The movement for each of the personas comes in the form of
+        # x y coordinates where the persona will move towards. e.g., (50, 34)
+        # This is where the core brains of the personas are invoked. 
+        with metrics.stage("move_personas"): 
+          movements = {"persona": self._move_personas(),
                        "meta": dict()}
-          for persona_name, persona in self.personas.items(): 
-            # <next_tile> is a x,y coordinate. e.g., (58, 9)
-            # <pronunciatio> is an emoji. e.g., "\ud83d\udca4"
-            # <description> is a string description of the movement. e.g., 
-            #   writing her next novel (editing her novel) 
-            #   @ double studio:double studio:common room:sofa
-            next_tile, pronunciatio, description = persona.move(
-              self.maze, self.personas, self.personas_tile[persona_name], 
-              self.curr_time)
-            movements["persona"][persona_name] = {}
-            movements["persona"][persona_name]["movement"] = next_tile
-            movements["persona"][persona_name]["pronunciatio"] = pronunciatio
-            movements["persona"][persona_name]["description"] = description
-            movements["persona"][persona_name]["chat"] = (persona
-                                                          .scratch.chat)
-
-          # Include the meta information about the current stage in the 
-          # movements dictionary. 
-          movements["meta"]["curr_time"] = (self.curr_time 
-                                             .strftime("%B %d, %Y, %H:%M:%S"))
-
-          # We then write the personas' movements to a file that will be sent 
-          # to the frontend server. 
-          # Example json output: 
-          # {"persona": {"Maria Lopez": {"movement": [58, 9]}},
-          #  "persona": {"Klaus Mueller": {"movement": [38, 12]}}, 
-          #  "meta": {curr_time: <datetime>}}
-          curr_move_file = f"{sim_folder}/movement/{self.step}.json"
-          with open(curr_move_file, "w") as outfile: 
-            outfile.write(json.dumps(movements, indent=2))
-
-          # After this cycle, the world takes one step forward, and the 
-          # current time moves by <sec_per_step> amount. 
-          self.step += 1
-          self.curr_time += datetime.timedelta(seconds=self.sec_per_step)
-
-          int_counter -= 1
+
+        # Include the meta information about the current stage in the 
+        # movements dictionary. 
+        movements["meta"]["curr_time"] = (self.curr_time 
+                                           .strftime("%B %d, %Y, %H:%M:%S"))
+        for persona_name, movement in movements["persona"].items(): 
+          self.personas_next_tile[persona_name] = tuple(movement["movement"])
+
+        # We then send the personas' movements to the frontend server, and 
+        # (if the step channel is down, or we keep the step files) log them.
+        # The channel closes when the run ends, so the movements of the 
+        # run's last step are logged either way, for the frontend to pick up
+        # after that. 
+        # Example json output: 
+        # {"persona": {"Maria Lopez": {"movement": [58, 9]}},
+        #  "persona": {"Klaus Mueller": {"movement": [38, 12]}}, 
+        #  "meta": {curr_time: <datetime>}}
+        with metrics.stage("write_movement"): 
+          if self.step_channel: 
+            self.step_channel.put_movement(self.step, movements)
+          if not self.step_channel or self.write_step_files: 
+            self.movement_log.append(self.step, movements)
+            self.trajectory.append(self.step, movements)
+          elif int_counter == 1: 
+            self.movement_log.append(self.step, movements)
+
+        # After this cycle, the world takes one step forward, and the 
+        # current time moves by <sec_per_step> amount. 
+        self.step += 1
+        self.curr_time += datetime.timedelta(seconds=self.sec_per_step)
+
+        # We log the step to the write-ahead log so that we can resume from
+        # here if the server dies before the next save. 
+        with metrics.stage("write_wal"): 
+          self._write_wal()
+
+        # The step's instrumentation records go to <metrics_file>. 
+        if metrics.enabled: 
+          metrics.write_json_lines(self.metrics_file)
+
+        int_counter -= 1
+
+        # If nothing can change for a while, we jump ahead over those steps.
+        if self.fast_forward and self.headless and int_counter > 0: 
+          quiet_steps = min(self._get_quiet_steps(), int_counter)
+          if quiet_steps > 0: 
+            with metrics.stage("fast_forward"): 
+              self._fast_forward(quiet_steps, movements)
+            int_counter -= quiet_steps
           
-      # Sleep so we don't burn our machines. 
-      time.sleep(self.server_sleep)
+      # Sleep so we don't burn our machines. When the step channel is up, 
+      # _get_environment has already waited for up to <server_sleep>.
+      elif not self.step_channel and not self.headless: 
+        time.sleep(self.server_sleep)
 
 
   def open_server(self): 
@@ -467,6 +1183,85 @@ class ReverieServer:
           int_count = int(sim_command.split()[-1])
           rs.start_server(int_count)
 
+        elif ("set cognition workers"
+              in sim_command[:21].lower()):
+          # Sets the number of worker threads that run the personas'
+          # cognition concurrently in each step. 1 moves them serially.
+          # Example: set cognition workers 8
+          self.cognition_workers = max(1, int(sim_command.split()[-1]))
+
+        elif ("set persona processes"
+              in sim_command[:21].lower()):
+          # Sets the number of worker processes that run the personas' 
+          # cognition in each step. 1 runs it in this process. 
+          # Example: set persona processes 4
+          self.persona_processes = max(1, int(sim_command.split()[-1]))
+
+        elif ("set persona nodes"
+              in sim_command[:17].lower()):
+          # Makes the persona processes worker nodes that connect to 
+          # <host>:<port> over TCP, started by hand on any machine (see 
+          # persona_workers.py), or by us if "local" is added; "off" goes 
+          # back to child processes. Addresses other than loopback ones 
+          # need a secret key in REVERIE_PERSONA_NODE_KEY. 
+          # Example: set persona nodes 0.0.0.0:8770
+          # Example: set persona nodes localhost:8770 local
+          # Example: set persona nodes off
+          args = sim_command.split()[3:]
+          if args[0].lower() == "off": 
+            self.persona_nodes_address = None
+          else: 
+            host, port = args[0].rsplit(":", 1)
+            if not is_loopback(host) and not get_persona_node_key(): 
+              raise ValueError(f"Set {PERSONA_NODE_KEY_ENV} to a secret "
+                               f"hex key to take nodes on {host}.")
+            self.persona_nodes_address = (host, int(port))
+          self.spawn_persona_nodes = args[-1].lower() == "local"
+
+        elif sim_command.lower() in ["set headless on", "set headless off"]: 
+          # Turns headless mode on or off. In headless mode, "run" does not
+          # wait for the frontend to move the personas. 
+          # Example: set headless on
+          self.headless = sim_command.lower().endswith("on")
+
+        elif sim_command.lower() in ["set cognition scheduling on", 
+                                     "set cognition scheduling off"]: 
+          # Turns cognition scheduling on or off. When on, personas in the 
+          # middle of an action skip their full cognitive chain until they 
+          # are due. 
+          # Example: set cognition scheduling off
+          self.cognition_scheduling = sim_command.lower().endswith("on")
+          self.cognition_scheduler.reset()
+
+        elif sim_command.lower() in ["set fast forward on", 
+                                     "set fast forward off"]: 
+          # Turns fast forward on or off. In headless mode, stretches of 
+          # steps in which nothing can change are then skipped in one go. 
+          # Example: set fast forward on
+          self.fast_forward = sim_command.lower().endswith("on")
+
+        elif sim_command.lower() in ["set instrumentation on", 
+                                     "set instrumentation off"]: 
+          # Turns the per-stage instrumentation on or off. While it is on, 
+          # each step's records are appended to reverie/metrics.jsonl. 
+          # Example: set instrumentation on
+          metrics.enabled = sim_command.lower().endswith("on")
+
+        elif ("set wal sync"
+              in sim_command[:12].lower()):
+          # Sets the number of steps between fsyncs of the write-ahead log. 
+          # 1 syncs every step. 
+          # Example: set wal sync 10
+          self.wal_sync_steps = max(1, int(sim_command.split()[-1]))
+
+        elif sim_command.lower() == "print instrumentation": 
+          # Prints the instrumentation totals so far as a Prometheus-style
+          # text snapshot, and saves it to reverie/metrics.prom. 
+          # Example: print instrumentation
+          ret_str += metrics.to_prometheus()
+          with open(f"{sim_folder}/reverie/metrics.prom", "w") as outfile: 
+            outfile.write(ret_str)
+
         elif ("print persona schedule" 
               in sim_command[:22].lower()): 
           # Print the decomposed schedule of the persona specified in the 
@@ -0,0 +1,209 @@
+"""
+File: step_channel.py
+Description: The backend end of the local message channel between the
+frontend server and the backend server.
+
+The frontend server's views push the environment of each step to the
+backend through this channel, and wait on it for the personas' movements of
+that step. This replaces polling for storage/<sim>/environment/<step>.json
+and storage/<sim>/movement/<step>.json; those files are still understood
+(and, by default, still written) but are no longer how the two servers
+signal each other.
+
+The frontend end lives in environment/frontend_server/translator/
+step_channel.py, and both ends must agree on STEP_CHANNEL_ADDRESS and
+STEP_CHANNEL_KEY_FILE. The channel carries pickles, so only clients that
+know the key can connect: we make up a random key for each run, and write
+it to temp_storage/<STEP_CHANNEL_KEY_FILE>, which only our user can read,
+for the frontend to pick up.
+"""
+import os
+import secrets
+import socket
+import threading
+import time
+from multiprocessing.connection import Listener
+
+STEP_CHANNEL_ADDRESS = ("localhost", 8765)
+STEP_CHANNEL_KEY_FILE = "step_channel_key"
+
+
+class StepChannel:
+  def __init__(self, sim_code, key_file, address=STEP_CHANNEL_ADDRESS):
+    # <sim_code> is the simulation this channel serves. Messages for any
+    # other simulation are refused so that the frontend falls back to files.
+    self.sim_code = sim_code
+    self.address = address
+    # <authkey> is the key the frontend authenticates with, which we write
+    # (in hex) to <key_file> once we listen.
+    self.authkey = secrets.token_bytes(32)
+    self.key_file = key_file
+
+    # <environments> holds the environments pushed by the frontend that the
+    # backend has not picked up yet, keyed by step.
+    # <movements> holds the movements the backend computed, keyed by step.
+    # Only the most recent steps are kept; see put_movement.
+    self.environments = dict()
+    self.movements = dict()
+    self.cv = threading.Condition()
+
+    self.listener = None
+    self.accept_thread = None
+    self.closed = False
+
+
+  def start(self):
+    """
+    Starts listening for the frontend server in a daemon thread.
+
+    INPUT
+      None
+    OUTPUT
+      True if the channel is listening; False if the address could not be
+      bound (in which case the servers keep signaling through files).
+    """
+    try:
+      self.listener = Listener(self.address, authkey=self.authkey)
+    except OSError as e:
+      print (f"Step channel unavailable ({e}); falling back to files.")
+      return False
+
+    try:
+      fd = os.open(self.key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                   0o600)
+      # The file may be left over from an earlier run, with other modes.
+      os.fchmod(fd, 0o600)
+      with os.fdopen(fd, "w") as outfile:
+        outfile.write(self.authkey.hex())
+    except OSError as e:
+      print (f"Step channel unavailable ({e}); falling back to files.")
+      self.listener.close()
+      self.listener = None
+      return False
+
+    self.accept_thread = threading.Thread(target=self._accept_loop,
+                                          name="reverie-step-channel",
+                                          daemon=True)
+    self.accept_thread.start()
+    return True
+
+
+  def close(self):
+    """
+    Stops listening, frees the address and removes the key file.
+    """
+    self.closed = True
+    if self.listener:
+      try:
+        os.remove(self.key_file)
+      except OSError:
+        pass
+      # The socket stays bound for as long as a thread is blocked accepting
+      # on it, even once it is closed, so we first wake the accept loop up
+      # with a connection of our own (which fails to authenticate).
+      try:
+        socket.create_connection(self.listener.address, timeout=1).close()
+      except OSError:
+        pass
+      self.accept_thread.join(timeout=5)
+      self.listener.close()
+      self.listener = None
+    with self.cv:
+      self.cv.notify_all()
+
+
+  def get_environment(self, step, timeout):
+    """
+    Waits up to <timeout> seconds for the frontend to push the environment
+    of <step>, and returns it.
+
+    INPUT
+      step: The step whose environment we are waiting for.
+      timeout: The number of seconds to wait.
+    OUTPUT
+      The environment dictionary (keyed by persona name), or None if it did
+      not arrive in time.
+    """
+    with self.cv:
+      self.cv.wait_for(lambda: step in self.environments or self.closed,
+                       timeout)
+      return self.environments.pop(step, None)
+
+
+  def put_movement(self, step, movements):
+    """
+    Publishes the movements of <step> and wakes up the frontend requests
+    waiting for them.
+
+    INPUT
+      step: The step the movements are for.
+      movements: The movements dictionary that would otherwise be written to
+                 storage/<sim>/movement/<step>.json.
+    OUTPUT
+      None
+    """
+    with self.cv:
+      self.movements[step] = movements
+      # The frontend only ever asks for the latest step (or the one before
+      # it if a response got lost), so we drop everything older.
+      for old_step in [i for i in self.movements if i < step - 1]:
+        del self.movements[old_step]
+      for old_step in [i for i in self.environments if i < step]:
+        del self.environments[old_step]
+      self.cv.notify_all()
+
+
+  def _accept_loop(self):
+    while not self.closed:
+      try:
+        conn = self.listener.accept()
+      except Exception:
+        # Either the listener was closed, or a client failed to
+        # authenticate; only the former ends the loop.
+        continue
+      threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+
+  def _serve(self, conn):
+    with conn:
+      while not self.closed:
+        try:
+          message = conn.recv()
+        except (EOFError, OSError):
+          return
+        conn.send(self._handle(message))
+
+
+  def _handle(self, message):
+    """
+    Handles one message from the frontend. Messages are dictionaries with a
+    "type" key:
+      {"type": "environment", "sim_code": ..., "step": ...,
+       "environment": {...}}
+        -> {"ok": True}
+      {"type": "movement", "sim_code": ..., "step": ..., "timeout": ...}
+        -> {"ok": True, "movement": <movements dictionary or None>}
+    Anything else gets {"ok": False}.
+    """
+    if (not isinstance(message, dict)
+        or message.get("sim_code") != self.sim_code):
+      return {"ok": False}
+
+    step = message.get("step")
+    if message.get("type") == "environment":
+      with self.cv:
+        self.environments[step] = message["environment"]
+        self.cv.notify_all()
+      return {"ok": True}
+
+    if message.get("type") == "movement":
+      deadline = time.time() + float(message.get("timeout", 0))
+      with self.cv:
+        while step not in self.movements and not self.closed:
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            break
+          self.cv.wait(remaining)
+        return {"ok": True, "movement": self.movements.get(step)}
+
+    return {"ok": False}
@@ -0,0 +1,202 @@
+"""
+File: step_log.py
+Description: A segmented, append-only log of per-step json records, used for
+a simulation's environment/ and movement/ folders.
+
+Each step's record is appended as one line of json to the current segment
+file (log_<first step>.jsonl), and its location is appended to the index
+(log.index) as a "<step> <segment> <offset> <length>" line. Reading a step
+back is then one seek into the right segment. If the same step is logged
+more than once, the last record wins. A run of steps that share one record
+(see append_range) stores it once, with an index line for each step.
+
+Simulations written before the log existed keep one <step>.json file per
+step; those are still read (and listed) as a fallback.
+
+Note: this file is kept identical in reverie/, reverie/backend_server/ and
+environment/frontend_server/, like global_methods.py.
+"""
+import json
+import os
+
+from os import listdir
+
+# <SEGMENT_BYTES> is the size after which we start a new segment file.
+# Segments other than the last one are never written to again.
+SEGMENT_BYTES = 8 * 1024 * 1024
+
+INDEX_FILE = "log.index"
+
+
+def is_sealed_segment(f):
+  """
+  Checks if <f> is a segment file of a step log that will not be written to
+  again (i.e., a later segment exists in the same folder).
+  ARGS:
+    f: path to the file.
+  RETURNS:
+    True if <f> is a sealed segment.
+  """
+  folder, file_name = os.path.split(f)
+  first_step = _get_segment_first_step(file_name)
+  if first_step is None:
+    return False
+  for i in listdir(folder):
+    i_first_step = _get_segment_first_step(i)
+    if i_first_step is not None and i_first_step > first_step:
+      return True
+  return False
+
+
+def _get_segment_first_step(file_name):
+  if not (file_name.startswith("log_") and file_name.endswith(".jsonl")):
+    return None
+  first_step = file_name[len("log_"):-len(".jsonl")]
+  if not first_step.isdigit():
+    return None
+  return int(first_step)
+
+
+class StepLog:
+  def __init__(self, folder):
+    # <folder> is the folder the log lives in, e.g., storage/<sim>/movement
+    self.folder = folder
+
+    # <index> maps each logged step to its (segment, offset, length).
+    # <index_offset> is how far into log.index we have read; the log can be
+    # appended to by another process, so we read new index lines as needed.
+    self.index = dict()
+    self.index_offset = 0
+    # <segment> is the segment file we append to, and <segment_file> its
+    # open handle (opened on the first append).
+    self.segment = None
+    self.segment_file = None
+    self.index_file = None
+
+    self._read_index()
+
+
+  def _read_index(self):
+    f_index = f"{self.folder}/{INDEX_FILE}"
+    if not os.path.exists(f_index):
+      return
+    with open(f_index, "rb") as index_file:
+      index_file.seek(self.index_offset)
+      data = index_file.read()
+
+    # Only complete lines count; the writer may be in the middle of one.
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].decode().splitlines():
+      step, segment, offset, length = line.split()
+      self.index[int(step)] = (segment, int(offset), int(length))
+      self.segment = segment
+    self.index_offset += end
+
+
+  def append(self, step, record):
+    """
+    Appends the record of <step> to the log.
+    ARGS:
+      step: the step the record is for.
+      record: json serializable record (e.g., the movements of the step).
+    RETURNS:
+      None
+    """
+    self.append_range(step, step, record)
+
+
+  def append_range(self, first_step, last_step, record):
+    """
+    Appends one record that stands for every step from <first_step> to
+    <last_step> (inclusive). It is written once, and each of the steps gets
+    an index line pointing at it, so reading any of them returns it.
+    ARGS:
+      first_step: the first step the record is for.
+      last_step: the last step the record is for.
+      record: json serializable record.
+    RETURNS:
+      None
+    """
+    self._read_index()
+    if self.segment_file is None:
+      os.makedirs(self.folder, exist_ok=True)
+      if self.segment is None:
+        self.segment = f"log_{str(first_step)}.jsonl"
+      self.segment_file = open(f"{self.folder}/{self.segment}", "ab")
+      self.index_file = open(f"{self.folder}/{INDEX_FILE}", "ab")
+
+    offset = self.segment_file.tell()
+    if offset >= SEGMENT_BYTES:
+      self.segment_file.close()
+      self.segment = f"log_{str(first_step)}.jsonl"
+      self.segment_file = open(f"{self.folder}/{self.segment}", "ab")
+      offset = self.segment_file.tell()
+
+    data = (json.dumps(record) + "\n").encode()
+    self.segment_file.write(data)
+    self.segment_file.flush()
+
+    index_lines = ""
+    for i in range(first_step, last_step + 1):
+      index_lines += (f"{str(i)} {self.segment} {str(offset)} "
+                      f"{str(len(data))}\n")
+      self.index[i] = (self.segment, offset, len(data))
+    self.index_file.write(index_lines.encode())
+    self.index_file.flush()
+    self.index_offset += len(index_lines)
+
+
+  def read(self, step):
+    """
+    Reads the record of <step> back.
+    ARGS:
+      step: the step to read.
+    RETURNS:
+      The record, or None if the step is not logged.
+    """
+    if step not in self.index:
+      self._read_index()
+
+    if step in self.index:
+      segment, offset, length = self.index[step]
+      with open(f"{self.folder}/{segment}", "rb") as segment_file:
+        segment_file.seek(offset)
+        return json.loads(segment_file.read(length))
+
+    f_step = f"{self.folder}/{str(step)}.json"
+    if os.path.exists(f_step):
+      with open(f_step) as json_file:
+        return json.load(json_file)
+    return None
+
+
+  def steps(self):
+    """
+    Returns all logged steps (including the legacy <step>.json files) in
+    ascending order.
+    """
+    self._read_index()
+    steps = set(self.index.keys())
+    if os.path.exists(self.folder):
+      for i in listdir(self.folder):
+        if i.endswith(".json") and i[:-len(".json")].isdigit():
+          steps.add(int(i[:-len(".json")]))
+    return sorted(steps)
+
+
+  def last_step(self):
+    """
+    Returns the latest logged step, or None if the log is empty.
+    """
+    steps = self.steps()
+    if not steps:
+      return None
+    return steps[-1]
+
+
+  def close(self):
+    if self.segment_file:
+      self.segment_file.close()
+      self.index_file.close()
+    self.segment_file = None
+    self.index_file = None
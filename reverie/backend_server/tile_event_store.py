@@ -0,0 +1,164 @@
+"""
+File: tile_event_store.py
+Description: Defines the TileEventStore class, which holds the events taking
+place on the tiles of a Maze.
+
+Events are (subject, predicate, object, description) tuples, e.g.,
+("Isabella Rodriguez", "is", "idle", "idle") for a persona, or
+("the Ville:Hobbs Cafe:cafe:refrigerator", None, None, None) for a game
+object that is not in use. Besides the events of each tile, the store
+indexes them by subject, by event and by arena, so that moving an event
+around, or asking where a subject is or what happens in an arena, takes
+time proportional to the events involved rather than to the tiles or the
+events on them.
+"""
+
+# <EMPTY_EVENTS> is what TileEventStore.get returns for a tile without
+# events.
+EMPTY_EVENTS = frozenset()
+
+
+class TileEventStore:
+  def __init__(self, arena_grid):
+    # <arena_grid> is the arena path id of each tile, as nested lists
+    # indexed [y][x] (see Maze.path_grids), which are quicker to index one
+    # tile at a time than the numpy grid.
+    self.arena_grid = arena_grid.tolist()
+    # <tile_events> holds the set of all events taking place in each tile,
+    # keyed by the tile's (x, y) coordinate. Tiles that never had an event
+    # are left out.
+    # e.g., self.tile_events[(58, 9)] =
+    #         {('double studio:double studio:bedroom 2:bed', None, None,
+    #           None)}
+    self.tile_events = dict()
+    # <subject_events> holds, for each subject, its events on each tile:
+    # {subject: {tile: set of events}}.
+    # <event_tiles> holds the tiles each event is on: {event: set of tiles}.
+    # <arena_events> holds the tiles each event is on in each arena:
+    # {arena path id: {event: set of tiles}}.
+    self.subject_events = dict()
+    self.event_tiles = dict()
+    self.arena_events = dict()
+
+
+  def get(self, tile):
+    """
+    Returns the set of events taking place on <tile> (which must not be
+    changed directly).
+    """
+    return self.tile_events.get((tile[0], tile[1]), EMPTY_EVENTS)
+
+
+  def get_subject_tiles(self, subject):
+    """
+    Returns the tiles <subject> has events on.
+    """
+    return list(self.subject_events.get(subject, dict()).keys())
+
+
+  def get_event_tiles(self, event):
+    """
+    Returns the tiles <event> is on.
+    """
+    return list(self.event_tiles.get(event, set()))
+
+
+  def get_arena_events(self, arena_id):
+    """
+    Returns the events taking place in the arena with the arena path id
+    <arena_id> (see Maze.path_grids), as a dictionary of the tiles each
+    event is on there (which must not be changed directly).
+    """
+    return self.arena_events.get(arena_id, dict())
+
+
+  def add(self, event, tile):
+    """
+    Adds <event> to <tile>.
+    """
+    tile = (tile[0], tile[1])
+    if tile in self.tile_events:
+      events = self.tile_events[tile]
+      if event in events:
+        return
+      events.add(event)
+    else:
+      self.tile_events[tile] = set([event])
+
+    self.subject_events.setdefault(event[0], dict()).setdefault(
+      tile, set()).add(event)
+    self.event_tiles.setdefault(event, set()).add(tile)
+    self.arena_events.setdefault(self._get_arena_id(tile), dict()).setdefault(
+      event, set()).add(tile)
+
+
+  def remove(self, event, tile):
+    """
+    Removes <event> from <tile>, if it is there.
+    """
+    tile = (tile[0], tile[1])
+    events = self.tile_events.get(tile)
+    if not events or event not in events:
+      return
+    events.remove(event)
+
+    subject_tiles = self.subject_events[event[0]]
+    subject_tiles[tile].remove(event)
+    if not subject_tiles[tile]:
+      del subject_tiles[tile]
+      if not subject_tiles:
+        del self.subject_events[event[0]]
+    event_tiles = self.event_tiles[event]
+    event_tiles.remove(tile)
+    if not event_tiles:
+      del self.event_tiles[event]
+    arena_id = self._get_arena_id(tile)
+    arena_events = self.arena_events[arena_id]
+    arena_events[event].remove(tile)
+    if not arena_events[event]:
+      del arena_events[event]
+      if not arena_events:
+        del self.arena_events[arena_id]
+
+
+  def turn_idle(self, event, tile):
+    """
+    Replaces <event> on <tile>, if it is there, with its idle form: the
+    same subject with no predicate, object or description.
+    """
+    events = self.tile_events.get((tile[0], tile[1]))
+    if events and event in events:
+      self.remove(event, tile)
+      self.add((event[0], None, None, None), tile)
+
+
+  def remove_subject(self, subject, tile):
+    """
+    Removes every event of <subject> from <tile>.
+    """
+    tile = (tile[0], tile[1])
+    subject_tiles = self.subject_events.get(subject, dict())
+    for event in list(subject_tiles.get(tile, [])):
+      self.remove(event, tile)
+
+
+  def items(self):
+    """
+    Returns (tile, set of events) pairs for every tile with events.
+    """
+    return [(tile, events) for tile, events in self.tile_events.items()
+            if events]
+
+
+  def clear(self):
+    """
+    Removes every event.
+    """
+    self.tile_events = dict()
+    self.subject_events = dict()
+    self.event_tiles = dict()
+    self.arena_events = dict()
+
+
+  def _get_arena_id(self, tile):
+    return self.arena_grid[tile[1]][tile[0]]